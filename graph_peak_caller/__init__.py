@@ -1 +1,19 @@
-from .callpeaks import CallPeaks, Configuration, CallPeaksFromQvalues
\ No newline at end of file
+import importlib
+
+# Imported on first use (PEP 562), so that importing a submodule, e.g.
+# the command line interface, does not import numpy and scipy
+_lazy_attributes = {"CallPeaks": ".callpeaks",
+                    "Configuration": ".callpeaks",
+                    "CallPeaksFromQvalues": ".callpeaks",
+                    "call_peaks": ".api"}
+
+
+def __getattr__(name):
+    if name not in _lazy_attributes:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return getattr(importlib.import_module(_lazy_attributes[name], __name__),
+                   name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_attributes))
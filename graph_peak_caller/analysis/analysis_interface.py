@@ -1,5 +1,6 @@
 import numpy as np
 import logging
+import os
 from collections import Counter
 from itertools import chain
 import offsetbasedgraph as obg
@@ -13,12 +14,16 @@ from .analyse_peaks import LinearRegion
 from .differentialbinding import main, MotifLocation
 from .fimowrapper import FimoFile
 from ..peakcollection import Peak, PeakCollection
+from ..peakarrays import PeakArrays
+from ..linearreads import LinearPathIndex, LinearReadsConverter
+from ..sparsesummits import cut_around_summits, get_summit_positions
 from .nongraphpeaks import NonGraphPeakCollection
 from .motifenrichment import plot_true_positives
-from ..peakfasta import PeakFasta
+from ..peakfasta import PeakFasta, merge_peak_fasta_files
 from ..mindense import DensePileup
 from ..sparsediffs import SparseValues, SparseDiffs
 from ..intervals import UniqueIntervals
+from .. import resources
 from .util import create_linear_path
 from .genotype_matrix import VariantList
 from .haplotype_finder import Main, VariantPrecence
@@ -260,51 +265,21 @@ def concatenate_sequence_files(args):
     else:
         file_endings = "_sequences.fasta"
 
-    all_fasta_entries = []
+    fasta_file_names = []
     for chromosome in chromosomes:
-        print("Processing chromosome %s" % chromosome)
-
         if args.use_input_file_pattern is not None:
             assert "[chrom]" in args.use_input_file_pattern, \
                 "Use [chrom] to specify where chromosome should be replaced."
-            try:
-                fasta_file = open(args.use_input_file_pattern.replace("[chrom]", chromosome))
-            except FileNotFoundError:
+            fasta_file_name = args.use_input_file_pattern.replace("[chrom]", chromosome)
+            if not os.path.isfile(fasta_file_name):
                 logging.info("Did not find file matching patterh %s. Does those files exist?" % args.use_input_file_pattern)
-                raise
+                raise FileNotFoundError(fasta_file_name)
         else:
             logging.info("Guessing file name since use_input_file_pattern is not specified")
-            fasta_file = open(chromosome + file_endings)
-
-        for line in fasta_file:
-            if line.startswith(">"):
-                all_fasta_entries.append([line, None])
-            else:
-                # This is sequence, add to prev entry
-                all_fasta_entries[-1][1] = line
-        fasta_file.close()
-
-    peaks = []
-    for fasta_entry in all_fasta_entries:
-        header = fasta_entry[0].rstrip()
-        sequence = fasta_entry[1].rstrip()
-
-        interval_json = "{%s" % header.split(" {")[1]
-        interval = Peak.from_file_line(interval_json)
-        interval.sequence = sequence
-        peaks.append(interval)
-
-    peaks = sorted(peaks, key=lambda s: -s.score)
-    out_fasta = open(out_file_name, "w")
-    out_intervalcollection = open(out_file_name_json, "w")
-    i = 0
-    for peak in peaks:
-        out_fasta.writelines([">peak%d %s\n" % (i, peak.to_file_line())])
-        out_fasta.writelines(["%s\n" % peak.sequence])
-        out_intervalcollection.writelines(["%s\n" % peak.to_file_line()])
-        i += 1
-    out_fasta.close()
-    out_intervalcollection.close()
+            fasta_file_name = chromosome + file_endings
+        fasta_file_names.append(fasta_file_name)
+
+    merge_peak_fasta_files(fasta_file_names, out_file_name, out_file_name_json)
 
     logging.info("Wrote all peaks in sorted order to %s" % out_file_name)
     logging.info("Wrote all peaks in sorted order to %s" % out_file_name_json)
@@ -312,19 +287,14 @@ def concatenate_sequence_files(args):
 
 def split_peaks_by_chromosome(args):
     chromosomes = args.chromosomes.split(",")
-    peaks = PeakCollection.from_file(args.in_file_name, text_file=True)
+    peaks = PeakArrays.from_intervalcollection_file(args.in_file_name)
 
-    out_peaks = {chrom: [] for chrom in chromosomes}
-    #out_files = {chrom: open(chrom + "_" + args.out_file_name_ending) for chrom in chromosomes}
-
-    for peak in peaks:
-        if peak.chromosome in chromosomes:
-            out_peaks[peak.chromosome].append(peak)
-        else:
-            logging.warning("Found peak %s that has a chromosome which is not in list of chromosomes %s" % (peak, chromosomes))
+    unknown = set(peaks.chromosome_names) - set(chromosomes)
+    if unknown or np.any(peaks.chromosome_codes < 0):
+        logging.warning("Found peaks with chromosomes %s which are not in list of chromosomes %s" % (unknown, chromosomes))
 
     for chrom in chromosomes:
-        PeakCollection(out_peaks[chrom]).to_file(chrom + "_" + args.out_file_name_ending, text_file=True)
+        peaks.get_chromosome(chrom).to_files(chrom + "_" + args.out_file_name_ending)
 
 
 def find_linear_path(args):
@@ -339,90 +309,63 @@ def find_linear_path(args):
 
 def move_linear_reads_to_graph(args):
     chromosomes = args.chromosomes.split(",")
-    chrom_lookup = set(chromosomes)
-    graphs = {}
-    out_files = {}
-    linear_paths = {} 
-    linear_path_file_name = args.data_dir + "/" + chrom + "_linear_pathv2.interval"
-    #if args.linear_path_file_name is not None:
-    #linear_path_file_name = args.linear_path_file_name
-
+    path_indexes = {}
     for chrom in chromosomes:
-        linear_paths[chrom] = obg.NumpyIndexedInterval.from_file(linear_path_file_name)
-        graphs[chrom] = obg.Graph.from_numpy_file(args.data_dir + "/" + chrom + ".nobg")
-        out_files[chrom] = open(args.out_files_base_name + "_" + chrom + ".intervalcollection", "w")
-
-    bedfile = open(args.bed_file_name, "r")
-    i = 0
-    for line in bedfile:
-        if i % 100000 == 0:
-            logging.info("%d reads processed" % i)
-        i += 1
-        line = line.split()
-        is_reverse = line[5] == "-"
-        chrom = line[0].replace("chr", "")
-        if chrom not in chrom_lookup:
-            continue
-        start = int(line[1])
-        end = int(line[2])
-        graph_interval = linear_paths[chrom].get_exact_subinterval(start, end)
-        graph_interval.graph = graphs[chrom]
-
-        if is_reverse:
-            graph_interval = graph_interval.get_reverse()
-            assert graph_interval.region_paths[0] < 0
-        out_files[chrom].writelines(["%s\n" % graph_interval.to_file_line()])
+        linear_path = resources.get_linear_path(
+            args.data_dir + "/" + chrom + "_linear_pathv2.interval")
+        graph = resources.get_graph(args.data_dir + "/" + chrom + ".nobg")
+        path_indexes[chrom] = LinearPathIndex.from_linear_path(
+            linear_path, graph)
 
-    for chrom in chromosomes:
-        out_files[chrom].close()
+    n_processes = 1 if args.n_processes is None else int(args.n_processes)
+    converter = LinearReadsConverter(path_indexes, n_processes=n_processes)
+    converter.convert(args.bed_file_name, args.out_files_base_name)
 
 
 def peaks_to_linear(args):
     # Get approximate linear position of peaks using a linear path
-    linear_path = obg.NumpyIndexedInterval.from_file(args.linear_path_file_name)
-    peaks = PeakCollection.from_file(args.peaks_file_name, text_file=True)
-    linear_peaks = peaks.to_approx_linear_peaks(linear_path, args.chromosome)
-    linear_peaks.to_bed_file(args.out_file_name)
+    linear_path = resources.get_linear_path(args.linear_path_file_name)
+    peaks = PeakArrays.from_intervalcollection_file(args.peaks_file_name)
+    peaks.to_approx_linear_bed_file(args.out_file_name, linear_path,
+                                    args.chromosome)
+
+
+def _get_summit_window(args):
+    if args.window_size is not None:
+        return int(args.window_size)
+    window = 60
+    logging.warning("Using default window size %d when cutting peaks around summits." % window)
+    return window
 
 
 def get_summits(args):
     graph = args.graph
-    qvalues = SparseDiffs.from_sparse_files(args.q_values_base_name)
-    #qvalues = SparseValues.from_sparse_files(args.q_values_base_name)
-    dense_qvalues = qvalues.to_dense_pileup(size=graph.number_of_basepairs())
-    qvalues = DensePileup(graph, dense_qvalues)
+    qvalues = SparseValues.from_sparse_files(args.q_values_base_name)
     logging.info("Q values fetched")
     peaks = PeakCollection.from_fasta_file(args.peaks_fasta_file, graph)
-
-    if args.window_size is not None:
-        window = int(args.window_size)
-    else:
-        window = 60
-        logging.warning("Using default window size %d when cutting peaks around summits." % window)
-
-    peaks.cut_around_summit(qvalues, n_base_pairs_around=window)
+    window = _get_summit_window(args)
+    summits = cut_around_summits(PeakArrays.from_peaks(peaks), qvalues,
+                                 graph, n_base_pairs_around=window)
     out_file_name = args.peaks_fasta_file.split(".")[0] + "_summits.fasta"
-    peaks.to_fasta_file(out_file_name, args.sequence_graph)
+    summits.to_peak_collection().to_fasta_file(out_file_name,
+                                               args.sequence_graph)
     logging.info("Wrote summits to " + out_file_name)
 
+
 def get_super_summits(args):
     graph = args.graph
-    qvalues = SparseDiffs.from_sparse_files(args.q_values_base_name)
-    #qvalues = SparseValues.from_sparse_files(args.q_values_base_name)
-    dense_qvalues = qvalues.to_dense_pileup(size=graph.number_of_basepairs())
-    qvalues = DensePileup(graph, dense_qvalues)
+    qvalues = SparseValues.from_sparse_files(args.q_values_base_name)
     logging.info("Q values fetched")
     peaks = PeakCollection.from_fasta_file(args.peaks_fasta_file, graph)
-
-    if args.window_size is not None:
-        window = int(args.window_size)
-    else:
-        window = 60
-        logging.warning("Using default window size %d when cutting peaks around summits." % window)
+    window = _get_summit_window(args)
 
     from offsetbasedgraph import NumpyIndexedInterval
     linear_ref = NumpyIndexedInterval.from_file(args.linear_ref)
-    peaks.cut_around_summit_super(qvalues, linear_ref, n_base_pairs_around=window)
+    summit_positions, _ = get_summit_positions(
+        PeakArrays.from_peaks(peaks), qvalues, graph)
+    peaks.intervals = [
+        peak.get_superinterval(int(summit), window, linear_ref)
+        for peak, summit in zip(peaks.intervals, summit_positions)]
     out_file_name = args.peaks_fasta_file.split(".")[0] + "_summits.fasta"
     peaks.to_fasta_file(out_file_name, args.sequence_graph)
     logging.info("Wrote summits to " + out_file_name)
@@ -569,7 +512,7 @@ def plot_motif_enrichment(args):
 
 def peaks_to_fasta(args):
     logging.info("Getting sequence retriever")
-    retriever = obg.SequenceGraph.from_file(args.sequence_graph)
+    retriever = resources.get_sequence_graph(args.sequence_graph)
     logging.info("Getting intervals")
     intervals = PeakCollection.create_generator_from_file(
         args.intervals_file_name)
@@ -0,0 +1,85 @@
+"""Peak calling from Python, without reading or writing files.
+
+    from graph_peak_caller.api import call_peaks, AlignmentArrays
+    reads = AlignmentArrays(starts, ends, region_paths, region_path_indptr)
+    peaks = call_peaks(graph, reads, config=config)
+
+See call_peaks for details.
+"""
+from . import resources
+from .callpeaks import CallPeaks, Configuration
+from .control.linearmap import LinearMap
+from .intervals import Intervals, UniqueIntervals
+from .linearprojection import AlignmentArrays
+from .peakarrays import PeakArrays
+from .reporter import Reporter
+
+
+class CallbackReporter(Reporter):
+    """Reporter that by default writes nothing, and passes each result
+    to callback(name, data) when it is added"""
+
+    def __init__(self, base_name="", compact=False, chunked=False,
+                 write_files=False, write_behind=False, callback=None):
+        super().__init__(base_name, compact, chunked, write_files,
+                         write_behind)
+        self._callback = callback
+
+    def add(self, name, data):
+        super().add(name, data)
+        if self._callback is not None:
+            self._callback(self._base_name + name, data)
+
+    def get_sub_reporter(self, name):
+        sub_reporter = super().get_sub_reporter(name)
+        sub_reporter._callback = self._callback
+        return sub_reporter
+
+
+def get_intervals(reads, graph, keep_duplicates=False):
+    """Intervals for reads given as AlignmentArrays or intervals"""
+    if isinstance(reads, AlignmentArrays):
+        reads = reads.to_intervals(graph)
+    reads = list(reads)
+    if keep_duplicates:
+        return Intervals(reads)
+    return UniqueIntervals(reads)
+
+
+def call_peaks(graph, sample_reads, control_reads=None, config=None,
+               linear_map=None, callback=None, chromosome=None):
+    """Call peaks on one graph, keeping all results in memory.
+
+    graph is a graph with numpy backend, or the file name of one.
+    Reads are AlignmentArrays or lists of intervals. Without
+    control_reads, the sample is used as control. linear_map is a
+    LinearMap (or file name), created from the graph if not given.
+    If callback is given, callback(name, data) is called with each
+    result (e.g. "fragment_pileup", "pvalues", "qvalues", "max_paths")
+    when it is computed. With several q value cutoffs, the names of
+    results for each cutoff start with q<cutoff>_.
+
+    Returns the peaks for config.q_values_threshold as PeakArrays,
+    sorted by score"""
+    if isinstance(graph, str):
+        graph = resources.get_graph(graph)
+    config = Configuration() if config is None else config.copy()
+    config.has_control = control_reads is not None
+    if linear_map is None:
+        linear_map = LinearMap.from_graph(graph)
+    elif isinstance(linear_map, str):
+        linear_map = resources.get_linear_map(linear_map, graph)
+    config.linear_map_name = linear_map
+
+    sample = get_intervals(sample_reads, graph, config.keep_duplicates)
+    if control_reads is None:
+        control = sample.__class__(sample._intervals)
+    else:
+        control = get_intervals(control_reads, graph, config.keep_duplicates)
+
+    caller = CallPeaks(graph, config, CallbackReporter(callback=callback))
+    caller.run_to_p_values(sample, control)
+    caller.get_p_to_q_values_mapping()
+    caller.get_q_values()
+    caller.call_peaks_from_q_values(chromosome=chromosome)
+    return PeakArrays.from_peaks(caller.max_path_peaks)
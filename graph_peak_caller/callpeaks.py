@@ -6,7 +6,6 @@ from .control import get_background_track_from_control,\
     get_background_track_from_input, scale_tracks
 from .sparsepvalues import PValuesFinder, PToQValuesMapper, QValuesFinder
 from .postprocess import HolesCleaner, SparseMaxPaths
-from .sparsediffs import SparseValues
 import json
 import sys
 
@@ -18,18 +17,44 @@ class Configuration:
         self.linear_map_name = None
         self.has_control = False
         self.q_values_threshold = 0.05
+        self.q_values_thresholds = None
         self.global_min = None
         self.keep_duplicates = False
+        self.background_cache_dir = None
+        self.background_cache_size = 20*1024**3
+        self.compact_tracks = False
+        self.chunked_tracks = False
+        self.window_size = None
+        self.halo_size = None
+        self.memory_limit = None
+        self.memory_history = None
+        self.prefetch_depth = 0
+        self.pileup_processes = 1
+        self.write_behind = False
+        self.handoff_memory = 2*1024**3
 
     def copy(self):
         o = Configuration()
         o.read_length = self.read_length
         o.fragment_length = self.fragment_length
-        o.linar_map_name = self.linear_map_name
+        o.linear_map_name = self.linear_map_name
         o.has_control = self.has_control
         o.q_values_threshold = self.q_values_threshold
+        o.q_values_thresholds = self.q_values_thresholds
         o.global_min = self.global_min
         o.keep_duplicates = self.keep_duplicates
+        o.background_cache_dir = self.background_cache_dir
+        o.background_cache_size = self.background_cache_size
+        o.compact_tracks = self.compact_tracks
+        o.chunked_tracks = self.chunked_tracks
+        o.window_size = self.window_size
+        o.halo_size = self.halo_size
+        o.memory_limit = self.memory_limit
+        o.memory_history = self.memory_history
+        o.prefetch_depth = self.prefetch_depth
+        o.pileup_processes = self.pileup_processes
+        o.write_behind = self.write_behind
+        o.handoff_memory = self.handoff_memory
         return o
 
 
@@ -44,7 +69,7 @@ class CallPeaks(object):
         self._reporter = reporter
         self.variant_maps = variant_maps
 
-    def run_pre_callpeaks(self, input_reads, control_reads):
+    def run_pre_callpeaks(self, input_reads, control_reads, background=None):
         try:
             sample_pileup = get_fragment_pileup(
                 self.graph, input_reads, self.config,
@@ -57,13 +82,18 @@ class CallPeaks(object):
                              "Turn on debugging (--verbose 2) for more debug info.")
             sys.exit(1)
 
-        if not self.config.has_control:
-            background_func = get_background_track_from_input
-        control_pileup = background_func(self.graph, control_reads,
-                                         self.config,
-                                         sample_pileup.touched_nodes)
+        if background is not None:
+            control_pileup = background.get_track(sample_pileup.touched_nodes)
+            n_control_reads = background.n_reads
+        else:
+            if not self.config.has_control:
+                background_func = get_background_track_from_input
+            control_pileup = background_func(self.graph, control_reads,
+                                             self.config,
+                                             sample_pileup.touched_nodes)
+            n_control_reads = control_reads.n_reads
         scale_tracks(sample_pileup, control_pileup,
-                     input_reads.n_reads/control_reads.n_reads)
+                     input_reads.n_reads/n_control_reads)
 
         self._reporter.add("fragment_pileup", sample_pileup)
         self._reporter.add("touched_nodes", sample_pileup.touched_nodes)
@@ -99,7 +129,7 @@ class CallPeaks(object):
         self.q_values_pileup.track_size = self.p_values_pileup.track_size
         self._reporter.add("qvalues", self.q_values_pileup)
 
-    def call_peaks_from_q_values(self, linear_path=None):
+    def call_peaks_from_q_values(self, linear_path=None, chromosome=None):
         assert self.q_values_pileup is not None
         caller = CallPeaksFromQvalues(
             self.graph, self.q_values_pileup,
@@ -107,10 +137,14 @@ class CallPeaks(object):
             touched_nodes=self.touched_nodes,
             config=self.config,
             linear_path=linear_path,
-            variant_maps=self.variant_maps
+            variant_maps=self.variant_maps,
+            chromosome=chromosome
             )
         caller.callpeaks()
         self.max_path_peaks = caller.max_paths
+        self.peak_sets = [(caller.get_reporter(cutoff),
+                           caller.max_paths_by_cutoff[cutoff])
+                          for cutoff in caller.cutoffs]
 
     def run(self, input_intervals, control_intervals):
         self.run_to_p_values(input_intervals, control_intervals)
@@ -118,8 +152,9 @@ class CallPeaks(object):
         self.get_q_values()
         self.call_peaks_from_q_values()
 
-    def run_to_p_values(self, input_intervals, control_intervals):
-        self.run_pre_callpeaks(input_intervals, control_intervals)
+    def run_to_p_values(self, input_intervals, control_intervals,
+                        background=None):
+        self.run_pre_callpeaks(input_intervals, control_intervals, background)
         self.get_p_values()
 
 
@@ -127,7 +162,8 @@ class CallPeaksFromQvalues:
     def __init__(self, graph, q_values_pileup,
                  experiment_info, reporter,
                  cutoff=0.1, raw_pileup=None, touched_nodes=None,
-                 config=None, q_values_max_path=False, linear_path=None, variant_maps=None):
+                 config=None, q_values_max_path=False, linear_path=None, variant_maps=None,
+                 chromosome=None, cutoffs=None):
 
         self.graph = graph
         self.q_values = q_values_pileup
@@ -140,20 +176,38 @@ class CallPeaksFromQvalues:
         self.q_values_max_path = q_values_max_path
         self.linear_path = linear_path
         self.variant_maps = variant_maps
+        self.chromosome = chromosome
+        if chromosome is None:
+            self.chromosome = reporter._base_name.replace("_", "")
 
         if config is not None:
             self.cutoff = config.q_values_threshold
+            if cutoffs is None:
+                cutoffs = config.q_values_thresholds
+        self.cutoffs = [self.cutoff] if not cutoffs else list(cutoffs)
         self._reporter = reporter
+        self._dense_q_values = None
+        self.max_paths_by_cutoff = {}
+        self.all_max_paths_by_cutoff = {}
+        self.sub_graphs_by_cutoff = {}
         # self.info.to_file(self.out_file_base_name + "experiment_info.pickle")
-        logging.info("Using q value cutoff %.4f" % self.cutoff)
-
-    def __threshold(self):
-        threshold = -np.log10(self.cutoff)
+        logging.info("Using q value cutoffs %s" % ", ".join(
+            "%.4f" % cutoff for cutoff in self.cutoffs))
+
+    def get_reporter(self, cutoff):
+        """Reporter for the results of one cutoff. With several
+        cutoffs, files are prefixed with q<cutoff>_"""
+        if len(self.cutoffs) == 1:
+            return self._reporter
+        return self._reporter.get_sub_reporter("q%g" % cutoff)
+
+    def __threshold(self, cutoff, reporter):
+        threshold = -np.log10(cutoff)
         logging.info("Thresholding peaks on q value %.4f" % threshold)
         self.pre_processed_peaks = self.q_values.threshold_copy(threshold)
-        self._reporter.add("thresholded", self.pre_processed_peaks)
+        reporter.add("thresholded", self.pre_processed_peaks)
 
-    def __postprocess(self):
+    def __postprocess(self, reporter):
         logging.info("Filling small Holes")
         self.pre_processed_peaks = HolesCleaner(
             self.graph,
@@ -161,31 +215,42 @@ class CallPeaksFromQvalues:
             self.info.read_length,
             self.touched_nodes
         ).run()
-        self._reporter.add("hole_cleaned", self.pre_processed_peaks)
+        reporter.add("hole_cleaned", self.pre_processed_peaks)
         self.filtered_peaks = self.pre_processed_peaks
 
-    def __get_max_paths(self):
+    @staticmethod
+    def __same_areas(thresholded, other):
+        return np.array_equal(thresholded.indices, other.indices) and \
+            np.array_equal(thresholded.values, other.values)
+
+    def __get_pileup(self):
+        if self.q_values_max_path:
+            return self.q_values
+        if self.raw_pileup is None:
+            self.raw_pileup = self._reporter.get("direct_pileup")
+        return self.raw_pileup
+
+    def __get_dense_q_values(self):
+        if self._dense_q_values is None:
+            self._dense_q_values = DensePileup(
+                self.graph, self.q_values.to_dense_pileup(
+                    self.graph.node_indexes[-1]))
+        return self._dense_q_values
+
+    def __get_max_paths(self, reporter):
         logging.info("Getting maxpaths")
-        if not self.q_values_max_path:
-            file_name = self._reporter._base_name+"direct_pileup"
-            logging.info("Reading raw direct pileup from file %s" % file_name)
-            _pileup = SparseValues.from_sparse_files(file_name)
-            self.raw_pileup = _pileup
-        else:
-            # raise NotImplementedError()
-            _pileup = self.q_values
+        _pileup = self.__get_pileup()
 
         assert(self.graph.uses_numpy_backend)
         logging.info("Running Sparse Max Paths")
         max_paths, sub_graphs = SparseMaxPaths(
             self.filtered_peaks, self.graph, _pileup, self.variant_maps).run()
 
-        self._reporter.add("all_max_paths", max_paths)
+        self.all_max_paths = max_paths
+        reporter.add("all_max_paths", max_paths)
         logging.info("All max paths found")
 
-        self.q_values = DensePileup(
-            self.graph, self.q_values.to_dense_pileup(
-                self.graph.node_indexes[-1]))
+        q_values = self.__get_dense_q_values()
 
         for max_path in max_paths:
             assert max_path.length() >= 0, "Max path %s has negative length" % max_path
@@ -194,9 +259,9 @@ class CallPeaksFromQvalues:
                 max_path.set_score(0)
                 continue
 
-            score = np.max(self.q_values.get_interval_values(max_path))
-            max_path.set_score(score)
-            max_path.chromosome = self._reporter._base_name.replace("_", "")
+            score = np.max(q_values.get_interval_values(max_path))
+            max_path.set_score(float(score))
+            max_path.chromosome = self.chromosome
             assert not np.isnan(score), "Score %s is nan" % score
 
 
@@ -207,13 +272,36 @@ class CallPeaksFromQvalues:
         pairs = [p for p in pairs if
                  p[0].length() >= self.info.fragment_length]
         logging.info("N filtered peaks: %s", len(pairs))
-        self._reporter.add("sub_graphs", [pair[1] for pair in pairs])
+        self.sub_graphs = [pair[1] for pair in pairs]
+        reporter.add("sub_graphs", self.sub_graphs)
         self.max_paths = [p[0] for p in pairs]
-        self._reporter.add("max_paths", self.max_paths)
+        reporter.add("max_paths", self.max_paths)
 
     def callpeaks(self):
+        """Call peaks for each cutoff. Cutoffs are run from the least
+        to the most strict. Each cutoff is called separately, but when
+        a stricter cutoff thresholds to the same areas as the previous
+        one (e.g. no q values between them, or no peak areas left), the
+        previous results are reused"""
         logging.info("Calling peaks")
-        self.__threshold()
-        self.__postprocess()
-        self.__get_max_paths()
-
+        previous = None
+        for cutoff in sorted(self.cutoffs, reverse=True):
+            reporter = self.get_reporter(cutoff)
+            self.__threshold(cutoff, reporter)
+            thresholded = self.pre_processed_peaks
+            if previous is not None and self.__same_areas(
+                    thresholded, previous):
+                logging.info("Same peak areas for q value cutoff %s as "
+                             "for the previous cutoff", cutoff)
+                reporter.add("hole_cleaned", self.filtered_peaks)
+                reporter.add("all_max_paths", self.all_max_paths)
+                reporter.add("sub_graphs", self.sub_graphs)
+                reporter.add("max_paths", self.max_paths)
+            else:
+                self.__postprocess(reporter)
+                self.__get_max_paths(reporter)
+            previous = thresholded
+            self.max_paths_by_cutoff[cutoff] = self.max_paths
+            self.all_max_paths_by_cutoff[cutoff] = self.all_max_paths
+            self.sub_graphs_by_cutoff[cutoff] = self.sub_graphs
+        self.max_paths = self.max_paths_by_cutoff[self.cutoffs[0]]
@@ -6,10 +6,12 @@ import offsetbasedgraph as obg
 from pyvg.conversion import vg_json_file_to_interval_collection
 
 from . import Configuration, CallPeaks
-from .multiplegraphscallpeaks import MultipleGraphsCallpeaks
+from .multiplegraphscallpeaks import MultipleGraphsCallpeaks, \
+    MultipleSamplesCallpeaks
 from .util import create_linear_map
 from .peakfasta import PeakFasta
 from .reporter import Reporter
+from . import resources
 from .intervals import UniqueIntervals
 from .shiftestimation import MultiGraphShiftEstimator
 import sys
@@ -39,6 +41,83 @@ def get_confiugration(args):
     return config
 
 
+def set_q_value_thresholds(config, q_threshold):
+    """Set one or more (comma separated) q-value thresholds"""
+    if q_threshold is None:
+        logging.info("Q value threshold not set. Running with default 0.05.")
+        return
+    thresholds = [float(q) for q in str(q_threshold).split(",")]
+    config.q_values_threshold = thresholds[0]
+    if len(thresholds) > 1:
+        config.q_values_thresholds = thresholds
+    logging.info("Running with q value threshold(s) %s" %
+                 ", ".join("%.3f" % q for q in thresholds))
+
+
+def set_compact_tracks(config, args):
+    if args.compact_tracks == "True":
+        config.compact_tracks = True
+        logging.info("Using 32 bit indices and values for tracks")
+
+
+def set_chunked_tracks(config, args):
+    if args.chunked_tracks == "True":
+        config.chunked_tracks = True
+        logging.info("Storing tracks in compressed chunks")
+
+
+def set_window_size(config, args):
+    if args.window_size is None:
+        return
+    config.window_size = int(float(args.window_size))
+    logging.info("Calling peaks in windows of about %d base pairs"
+                 % config.window_size)
+
+
+def set_memory_limit(config, args):
+    if args.memory_limit is None:
+        return
+    config.memory_limit = int(float(args.memory_limit)*1024**3)
+    config.memory_history = "graph_peak_caller_memory.json"
+    logging.info("Running graphs in parallel using at most %.1f GB"
+                 % (config.memory_limit/1024**3))
+
+
+def set_prefetch_depth(config, args):
+    config.prefetch_depth = 1
+    if args.prefetch_depth is not None:
+        config.prefetch_depth = int(args.prefetch_depth)
+    if config.prefetch_depth > 0:
+        logging.info("Loading up to %d graphs ahead in the background"
+                     % config.prefetch_depth)
+
+
+def set_write_behind(config, args):
+    if args.write_behind == "True":
+        config.write_behind = True
+        logging.info("Writing files in the background")
+
+
+def set_pileup_processes(config, args):
+    if args.pileup_processes is None:
+        return
+    config.pileup_processes = int(args.pileup_processes)
+    logging.info("Using %d processes for the sample pileup"
+                 % config.pileup_processes)
+
+
+def set_background_cache(config, args):
+    if args.background_cache is None:
+        return
+    config.background_cache_dir = args.background_cache
+    if args.background_cache_size is not None:
+        config.background_cache_size = int(
+            float(args.background_cache_size)*1024**3)
+    logging.info("Using background track cache in %s (max %.1f GB)"
+                 % (config.background_cache_dir,
+                    config.background_cache_size/1024**3))
+
+
 def get_intervals(args):
     iclass = UniqueIntervals  # Use Intervals to skip filter dup
     samples = iclass(parse_input_file(args.sample, args.graph))
@@ -93,7 +172,7 @@ def run_callpeaks_interface(args):
 
 def create_alignment_fasta(args):
     intervals = UniqueIntervals(parse_input_file(args.vg_json_file_name, args.graph))
-    sequence_graph = obg.SequenceGraph.from_file(args.data_dir + "/" + args.chrom + ".nobg.sequences")
+    sequence_graph = resources.get_sequence_graph(args.data_dir + "/" + args.chrom + ".nobg.sequences")
     seqs = (sequence_graph.get_interval_sequence(interval)
             for interval in intervals)
 
@@ -154,7 +233,7 @@ def run_callpeaks2(args):
     logging.info("Using graphs: %s " % graphs)
     sequence_graph_file_names = [fn + ".sequences" for fn in graphs]
     logging.info("Will use sequence graphs. %s" % sequence_graph_file_names)
-    sequence_retrievers = (obg.SequenceGraph.from_file(fn)
+    sequence_retrievers = (resources.get_sequence_graph(fn)
                            for fn in sequence_graph_file_names)
 
     data_dir = os.path.dirname(graphs[0])
@@ -192,11 +271,7 @@ def run_callpeaks2(args):
         config.keep_duplicates = True
         logging.info("Keeping duplicates")
 
-    if args.q_threshold is not None:
-        config.q_values_threshold = float(args.q_threshold)
-        logging.info("Running with q value threshold %.3f" % config.q_values_threshold)
-    else:
-        logging.info("Q value threshold not set. Running with default 0.05.")
+    set_q_value_thresholds(config, args.q_threshold)
 
     if args.fragment_length is None:
         logging.info("Fragment length was not specified. Will now"
@@ -235,8 +310,18 @@ def run_callpeaks2(args):
         logging.info("Not using min background.")
         config.global_min = None
 
+    set_background_cache(config, args)
+    set_compact_tracks(config, args)
+    set_chunked_tracks(config, args)
+    set_window_size(config, args)
+    set_memory_limit(config, args)
+    set_prefetch_depth(config, args)
+    set_pileup_processes(config, args)
+    set_write_behind(config, args)
     out_name = args.out_name if args.out_name is not None else ""
-    reporter = Reporter(out_name)
+    reporter = Reporter(out_name, config.compact_tracks,
+                        config.chunked_tracks,
+                        write_behind=config.write_behind)
     config.has_control = args.control is not None
     caller = MultipleGraphsCallpeaks(
         names,
@@ -270,7 +355,7 @@ def run_callpeaks_whole_genome(args):
         if not os.path.isfile(linear_map_name):
             logging.warning("Did not find linear map for "
                             "chromosome %s. Will create." % chrom)
-            graph = obg.Graph.from_file(graph_file_names[i])
+            graph = resources.get_graph(graph_file_names[i])
             create_linear_map(graph, linear_map_name)
         else:
             logging.info("Found linear map %s that will be used." % linear_map_name)
@@ -278,7 +363,7 @@ def run_callpeaks_whole_genome(args):
 
 
     sequence_retrievers = \
-            (obg.SequenceGraph.from_file(args.data_dir + "/" + chrom + ".nobg.sequences")
+            (resources.get_sequence_graph(args.data_dir + "/" + chrom + ".nobg.sequences")
              for chrom in chromosomes)
 
 
@@ -343,19 +428,19 @@ def run_callpeaks_whole_genome_from_p_values(args):
     chromosomes = [chromosome]
     graph_file_names = [args.data_dir + chrom + ".nobg" for chrom in chromosomes]
     sequence_retrievers = \
-        (obg.SequenceGraph.from_file(args.data_dir + "/" + chrom + ".nobg.sequences") for chrom in chromosomes)
+        (resources.get_sequence_graph(args.data_dir + "/" + chrom + ".nobg.sequences") for chrom in chromosomes)
     out_name = args.out_name if args.out_name is not None else ""
     config = Configuration()
 
-    if args.q_threshold is not None:
-        config.q_values_threshold = float(args.q_threshold)
-        logging.info("Running with q value threshold %.3f" % config.q_values_threshold)
-    else:
-        logging.info("Q value threshold not set. Running with default 0.05.")
+    set_q_value_thresholds(config, args.q_threshold)
 
     config.fragment_length = int(args.fragment_length)
     config.read_length = int(args.read_length)
-    reporter = Reporter(out_name)
+    set_compact_tracks(config, args)
+    set_chunked_tracks(config, args)
+    set_window_size(config, args)
+    reporter = Reporter(out_name, config.compact_tracks,
+                        config.chunked_tracks)
     caller = MultipleGraphsCallpeaks(
         chromosomes,
         graph_file_names,
@@ -369,3 +454,82 @@ def run_callpeaks_whole_genome_from_p_values(args):
     )
     caller.create_joined_q_value_mapping()
     caller.run_from_p_values(only_chromosome=chromosome)
+
+
+def read_sample_sheet(file_name, chromosomes):
+    """Read a tab separated sample sheet with one sample per line:
+    name, sample alignments and optionally control alignments.
+    [chrom] in the file names is replaced by each chromosome.
+    Returns names, samples and controls for MultipleSamplesCallpeaks"""
+    names = []
+    samples = {}
+    controls = {}
+    with open(file_name) as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            columns = line.split()
+            name, sample = columns[:2]
+            if name in samples:
+                logging.critical("Sample name %s is used more than once in %s"
+                                 % (name, file_name))
+                sys.exit(1)
+            names.append(name)
+            samples[name] = [sample.replace("[chrom]", chrom)
+                             for chrom in chromosomes]
+            controls[name] = None
+            if len(columns) > 2:
+                controls[name] = [columns[2].replace("[chrom]", chrom)
+                                  for chrom in chromosomes]
+    return names, samples, controls
+
+
+def run_callpeaks_batch(args):
+    chromosomes = args.chromosomes.split(",")
+    sample_names, samples, controls = read_sample_sheet(
+        args.sample_sheet, chromosomes)
+    logging.info("Calling peaks for %d samples on %d chromosomes",
+                 len(sample_names), len(chromosomes))
+    graph_file_names = [os.path.join(args.data_dir, chrom + ".nobg")
+                        for chrom in chromosomes]
+    linear_map_file_names = []
+    for chrom, graph_file_name in zip(chromosomes, graph_file_names):
+        linear_map_name = os.path.join(args.data_dir,
+                                       chrom + "_linear_map.npz")
+        if not os.path.isfile(linear_map_name):
+            logging.warning("Did not find linear map for "
+                            "chromosome %s. Will create." % chrom)
+            create_linear_map(obg.Graph.from_file(graph_file_name),
+                              linear_map_name)
+        linear_map_file_names.append(linear_map_name)
+
+    config = Configuration()
+    config.fragment_length = int(args.fragment_length)
+    config.read_length = int(args.read_length)
+    if config.fragment_length < config.read_length:
+        logging.critical("Fragment length is smaller than read length. Cannot call peaks.")
+        sys.exit(1)
+    if args.keep_duplicates == "True":
+        config.keep_duplicates = True
+        logging.info("Keeping duplicates")
+    set_q_value_thresholds(config, args.q_threshold)
+    if args.genome_size is not None:
+        config.global_min = int(args.unique_reads) * \
+            config.fragment_length / int(args.genome_size)
+        logging.info("Computed min background signal to be %.3f"
+                     % config.global_min)
+    set_background_cache(config, args)
+    set_compact_tracks(config, args)
+    set_chunked_tracks(config, args)
+    set_write_behind(config, args)
+
+    out_name = args.out_name if args.out_name is not None else ""
+    caller = MultipleSamplesCallpeaks(
+        chromosomes, graph_file_names, sample_names,
+        samples, controls, linear_map_file_names,
+        config, Reporter(out_name, config.compact_tracks,
+                         config.chunked_tracks,
+                         write_behind=config.write_behind),
+        sequence_graph_file_names=[fn + ".sequences"
+                                   for fn in graph_file_names])
+    caller.run()
@@ -1,37 +1,22 @@
 #!/usr/bin/python3
 import argparse
+import importlib
 import sys
 import logging
-from graph_peak_caller.logging_config import set_logging_config
+from graph_peak_caller.logging_config import set_logging_config, \
+    set_numpy_error_config
+from graph_peak_caller import resources
 from graph_peak_caller.custom_exceptions import *
-import pyvg
-import offsetbasedgraph as obg
-import offsetbasedgraph.vcfmap
-import pickle
-from graph_peak_caller.peakcollection import Peak, PeakCollection
-from graph_peak_caller.sparsediffs import SparseValues
-from graph_peak_caller.mindense import DensePileup
 
+# Subcommand implementations are given as "module:function" in the
+# interface table below, and only imported when the subcommand is run,
+# so that parsing arguments does not import numpy, offsetbasedgraph,
+# pyvg, matplotlib etc.
+CALLPEAKS = "graph_peak_caller.callpeaks_interface:"
+ANALYSIS = "graph_peak_caller.analysis.analysis_interface:"
+PREPROCESS = "graph_peak_caller.preprocess_interface:"
+SERVER = "graph_peak_caller.server:"
 
-from graph_peak_caller.callpeaks_interface import \
-    run_callpeaks_interface, run_callpeaks_whole_genome,\
-    run_callpeaks_whole_genome_from_p_values, run_callpeaks2, create_alignment_fasta
-
-from graph_peak_caller.analysis.analysis_interface import analyse_peaks_whole_genome,\
-    analyse_peaks, peaks_to_fasta, linear_peaks_to_fasta,\
-    analyse_manually_classified_peaks, differential_expression,\
-    plot_motif_enrichment, get_summits, get_super_summits, peaks_to_linear, move_linear_reads_to_graph,\
-    find_linear_path, concatenate_sequence_files, check_haplotype, get_motif_locations,\
-    get_haplotype_sequence, get_overlapping_alignments, get_analysis_summaries, \
-    split_peaks_by_chromosome
-
-from graph_peak_caller.preprocess_interface import \
-    count_unique_reads_interface, create_ob_graph,\
-    create_linear_map_interface,\
-    split_vg_json_reads_into_chromosomes, shift_estimation
-
-
-from offsetbasedgraph.interval import NoLinearProjectionException
 
 def main():
     run_argument_parser(sys.argv[1:])
@@ -42,42 +27,37 @@ def version(args):
 
 
 def clean_vcf_wrapper(args):
+    from offsetbasedgraph.vcfmap import simplify_vcf
     for chromosome in args.chromosomes.split(","):
-        offsetbasedgraph.vcfmap.simplify_vcf(chromosome, args.data_folder)
-
-
-def project_alignments(alignments, linear_path):
-    import numpy as np
-    i = 0
-    for alignment in alignments:
-        if i % 10000 == 0:
-            logging.info("Processed %d alignments" % i)
-        i += 1
+        simplify_vcf(chromosome, args.data_folder)
+
+
+def project_alignments(alignments, linear_path, chunk_size=100000):
+    """Yields linear start, end and strand of the alignments that can
+    be projected to linear_path"""
+    from graph_peak_caller.linearprojection import LinearProjector, \
+        AlignmentArrays, chunks
+    projector = None
+    for chunk in chunks(alignments, chunk_size):
+        if projector is None:
+            projector = LinearProjector(chunk[0].graph, linear_path)
+        starts, ends, strands, is_projected = projector.project(
+            AlignmentArrays.from_intervals(chunk))
+        for start, end, strand in zip(starts[is_projected].tolist(),
+                                      ends[is_projected].tolist(),
+                                      strands[is_projected].tolist()):
+            yield start, end, "+" if strand > 0 else "-"
 
-        try:
-            if alignment.region_paths[0] < 0:
-                assert np.all(np.array(alignment.region_paths) < 0)
-                start, end = alignment.get_reverse().to_linear_offsets2(linear_path)
-                strand = "-"
-            else:
-                assert np.all(np.array(alignment.region_paths) > 0)
-                start, end = alignment.to_linear_offsets2(linear_path)
-                strand = "+"
-        except NoLinearProjectionException:
-            logging.warning("Found no linear projection for %s. Skipping" % alignment)
-
-        yield start, end, strand
 
 def project_vg_alignments(args):
     from pyvg.conversion import vg_json_file_to_intervals
-    linear_path = obg.NumpyIndexedInterval.from_file(args.linear_path_file_name)
-    #print(linear_path.nodes_in_interval())
+    from graph_peak_caller.linearprojection import project_alignments_to_bed
+    linear_path = resources.get_linear_path(args.linear_path_file_name)
     alignments = vg_json_file_to_intervals(args.alignments_json_file_name, args.graph)
 
     with open(args.out_file_name, "w") as f:
-        projected_alignments = project_alignments(alignments, linear_path)
-        for start, end, strand in projected_alignments:
-            f.writelines(["%s\t%d\t%d\t.\t0\t%s\n" % (args.chromosome, start, end, strand)])
+        project_alignments_to_bed(alignments, args.graph, linear_path,
+                                  args.chromosome, f)
 
 
 def check_pruned_graphs_stats(args):
@@ -105,23 +85,23 @@ def vg_json_alignments_to_intervals(args):
 
 
 def get_intersecting_intervals(args):
+    import numpy as np
     from offsetbasedgraph import IntervalCollection
-    intervals1 = IntervalCollection.from_file(args.file1, text_file=True, graph=args.graph)
+    from graph_peak_caller.overlapindex import OverlapIndex
+    intervals1 = list(IntervalCollection.from_file(args.file1, text_file=True, graph=args.graph))
     intervals2 = IntervalCollection.from_file(args.file2, text_file=True, graph=args.graph)
 
-    out = []
-    for interval1 in intervals1.intervals:
-        for interval2 in intervals2.intervals:
-            if interval1.intersects(interval2):
-                out.append(interval1)
-                logging.info("Found match between %s and %s" % (interval1, interval2))
-                continue
+    ids, _ = OverlapIndex.from_intervals(intervals1, args.graph).overlapping_pairs(
+        OverlapIndex.from_intervals(intervals2, args.graph))
+    out = [intervals1[i] for i in np.unique(ids)]
+    logging.info("Found %d of %d intervals intersecting" % (len(out), len(intervals1)))
 
     IntervalCollection(out).to_file(args.out_file_name, text_file=True)
     logging.info("Wrote intersecting intervals to %s" % args.out_file_name)
 
 
 def index_interval(args):
+    import offsetbasedgraph as obg
     intervals = obg.IntervalCollection.from_file(args.file_name, text_file=True, graph=args.graph)
     intervals = list(intervals.intervals)
     assert len(intervals) == 1, "Only a single interval in file is supported"
@@ -132,6 +112,8 @@ def index_interval(args):
 
 
 def get_variant_edges(args):
+    import pickle
+    import offsetbasedgraph as obg
     graph = args.graph
     linear_ref = list(obg.IntervalCollection.from_file(args.linear_reference_interval, text_file=True).intervals)[0]
     logging.info("Finding liner ref edges")
@@ -176,12 +158,44 @@ interface = \
                                              'duplicate input alignments.'),
                     ('-m/--min_fold_enrichment', 'Optional. Minimum fold enrichment required for '
                                                'candidate peaks when estimating fragment length. Default 5.'),
-                    ('-q/--q_threshold', 'Optional. q-value threshold. Default is 0.05.'),
+                    ('-q/--q_threshold', 'Optional. q-value threshold. Default is 0.05. Use a comma-separated '
+                                          'list (e.g. 0.05,0.01) to call peaks for several thresholds in one run.'),
                     ('-M /--max_fold_enrichment', 'Optional. Maximum fold enrichment required for '
                                                'candidate peaks when estimating fragment length. Default 50.'),
-
-                ],
-                'method': run_callpeaks2,
+                    ('-b/--background_cache', 'Optional. Directory for caching background tracks. '
+                                              'Background tracks for the same control and settings '
+                                              'are then reused across runs.'),
+                    ('-B/--background_cache_size', 'Optional. Max size of the background cache in GB. '
+                                                   'Default 20.'),
+                    ('-C/--compact_tracks', 'Optional. Set to True to write tracks with 32 bit '
+                                            'indices and values, using about half the disk. P-values are '
+                                            'written at full precision, and peaks are the same. Tracks '
+                                            'kept in memory between stages are always stored with 32 bit '
+                                            'indices, and 32 bit values where no value changes.'),
+                    ('-k/--chunked_tracks', 'Optional. Set to True to store tracks in compressed chunks '
+                                            '(<name>_track.npz), so that parts of them can be read '
+                                            'without reading the whole track.'),
+                    ('-w/--window_size', 'Optional. Call peaks in windows of about this many base pairs, '
+                                         'to limit memory use on very large graphs. Results are equal '
+                                         'up to floating point rounding.'),
+                    ('-L/--memory_limit', 'Optional. Memory limit in GB. If set, graphs are run to p-values '
+                                          'in parallel processes, largest first, as long as their estimated '
+                                          'memory use fits. Measured use is saved to graph_peak_caller_memory.json '
+                                          'to improve later estimates.'),
+                    ('-P/--prefetch_depth', 'Optional. Number of graphs (with linear maps and reads) to '
+                                            'load in the background while the current graph is processed. '
+                                            'Reads are held as arrays, and a sample that is also the '
+                                            'control is read once. Default 1. Set to 0 to load each graph '
+                                            'and stream its reads when it is needed.'),
+                    ('-j/--pileup_processes', 'Optional. Number of processes used to create the sample '
+                                              'pileup. If above 1, the reads on the two strands are '
+                                              'extended in parallel, and if above 2, batches of reads are '
+                                              'also added to the pileup in this many processes. Default 1.'),
+                    ('-W/--write_behind', 'Optional. Set to True to write result files in a background '
+                                          'thread while the next stage runs.'),
+
+                ],
+                'method': CALLPEAKS + 'run_callpeaks2',
         },
 
     'callpeaks_whole_genome_from_p_values':
@@ -194,12 +208,63 @@ interface = \
                     ('-n/--out_name', 'Optional. eg experiment1_'),
                     ('-f/--fragment_length', ''),
                     ('-r/--read_length', ''),
-                    ('-q/--q_threshold', 'Optional. q-value threshold. Default is 0.05.'),
+                    ('-q/--q_threshold', 'Optional. q-value threshold. Default is 0.05. Use a comma-separated '
+                                          'list (e.g. 0.05,0.01) to call peaks for several thresholds in one run.'),
                     ('-m/--variant_maps_path', 'Optional. Path where variant maps are stored. '
                                                'If set, variant maps will be used to try to improve max paths '
-                                               'through subgraphs (better handling of insertions and deletions)')
-                ],
-            'method': run_callpeaks_whole_genome_from_p_values
+                                               'through subgraphs (better handling of insertions and deletions)'),
+                    ('-C/--compact_tracks', 'Optional. Set to True to write tracks with 32 bit '
+                                            'indices and values, using about half the disk. P-values are '
+                                            'written at full precision, and peaks are the same. Tracks '
+                                            'kept in memory between stages are always stored with 32 bit '
+                                            'indices, and 32 bit values where no value changes.'),
+                    ('-k/--chunked_tracks', 'Optional. Set to True to store tracks in compressed chunks '
+                                            '(<name>_track.npz), so that parts of them can be read '
+                                            'without reading the whole track.'),
+                    ('-w/--window_size', 'Optional. Call peaks in windows of about this many base pairs, '
+                                         'to limit memory use on very large graphs. Results are equal '
+                                         'up to floating point rounding.'),
+                ],
+            'method': CALLPEAKS + 'run_callpeaks_whole_genome_from_p_values'
+        },
+    'callpeaks_batch':
+        {
+            'help': 'Call peaks for multiple samples on the same graphs. Graphs, linear maps and '
+                    'background tracks of shared controls are only created once per chromosome.',
+            'arguments':
+                [
+                    ('sample_sheet', 'Tab separated file with one line per sample: name, sample '
+                                     'alignments and (optional) control alignments. [chrom] in '
+                                     'file names is replaced by each chromosome name.'),
+                    ('chromosomes', 'Comma-separated list of chromosomes, e.g. chr1,chr2'),
+                    ('-d/--data_dir', 'Directory containing graphs and linear maps.'),
+                    ('-f/--fragment_length', ''),
+                    ('-r/--read_length', ''),
+                    ('-n/--out_name', 'Optional. Out base name. Prepended to output files.'),
+                    ('-u/--unique_reads', 'Optional. Number of unique reads. Used with --genome_size'),
+                    ('-G/--genome_size', 'Optional. Number of base pairs covered by graphs in total. '
+                                         'If set, --unique_reads is used to compute min background.'),
+                    ('-q/--q_threshold', 'Optional. q-value threshold. Default is 0.05. Use a comma-separated '
+                                          'list (e.g. 0.05,0.01) to call peaks for several thresholds in one run.'),
+                    ('-D/--keep_duplicates', 'Optional. Set to True in order to keep '
+                                             'duplicate input alignments.'),
+                    ('-b/--background_cache', 'Optional. Directory for caching background tracks. '
+                                              'Background tracks for the same control and settings '
+                                              'are then reused across runs.'),
+                    ('-B/--background_cache_size', 'Optional. Max size of the background cache in GB. '
+                                                   'Default 20.'),
+                    ('-C/--compact_tracks', 'Optional. Set to True to write tracks with 32 bit '
+                                            'indices and values, using about half the disk. P-values are '
+                                            'written at full precision, and peaks are the same. Tracks '
+                                            'kept in memory between stages are always stored with 32 bit '
+                                            'indices, and 32 bit values where no value changes.'),
+                    ('-k/--chunked_tracks', 'Optional. Set to True to store tracks in compressed chunks '
+                                            '(<name>_track.npz), so that parts of them can be read '
+                                            'without reading the whole track.'),
+                    ('-W/--write_behind', 'Optional. Set to True to write result files in a background '
+                                          'thread while the next stage runs.'),
+                ],
+            'method': CALLPEAKS + 'run_callpeaks_batch'
         },
     'peaks_to_fasta':
         {
@@ -211,7 +276,7 @@ interface = \
                     ('intervals_file_name', ''),
                     ('out_file_name', '')
                 ],
-            'method': peaks_to_fasta
+            'method': ANALYSIS + 'peaks_to_fasta'
         },
     'linear_peaks_to_fasta':
         {
@@ -222,7 +287,7 @@ interface = \
                     ('fasta_file', 'Reference genome fasta file. Will be used to fetch sequences.'),
                     ('out_file_name', '')
                 ],
-            'method': linear_peaks_to_fasta
+            'method': ANALYSIS + 'linear_peaks_to_fasta'
         },
     'linear_peaks_to_fasta_summits':
         {
@@ -234,7 +299,7 @@ interface = \
                     ('out_file_name', ''),
                     ('window', 'Number of bps around summits to keep')
                 ],
-            'method': linear_peaks_to_fasta
+            'method': ANALYSIS + 'linear_peaks_to_fasta'
         },
     'create_ob_graph':
         {
@@ -245,7 +310,7 @@ interface = \
                                           '(created by running vg view -Vj graph.vg > graph.json'),
                     ('-o/--out_file_name', 'Optional. Will use input file base name if unset.')
                 ],
-            'method': create_ob_graph
+            'method': PREPROCESS + 'create_ob_graph'
         },
     'create_linear_map':
         {
@@ -255,7 +320,7 @@ interface = \
                 [
                     ('-o/--out_file_base_name', 'Optional out file name'),
                 ],
-            'method': create_linear_map_interface
+            'method': PREPROCESS + 'create_linear_map_interface'
         },
     'split_vg_json_reads_into_chromosomes':
         {
@@ -264,9 +329,10 @@ interface = \
                 [
                     ('chromosomes', 'Comma-separated list of chromosomes to split reads into'),
                     ('vg_json_reads_file_name', ''),
-                    ('range_files_base_name', 'Base name, e.g. dir, to range files')
+                    ('range_files_base_name', 'Base name, e.g. dir, to range files'),
+                    ('-n/--n_processes', 'Optional. Number of processes to split the file with. Default 1.')
                 ],
-            'method': split_vg_json_reads_into_chromosomes
+            'method': PREPROCESS + 'split_vg_json_reads_into_chromosomes'
         },
     'concatenate_sequence_files':
         {
@@ -281,7 +347,7 @@ interface = \
                                                     'following the pattern. Use [chrom] where chromosome should'
                                                     'be replaced. E.g. peaks_[chrom].fasta')
                 ],
-            'method': concatenate_sequence_files
+            'method': ANALYSIS + 'concatenate_sequence_files'
         },
     'plot_motif_enrichment':
         {
@@ -296,7 +362,7 @@ interface = \
                     ('plot_title', 'Title above plot'),
                     ('background_model_file', 'Optional. Background model file for fimo. If not set, fimo will use uniform background.')
                 ],
-            'method': plot_motif_enrichment
+            'method': ANALYSIS + 'plot_motif_enrichment'
         },
     'analyse_peaks':
         {
@@ -313,7 +379,7 @@ interface = \
                     ('graph_start', 'Start pos in chromosome of graph.'),
                     ('graph_end', 'End pos in chromosome of graph. 0 if covering whole chromosome')
                 ],
-            'method': analyse_peaks
+            'method': ANALYSIS + 'analyse_peaks'
         },
     'analyse_peaks_whole_genome':
         {
@@ -326,7 +392,7 @@ interface = \
                     ('out_file', 'Out file base name (file endings for different formats will be appended)'),
                     ('-f/--use_graph_fasta', 'Optional. Specify fasta file to use for graph, format file_[chrom].fasta, where [chrom] will be replaced')               
                 ],
-            'method': analyse_peaks_whole_genome
+            'method': ANALYSIS + 'analyse_peaks_whole_genome'
         },
     'count_unique_reads':
         {
@@ -337,7 +403,7 @@ interface = \
                     ('graphs_location', 'Will use the graphs *_[chromosome].nobg'),
                     ('reads_base_name', 'Will use files *_[chromosome].json')
                 ],
-            'method': count_unique_reads_interface
+            'method': PREPROCESS + 'count_unique_reads_interface'
         },
     'find_linear_path':
         {
@@ -351,7 +417,7 @@ interface = \
                     ('-i/--out_file_name_interval', 'Optional. When specified, an IntervalCollection will '
                                                     'be written to this file.'),
                 ],
-            'method': find_linear_path
+            'method': ANALYSIS + 'find_linear_path'
         },
     'move_linear_reads_to_graph':
         {
@@ -361,9 +427,10 @@ interface = \
                     ('bed_file_name', ''),
                     ('chromosomes', 'Comma separated list of chromosomes to use'),
                     ('data_dir', 'Directory containing graphs and linear path files'),
-                    ('out_files_base_name', '')
+                    ('out_files_base_name', ''),
+                    ('-n/--n_processes', 'Optional. Number of processes to convert the file with. Default 1.')
                 ],
-            'method': move_linear_reads_to_graph
+            'method': ANALYSIS + 'move_linear_reads_to_graph'
         },
     'diffexpr':
         {
@@ -374,7 +441,7 @@ interface = \
                     ('test_name', ''),
                     ('fimo_file_name', '')
                 ],
-            'method': differential_expression
+            'method': ANALYSIS + 'differential_expression'
         },
     'check_haplotype':
         {
@@ -387,7 +454,7 @@ interface = \
                     ('interval_name', ''),
                     ('from_peakcollection', 'Optional if given then use intervalcollectionfile')
                 ],
-            'method': check_haplotype
+            'method': ANALYSIS + 'check_haplotype'
         },
     'analysis_summary':
         {
@@ -399,7 +466,7 @@ interface = \
                     ('chrom', ''),
                     ('interval_name', ''),
                 ],
-            'method': get_analysis_summaries
+            'method': ANALYSIS + 'get_analysis_summaries'
         },
 
     'overlapping_alignments':
@@ -412,7 +479,7 @@ interface = \
                     ('chromosomes', 'Comma-separated list of chromosomes'),
                     ('interval_name', ''),
                 ],
-            'method': get_overlapping_alignments
+            'method': ANALYSIS + 'get_overlapping_alignments'
         },
     'haplotype_sequence':
         {
@@ -426,7 +493,7 @@ interface = \
                     ('interval_name', ''),
                     ('haplotype', '')
                 ],
-            'method': get_haplotype_sequence
+            'method': ANALYSIS + 'get_haplotype_sequence'
         },
     'motif_locations':
         {
@@ -438,7 +505,7 @@ interface = \
                     ('interval_name', ''),
                     ('chrom', '')
                 ],
-            'method': get_motif_locations
+            'method': ANALYSIS + 'get_motif_locations'
         },
 
     'peaks_to_linear':
@@ -451,7 +518,7 @@ interface = \
                     ('chromosome', 'Name of chromosome that will be used when writing the bed file'),
                     ('out_file_name', 'Out file name')
                 ],
-            'method': peaks_to_linear
+            'method': ANALYSIS + 'peaks_to_linear'
         },
     'version':
         {
@@ -474,7 +541,7 @@ interface = \
                     ('max_fold_enrichment', 'Optional. Maximum fold enrichment when '
                                             'finding candidates. Default is 50.')
                 ],
-            'method': shift_estimation
+            'method': PREPROCESS + 'shift_estimation'
         },
     'get_summits':
         {
@@ -488,7 +555,7 @@ interface = \
                     ('window_size', 'Optional. Number of basepairs to each side '
                                     'from summit to include. Default is 60.')
                 ],
-            'method': get_summits
+            'method': ANALYSIS + 'get_summits'
         },
     'get_super_summits':
         {
@@ -503,7 +570,7 @@ interface = \
                     ('window_size', 'Optional. Number of basepairs to each side '
                                     'from summit to include. Default is 60.'),
                 ],
-            'method': get_super_summits
+            'method': ANALYSIS + 'get_super_summits'
         },
     'project_vg_alignments':
         {
@@ -551,7 +618,7 @@ interface = \
                     ('chrom', ""),
                     ('out_file_name', 'Out file name'),
                 ],
-            'method': create_alignment_fasta
+            'method': CALLPEAKS + 'create_alignment_fasta'
         },
     'get_intersecting_intervals':
         {
@@ -574,7 +641,7 @@ interface = \
                     ('chromosomes', 'Comma separated list of chromosomes to look for'),
                     ('out_file_name_ending', 'Will add *chromosome*_ before this name for each chromosome found.')
                 ],
-            'method': split_peaks_by_chromosome
+            'method': ANALYSIS + 'split_peaks_by_chromosome'
         },
     'clean_vcfs':
         {
@@ -606,15 +673,38 @@ interface = \
                     ('out_file_name', '')
                 ],
             'method': get_variant_edges
+        },
+    'serve':
+        {
+            'help': 'Run a local server that keeps graphs loaded and runs peak calling jobs '
+                    '(%s) sent with submit.' % ', '.join(resources.SERVER_COMMANDS),
+            'arguments':
+                [
+                    ('-s/--socket', 'Optional. Unix socket to listen on. Default graph_peak_caller.sock'),
+                    ('-j/--jobs_dir', 'Optional. Directory where each job gets an output directory. '
+                                      'Default jobs'),
+                    ('-n/--n_workers', 'Optional. Number of jobs to run at the same time. Default 1.'),
+                    ('-p/--preload', 'Optional. Comma separated list of graph files to load at startup.'),
+                ],
+            'method': SERVER + 'serve'
+        },
+    'submit':
+        {
+            'help': 'Submit a job to a server started with serve, and show its log.',
+            'arguments':
+                [
+                    ('-s/--socket', 'Optional. Unix socket of the server. Default graph_peak_caller.sock'),
+                ],
+            'remaining_arguments': ('job', 'The command to run, e.g. callpeaks -g graph.nobg ...'),
+            'method': SERVER + 'submit'
         }
-                
 }
 
 
 class GraphAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         try:
-            new_values = obg.Graph.from_numpy_file(values)
+            new_values = resources.get_graph(values)
         except FileNotFoundError:
             raise GraphNotFoundException()
 
@@ -622,7 +712,7 @@ class GraphAction(argparse.Action):
         setattr(namespace, self.dest, new_values)
         setattr(namespace, "graph_file_name", values)
         try:
-            sequencegraph = obg.SequenceGraph.from_file(values + ".sequences")
+            sequencegraph = resources.get_sequence_graph(values + ".sequences")
             setattr(namespace, "sequence_graph", sequencegraph)
             logging.info("Using sequencegraph %s" % (values + ".sequences"))
         except FileNotFoundError:
@@ -630,59 +720,77 @@ class GraphAction(argparse.Action):
             setattr(namespace, "sequence_graph", None)
 
 
-def run_argument_parser(args):
-    # Create parser
-    parser = argparse.ArgumentParser(
-        description='Graph peak caller',
-        prog='graph_peak_caller',
-        formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=50, width=100))
+def get_method(method):
+    """Import the function for a subcommand, given as "module:function" """
+    if callable(method):
+        return method
+    module_name, function_name = method.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
 
-    subparsers = parser.add_subparsers(help='Subcommands')
 
-    for command in interface:
+def add_subcommand(subparsers, command, spec):
+    example = ""
+    if "example_run" in spec:
+        example = "\nExample: " + spec["example_run"]
+
+    subparser = subparsers.add_parser(
+        command,
+        help=spec["help"] + example)
 
-        example = ""
-        if "example_run" in interface[command]:
-            example = "\nExample: " + interface[command]["example_run"]
+    subparser.add_argument('-v', '--verbose',
+                           help='Verbosity level. 0 (show only warnings and errors), 1 (show info, '
+                                'warnings and errors), 2 (show everything). Default is 1.', dest='verbose',
+                           required=False, metavar='N', const=1, type=int, nargs='?', default=1)
 
-        subparser = subparsers.add_parser(
-            command,
-            help=interface[command]["help"] + example)
+    if 'requires_graph' in spec:
+        subparser.add_argument('-g', '--graph', action=GraphAction,
+                               help='Graph file name', dest='graph',
+                               required=True, metavar='file.nobg')
 
-        subparser.add_argument('-v', '--verbose',
-                               help='Verbosity level. 0 (show only warnings and errors), 1 (show info, '
-                                    'warnings and errors), 2 (show everything). Default is 1.', dest='verbose',
-                               required=False, metavar='N', const=1, type=int, nargs='?', default=1)
+    for argument, help in spec["arguments"]:
 
-        if 'requires_graph' in interface[command]:
-            subparser.add_argument('-g', '--graph', action=GraphAction,
-                                   help='Graph file name', dest='graph',
-                                   required=True, metavar='file.nobg')
+        if "/" in argument:
+            c = argument.split("/")
+            short_command = c[0].strip()
+            long_command = c[1].strip()
+            assert long_command.startswith("--"), "Long command for %s must start with --" % argument
+            assert short_command.startswith("-"), "Short command for %s must start with -" % argument
 
-        for argument, help in interface[command]["arguments"]:
+            required = True
+            if "Optional" in help or "optional" in help:
+                required = False
 
-            if "/" in argument:
-                c = argument.split("/")
-                short_command = c[0].strip()
-                long_command = c[1].strip()
-                assert long_command.startswith("--"), "Long command for %s must start with --" % argument
-                assert short_command.startswith("-"), "Short command for %s must start with -" % argument
+            nargs = None
+            if "wildcard" in help:
+                nargs = "+"
 
-                required = True
-                if "Optional" in help or "optional" in help:
-                    required = False
+            subparser.add_argument(short_command, long_command,
+                                   dest=long_command.replace("--", ""), help=help,
+                                   required=required, nargs=nargs)
+        else:
+            subparser.add_argument(argument, help=help)
 
-                nargs = None
-                if "wildcard" in help:
-                    nargs = "+"
+    if "remaining_arguments" in spec:
+        argument, help = spec["remaining_arguments"]
+        subparser.add_argument(argument, help=help, nargs=argparse.REMAINDER)
+    subparser.set_defaults(func=spec["method"])
 
-                subparser.add_argument(short_command, long_command,
-                                       dest=long_command.replace("--", ""), help=help,
-                                       required=required, nargs=nargs)
-            else:
-                subparser.add_argument(argument, help=help)
-        subparser.set_defaults(func=interface[command]["method"])
 
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Graph peak caller',
+        prog='graph_peak_caller',
+        formatter_class=lambda prog: argparse.HelpFormatter(prog, max_help_position=50, width=100))
+
+    subparsers = parser.add_subparsers(help='Subcommands')
+
+    for command in interface:
+        add_subcommand(subparsers, command, interface[command])
+    return parser
+
+
+def run_argument_parser(args):
+    parser = build_parser()
 
     if len(args) == 0:
         parser.print_help()
@@ -696,9 +804,15 @@ def run_argument_parser(args):
     set_logging_config(args.verbose)
 
     if hasattr(args, 'func'):
+        func = get_method(args.func)
+        set_numpy_error_config()
         try:
-            args.func(args)
-        except (pyvg.vgobjects.IntervalNotInGraphException, InvalidPileupInterval) as e:
+            func(args)
+        except Exception as e:
+            from pyvg.vgobjects import IntervalNotInGraphException
+            if not isinstance(e, (IntervalNotInGraphException,
+                                  InvalidPileupInterval)):
+                raise
             logging.debug(e)
             logging.error("Found an alignment not compatible with the graph that was used."
                           " Are you sure alignments/intervals are mapped to the same graph that was used?"
@@ -1,7 +1,10 @@
 import logging
+import numpy as np
 
 from .controlgenerator import SparseControl
 from .linearmap import LinearMap
+from ..sparsediffs import SparseDiffs
+from ..touchednodes import as_touched_nodes
 
 
 def get_background_track(graph, intervals, config, extensions,
@@ -29,6 +32,49 @@ def get_background_track_from_input(
                                 extensions, touched_nodes)
 
 
+def get_extensions(config):
+    if config.has_control:
+        return [config.fragment_length, 1000, 10000]
+    return [10000]
+
+
+class SharedBackground:
+    """Background track computed for all nodes in the graph, so that
+    it can be reused for all samples using the same control. Nodes not
+    touched by a sample get the min value, as in SparseControl"""
+
+    def __init__(self, track, n_reads, min_value, graph):
+        self._track = track
+        self.n_reads = n_reads
+        self._min_value = min_value
+        self._graph = graph
+
+    def get_track(self, touched_nodes=None):
+        indices = self._track._indices
+        values = np.cumsum(self._track._diffs)
+        if touched_nodes is not None:
+            touched_nodes = as_touched_nodes(touched_nodes, self._graph)
+            nodes = np.searchsorted(self._graph.node_indexes, indices,
+                                    side="right")-1
+            is_touched = touched_nodes.contains(nodes+self._graph.min_node)
+            is_node_start = np.r_[True, nodes[1:] != nodes[:-1]]
+            keep = is_touched | is_node_start
+            values = np.where(is_touched, values, self._min_value)[keep]
+            indices = indices[keep]
+        return SparseDiffs(indices.copy(), np.diff(np.r_[0, values]),
+                           is_sorted=True)
+
+
+def get_shared_background(graph, intervals, config, linear_map):
+    logging.info("Creating shared background track")
+    sc = SparseControl(linear_map, graph, get_extensions(config),
+                       config.fragment_length, None)
+    if config.global_min is not None:
+        sc.set_min_value(config.global_min)
+    track = sc.create(intervals)
+    return SharedBackground(track, intervals.n_reads, sc._min_value, graph)
+
+
 def scale_tracks(fragment_pileup, background_track, ratio):
     logging.info("Scaling tracks to ratio: %d" % ratio)
     if ratio == 1:
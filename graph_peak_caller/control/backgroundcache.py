@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+from ..sparsediffs import SparseDiffs
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_VERSION = 1
+
+
+def get_file_checksum(file_name, chunk_size=16*1024*1024):
+    checksum = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_array_checksum(*arrays):
+    checksum = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        checksum.update(str(array.dtype).encode())
+        checksum.update(array.tobytes())
+    return checksum.hexdigest()
+
+
+def get_linear_map_checksum(linear_map):
+    if isinstance(linear_map, str):
+        with np.load(linear_map) as data:
+            return get_array_checksum(data["starts"], data["ends"])
+    return get_array_checksum(linear_map._node_starts, linear_map._node_ends)
+
+
+def get_graph_checksum(graph):
+    return get_array_checksum(graph.node_indexes, [graph.min_node])
+
+
+@contextmanager
+def file_lock(file_name):
+    """Exclusive lock shared between processes. Does nothing on
+    platforms without fcntl"""
+    if fcntl is None:
+        yield
+        return
+    with open(file_name, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class BackgroundCache:
+    """On-disk cache of background tracks (SharedBackground) keyed
+    by a hash of everything the track depends on.
+
+    Entries are written to a temporary file and moved in place, so
+    readers never see partial files. A lock per key makes concurrent
+    processes wait for a track being created instead of creating it
+    again. When the total size exceeds max_size, the least recently
+    used entries (by mtime, which is updated on each hit) are removed"""
+
+    def __init__(self, directory, max_size=20*1024**3):
+        self._directory = directory
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        if config.background_cache_dir is None:
+            return None
+        return cls(config.background_cache_dir,
+                   config.background_cache_size)
+
+    @staticmethod
+    def get_key(control_file_name, graph, linear_map, extensions, config):
+        parts = [CACHE_VERSION, get_file_checksum(control_file_name),
+                 get_graph_checksum(graph),
+                 get_linear_map_checksum(linear_map),
+                 list(extensions), config.fragment_length,
+                 config.global_min, config.keep_duplicates]
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def _get_file_name(self, key):
+        return os.path.join(self._directory, key + ".npz")
+
+    def get(self, key, graph):
+        from . import SharedBackground
+        file_name = self._get_file_name(key)
+        try:
+            with np.load(file_name) as data:
+                track = SparseDiffs(data["indices"], data["diffs"])
+                n_reads = int(data["n_reads"])
+                min_value = float(data["min_value"])
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            pass
+        logging.info("Found background track in cache: %s", file_name)
+        return SharedBackground(track, n_reads, min_value, graph)
+
+    def put(self, key, background):
+        fd, tmp_name = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, indices=background._track._indices,
+                     diffs=background._track._diffs,
+                     n_reads=background.n_reads,
+                     min_value=background._min_value)
+        os.replace(tmp_name, self._get_file_name(key))
+        logging.info("Stored background track in cache: %s",
+                     self._get_file_name(key))
+        self.evict(keep=key)
+
+    def get_or_create(self, key, create_func, graph):
+        background = self.get(key, graph)
+        if background is not None:
+            return background
+        with file_lock(os.path.join(self._directory, key + ".lock")):
+            background = self.get(key, graph)
+            if background is not None:
+                return background
+            background = create_func()
+            self.put(key, background)
+        return background
+
+    def evict(self, keep=None):
+        with file_lock(os.path.join(self._directory, ".evict.lock")):
+            entries = []
+            for file_name in os.listdir(self._directory):
+                if not file_name.endswith(".npz"):
+                    continue
+                path = os.path.join(self._directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_size = sum(entry[1] for entry in entries)
+            keep_name = None if keep is None else self._get_file_name(keep)
+            for _, size, path in sorted(entries):
+                if total_size <= self._max_size:
+                    break
+                if path == keep_name:
+                    continue
+                logging.info("Removing %s from background cache", path)
+                try:
+                    os.remove(path)
+                    os.remove(path[:-len(".npz")] + ".lock")
+                except FileNotFoundError:
+                    pass
+                total_size -= size
@@ -1,14 +1,54 @@
 import numpy as np
 import logging
 
-from ..sparsediffs import SparseDiffs
 from .linearpileup import LinearPileup
 from .linearmap import LinearMap
+from .. import resources
+
+
+def get_max_window_values(starts, extension_sizes, fragment_length,
+                          min_value):
+    """Background values on the linear coordinate for sorted read
+    starts: at each position, the max over the extension sizes of the
+    number of reads within extension_size/2 of the position, scaled by
+    fragment_length/extension_size. Returns the positions where the
+    value may change and the values from there.
+
+    The change points are the window ends starts-/+extension, which are
+    already sorted for each extension and only need to be merged. The
+    counts of each window are found by searching for its ends in the
+    change points. As when the window tracks were combined one at a
+    time, min_value is applied to the first window from its first
+    change point on"""
+    extensions = [extension_size // 2 for extension_size in extension_sizes]
+    indices = np.concatenate([starts+offset for extension in extensions
+                              for offset in (-extension, extension)])
+    # A stable sort finds the sorted runs and merges them
+    indices.sort(kind="stable")
+    indices = indices[np.r_[True, indices[1:] != indices[:-1]]]
+    max_values = None
+    for extension in extensions:
+        counts = np.bincount(np.searchsorted(indices, starts-extension),
+                             minlength=indices.size)
+        counts -= np.bincount(np.searchsorted(indices, starts+extension),
+                              minlength=indices.size)
+        np.cumsum(counts, out=counts)
+        values = counts / (extension*2/fragment_length)
+        if max_values is None:
+            is_clipped = indices >= starts[0]-extension
+            values[is_clipped] = np.maximum(values[is_clipped], min_value)
+            max_values = values
+        else:
+            np.maximum(max_values, values, out=max_values)
+    return indices, max_values
 
 
 class SparseControl:
     def __init__(self, linear_map, graph, extension_sizes, fragment_length, touched_nodes):
-        self._linear_map = LinearMap.from_file(linear_map, graph)
+        if isinstance(linear_map, LinearMap):
+            self._linear_map = linear_map
+        else:
+            self._linear_map = resources.get_linear_map(linear_map, graph)
         self._extension_sizes = extension_sizes
         self._fragment_length = fragment_length
         self._graph = graph
@@ -20,24 +60,14 @@ class SparseControl:
 
     def create(self, reads):
         mapped_reads = self._linear_map.map_interval_collection(reads)
+        mapped_reads.sort()
         if self._min_value is None:
             self._min_value = mapped_reads.n_intervals*self._fragment_length / self._linear_map._length
         logging.info("Using min value %s", self._min_value)
-        max_pileup = None
-        for tmp_extension in self._extension_sizes:
-            extension = tmp_extension // 2
-            sparse_diffs = SparseDiffs.from_starts_and_ends(
-                mapped_reads.extend_np(extension))
-            sparse_diffs /= (extension*2/self._fragment_length)
-            if max_pileup is None:
-                sparse_diffs.clip_min(self._min_value)
-                max_pileup = sparse_diffs
-            else:
-                max_pileup = max_pileup.maximum(sparse_diffs)
-        max_pileup._sanitize()
-        lin_pileup = LinearPileup(
-            max_pileup._indices,
-            np.cumsum(max_pileup._diffs))
+        indices, values = get_max_window_values(
+            mapped_reads.starts, self._extension_sizes,
+            self._fragment_length, self._min_value)
+        lin_pileup = LinearPileup(indices, values)
         lin_pileup.sanitize_indices()
         lin_pileup.sanitize_values()
         return lin_pileup.to_sparse_pileup(
@@ -20,6 +20,12 @@ class LinearIntervalCollection(object):
         e = " ".join(str(i) for i in self.ends)
         return "(%s:%s)" % (s, e)
 
+    def sort(self):
+        """Sort by start position, so that extended starts are sorted"""
+        args = np.argsort(self.starts, kind="mergesort")
+        self.starts = self.starts[args]
+        self.ends = self.ends[args]
+
     def extend_np(self, extension_size):
         return np.add.outer(np.array([-extension_size, extension_size]),
                             self.starts)
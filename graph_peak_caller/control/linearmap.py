@@ -96,7 +96,7 @@ class LinearMap:
             all_values.extend(unmapped_indices.values)
         return SparseDiffs(
             np.array(all_indices, dtype="int"),
-            np.diff(np.r_[0, all_values]))
+            np.diff(np.r_[0, all_values]), is_sorted=True)
 
     @classmethod
     def from_graph(cls, graph):
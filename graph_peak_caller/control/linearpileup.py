@@ -3,6 +3,7 @@ import logging
 from collections import defaultdict
 
 from ..eventsorter import EventSorter, EventSort
+from ..touchednodes import TouchedNodes
 
 
 class UnmappedIndices(object):
@@ -62,16 +63,18 @@ class LinearPileup(object):
         return linear_map.to_sparse_pileup(unmapped_indices, min_value)
 
     def get_event_sorter(self, linear_map, touched_nodes=None):
-        node_start_values = [node_id for node_id in
-                             (linear_map._graph.blocks
-                              if touched_nodes is None else touched_nodes)]
-        node_end_values = node_start_values[:]
-        node_starts_idxs = [linear_map.get_node_start(node_id)
-                            for node_id in node_start_values]
-        node_end_idxs = [linear_map.get_node_end(node_id)
-                         for node_id in node_end_values]
-        for start_idx, end_idx in zip(node_starts_idxs, node_end_idxs):
-            assert start_idx < end_idx, "%s, %s" % (start_idx, end_idx)
+        if touched_nodes is None:
+            node_ids = [node_id for node_id in linear_map._graph.blocks]
+        elif isinstance(touched_nodes, TouchedNodes):
+            node_ids = touched_nodes.get_node_ids()
+        else:
+            node_ids = list(touched_nodes)
+        node_start_values = np.asanyarray(node_ids, dtype="int64")
+        node_end_values = node_start_values
+        node_idxs = node_start_values - linear_map._graph.min_node
+        node_starts_idxs = linear_map._node_starts[node_idxs]
+        node_end_idxs = linear_map._node_ends[node_idxs]
+        assert np.all(node_starts_idxs < node_end_idxs)
         idxs = [node_end_idxs, self.indices, node_starts_idxs]
         values = [node_end_values, self.values, node_start_values]
         event_sorter = EventSorter(idxs, values, names=["NODE_END",
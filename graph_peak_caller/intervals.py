@@ -31,3 +31,19 @@ class UniqueIntervals:
             interval_hashes[_hash] = True
             self.n_reads += 1
             yield interval
+
+
+class AlignmentIntervals:
+    """The alignments in an AlignmentArrays as intervals on graph.
+    Intervals are created each time this is iterated over, so that
+    only the arrays are kept in memory"""
+
+    def __init__(self, alignments, graph):
+        self.alignments = alignments
+        self._graph = graph
+
+    def __len__(self):
+        return len(self.alignments)
+
+    def __iter__(self):
+        return self.alignments.to_intervals(self._graph)
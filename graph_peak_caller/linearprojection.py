@@ -0,0 +1,229 @@
+import logging
+import numpy as np
+import offsetbasedgraph as obg
+
+
+class AlignmentArrays:
+    """Columnar representation of alignments (directed intervals).
+    Region paths are stored as a CSR array (region_paths,
+    region_path_indptr) as in PeakArrays. Start and end offsets are
+    on the first and last region path"""
+
+    def __init__(self, starts, ends, region_paths, region_path_indptr):
+        self.starts = np.asanyarray(starts, dtype="int64")
+        self.ends = np.asanyarray(ends, dtype="int64")
+        self.region_paths = np.asanyarray(region_paths, dtype="int64")
+        self.region_path_indptr = np.asanyarray(region_path_indptr,
+                                                dtype="int64")
+
+    def __len__(self):
+        return self.starts.size
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        starts = []
+        ends = []
+        region_paths = []
+        lens = [0]
+        for interval in intervals:
+            starts.append(interval.start_position.offset)
+            ends.append(interval.end_position.offset)
+            region_paths.extend(interval.region_paths)
+            lens.append(len(interval.region_paths))
+        return cls(starts, ends, region_paths, np.cumsum(lens))
+
+    def subset(self, idxs):
+        """Select alignments by index array or boolean mask, keeping
+        order"""
+        idxs = np.arange(len(self))[idxs]
+        rp_lengths = np.diff(self.region_path_indptr)[idxs]
+        indptr = np.insert(np.cumsum(rp_lengths), 0, 0)
+        rp_starts = self.region_path_indptr[idxs]
+        rp_idxs = np.arange(indptr[-1]) + np.repeat(
+            rp_starts-indptr[:-1], rp_lengths)
+        return self.__class__(self.starts[idxs], self.ends[idxs],
+                              self.region_paths[rp_idxs], indptr)
+
+    def to_file(self, file_name):
+        with open(file_name, "wb") as f:
+            np.savez(f, starts=self.starts, ends=self.ends,
+                     region_paths=self.region_paths,
+                     region_path_indptr=self.region_path_indptr)
+        return file_name
+
+    @classmethod
+    def from_file(cls, file_name):
+        with np.load(file_name) as data:
+            return cls(data["starts"], data["ends"], data["region_paths"],
+                       data["region_path_indptr"])
+
+    def to_intervals(self, graph=None):
+        for i in range(len(self)):
+            yield obg.Interval(
+                int(self.starts[i]), int(self.ends[i]),
+                self.region_paths[self.region_path_indptr[i]:
+                                  self.region_path_indptr[i+1]].tolist(),
+                graph)
+
+    @property
+    def first_nodes(self):
+        return self.region_paths[self.region_path_indptr[:-1]]
+
+    @property
+    def last_nodes(self):
+        return self.region_paths[self.region_path_indptr[1:]-1]
+
+    def get_strands(self):
+        """1 for alignments on forward nodes, -1 for reverse nodes and
+        0 for alignments on nodes of both directions"""
+        n_forward = np.add.reduceat(self.region_paths > 0,
+                                    self.region_path_indptr[:-1])
+        n_nodes = np.diff(self.region_path_indptr)
+        strands = np.zeros(len(self), dtype="int8")
+        strands[n_forward == n_nodes] = 1
+        strands[n_forward == 0] = -1
+        return strands
+
+
+class LinearProjector:
+    """Projects alignments to offsets on a linear path through the graph.
+
+    Alignments are projected the same way as Interval.to_linear_offsets2:
+    a start (end) on a node that is not on the path is moved to the end
+    of a previous node that is, and reverse alignments are projected as
+    their reverse. When a node has several previous nodes on the path,
+    the one furthest along the path is used"""
+
+    def __init__(self, graph, linear_path):
+        self._min_node = graph.min_node
+        self._node_sizes = np.diff(graph.node_indexes.astype("int64"))
+        n_nodes = self._node_sizes.size
+        path_nodes = np.unique(
+            np.asanyarray(linear_path._distance_to_node, dtype="int64"))
+        path_nodes = path_nodes[(path_nodes >= self._min_node) &
+                                (path_nodes < self._min_node+n_nodes)]
+        self._is_on_path = np.zeros(n_nodes, dtype="bool")
+        self._is_on_path[path_nodes-self._min_node] = True
+
+        # Offset on the path where each node starts (if on the path),
+        # or where its last previous node on the path ends. -1 if none
+        self._projected_starts = np.full(n_nodes, -1, dtype="int64")
+        node_to_distance = np.asanyarray(linear_path._node_to_distance)
+        path_offsets = node_to_distance[
+            path_nodes-linear_path.min_node].astype("int64")
+        nodes, prev_nodes = self._get_reverse_edges(graph)
+        is_valid = (nodes >= self._min_node) & (nodes < self._min_node+n_nodes) & \
+            (prev_nodes >= self._min_node) & (prev_nodes < self._min_node+n_nodes)
+        nodes, prev_nodes = nodes[is_valid], prev_nodes[is_valid]
+        prev_on_path = self._is_on_path[prev_nodes-self._min_node]
+        nodes, prev_nodes = nodes[prev_on_path], prev_nodes[prev_on_path]
+        prev_offsets = np.zeros(n_nodes, dtype="int64")
+        prev_offsets[path_nodes-self._min_node] = path_offsets
+        prev_ends = prev_offsets[prev_nodes-self._min_node] + \
+            self._node_sizes[prev_nodes-self._min_node]
+        np.maximum.at(self._projected_starts, nodes-self._min_node, prev_ends)
+        self._projected_starts[path_nodes-self._min_node] = path_offsets
+
+    @staticmethod
+    def _get_reverse_edges(graph):
+        """Node and previous node for all edges in graph.reverse_adj_list"""
+        adj_list = graph.reverse_adj_list
+        if hasattr(adj_list, "_values"):
+            n_edges = adj_list._n_edges.astype("int64")
+            first_edges = np.cumsum(n_edges)-n_edges
+            rows = np.repeat(np.arange(n_edges.size), n_edges)
+            positions = np.repeat(adj_list._indices.astype("int64"), n_edges) + \
+                np.arange(rows.size) - np.repeat(first_edges, n_edges)
+            nodes = -(rows+adj_list.node_id_offset)
+            prev_nodes = -adj_list._values[positions].astype("int64")
+            return nodes, prev_nodes
+        pairs = [(-node, -prev_node) for node, prev_nodes in adj_list.items()
+                 for prev_node in prev_nodes]
+        if not pairs:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64")
+        nodes, prev_nodes = np.array(pairs, dtype="int64").T
+        return nodes, prev_nodes
+
+    def _node_sizes_of(self, nodes):
+        return self._node_sizes[np.abs(nodes)-self._min_node]
+
+    def project(self, alignments):
+        """Returns linear starts, ends and strands (1/-1) of all
+        alignments, and a mask of those that could be projected"""
+        if len(alignments) == 0:
+            empty = np.zeros(0, dtype="int64")
+            return empty, empty, np.zeros(0, dtype="int8"), \
+                np.zeros(0, dtype="bool")
+        strands = alignments.get_strands()
+        is_reverse = strands == -1
+        first_nodes = alignments.first_nodes
+        last_nodes = alignments.last_nodes
+        starts = alignments.starts.copy()
+        ends = alignments.ends.copy()
+        # Reverse alignments are projected as their reverse
+        first_nodes[is_reverse] = -alignments.last_nodes[is_reverse]
+        last_nodes[is_reverse] = -alignments.first_nodes[is_reverse]
+        starts[is_reverse] = self._node_sizes_of(last_nodes[is_reverse]) - \
+            alignments.ends[is_reverse]
+        ends[is_reverse] = self._node_sizes_of(first_nodes[is_reverse]) - \
+            alignments.starts[is_reverse]
+
+        node_sizes = self._node_sizes_of(alignments.region_paths)
+        lengths = np.add.reduceat(node_sizes, alignments.region_path_indptr[:-1]) - \
+            alignments.starts - \
+            (self._node_sizes_of(alignments.last_nodes)-alignments.ends)
+
+        first_idxs = np.abs(first_nodes)-self._min_node
+        last_idxs = np.abs(last_nodes)-self._min_node
+        linear_starts = self._projected_starts[first_idxs] + starts
+        keeps_length = (last_nodes == first_nodes) | self._is_on_path[last_idxs]
+        linear_ends = np.where(
+            keeps_length, linear_starts + lengths,
+            self._projected_starts[last_idxs] + ends)
+        is_projected = (strands != 0) & \
+            (self._projected_starts[first_idxs] >= 0) & \
+            (keeps_length | (self._projected_starts[last_idxs] >= 0)) & \
+            (linear_ends >= linear_starts)
+        return linear_starts, linear_ends, strands, is_projected
+
+
+def write_bed(out_file, chromosome, starts, ends, strands):
+    """Write bed lines in one chunk"""
+    strand_names = np.array(["-", "+"])[(np.asanyarray(strands) > 0).astype("int")]
+    out_file.write("".join(
+        "%s\t%d\t%d\t.\t0\t%s\n" % (chromosome, start, end, strand)
+        for start, end, strand in zip(starts.tolist(), ends.tolist(),
+                                      strand_names.tolist())))
+
+
+def chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def project_alignments_to_bed(alignments, graph, linear_path, chromosome,
+                              out_file, chunk_size=100000):
+    """Project alignments (intervals) to linear_path and write them as bed
+    lines, chunk_size alignments at a time. Returns the number of
+    alignments written and skipped"""
+    projector = LinearProjector(graph, linear_path)
+    n_written = 0
+    n_skipped = 0
+    for chunk in chunks(alignments, chunk_size):
+        starts, ends, strands, is_projected = projector.project(
+            AlignmentArrays.from_intervals(chunk))
+        write_bed(out_file, chromosome, starts[is_projected],
+                  ends[is_projected], strands[is_projected])
+        n_written += np.count_nonzero(is_projected)
+        n_skipped += is_projected.size-np.count_nonzero(is_projected)
+        logging.info("Processed %d alignments", n_written+n_skipped)
+    if n_skipped:
+        logging.warning("Found no linear projection for %d alignments. "
+                        "Skipped these", n_skipped)
+    return n_written, n_skipped
@@ -0,0 +1,157 @@
+import logging
+from multiprocessing import Pool
+import numpy as np
+
+from .readsplitter import find_chunk_boundaries
+
+
+class LinearPathIndex:
+    """The nodes of a linear path in path order, with their start
+    offsets on the path and their sizes. Used to move linear intervals
+    to the graph in batches"""
+
+    def __init__(self, nodes, starts, node_sizes, length):
+        self.nodes = np.asanyarray(nodes, dtype="int64")
+        self.starts = np.asanyarray(starts, dtype="int64")
+        self.node_sizes = np.asanyarray(node_sizes, dtype="int64")
+        self.length = int(length)
+
+    @classmethod
+    def from_linear_path(cls, linear_path, graph):
+        distance_to_node = np.asanyarray(
+            linear_path._distance_to_node, dtype="int64")[:linear_path.length()]
+        starts = np.flatnonzero(np.diff(distance_to_node, prepend=-1) != 0)
+        nodes = distance_to_node[starts]
+        node_sizes = np.diff(graph.node_indexes.astype("int64"))[
+            nodes-graph.min_node]
+        return cls(nodes, starts, node_sizes, linear_path.length())
+
+    def get_intervals(self, starts, ends, is_reverse):
+        """Graph intervals covering [starts, ends) on the path, reversed
+        where is_reverse. Returns start offsets, end offsets and region
+        paths as a CSR array (region_paths, region_path_indptr)"""
+        first_idxs = np.searchsorted(self.starts, starts, side="right")-1
+        last_idxs = np.searchsorted(self.starts, ends-1, side="right")-1
+        start_offsets = starts-self.starts[first_idxs]
+        end_offsets = ends-self.starts[last_idxs]
+        n_nodes = last_idxs-first_idxs+1
+        region_path_indptr = np.insert(np.cumsum(n_nodes), 0, 0)
+        node_idxs = np.repeat(first_idxs-region_path_indptr[:-1], n_nodes) + \
+            np.arange(region_path_indptr[-1])
+        # Reverse intervals take their nodes from the end
+        reverse_rows = np.repeat(is_reverse, n_nodes)
+        reverse_node_idxs = np.repeat(
+            last_idxs+region_path_indptr[:-1], n_nodes) - \
+            np.arange(region_path_indptr[-1])
+        node_idxs = np.where(reverse_rows, reverse_node_idxs, node_idxs)
+        region_paths = np.where(reverse_rows, -self.nodes[node_idxs],
+                                self.nodes[node_idxs])
+        start_offsets, end_offsets = (
+            np.where(is_reverse,
+                     self.node_sizes[last_idxs]-end_offsets, start_offsets),
+            np.where(is_reverse,
+                     self.node_sizes[first_idxs]-start_offsets, end_offsets))
+        return start_offsets, end_offsets, region_paths, region_path_indptr
+
+
+def to_file_lines(start_offsets, end_offsets, region_paths,
+                  region_path_indptr):
+    """Intervalcollection text lines (as written by
+    Interval.to_file_line) for intervals in columnar form"""
+    region_path_strings = region_paths.astype("str").tolist()
+    indptr = region_path_indptr.tolist()
+    return "".join(
+        '{"start": %d, "end": %d, "region_paths": [%s], "direction": 1}\n' % (
+            start, end, ", ".join(region_path_strings[indptr[i]:indptr[i+1]]))
+        for i, (start, end) in enumerate(zip(start_offsets.tolist(),
+                                             end_offsets.tolist())))
+
+
+def parse_bed_chunk(data):
+    """Chromosome (without chr prefix), start, end and strand of the bed
+    lines in data"""
+    rows = [line.split() for line in data.decode().splitlines()]
+    rows = [row for row in rows if row and not row[0].startswith(("#", "track"))]
+    chromosomes = np.array([row[0].replace("chr", "") for row in rows],
+                           dtype="str")
+    starts = np.array([row[1] for row in rows], dtype="int64")
+    ends = np.array([row[2] for row in rows], dtype="int64")
+    is_reverse = np.array([row[5] == "-" for row in rows], dtype="bool")
+    return chromosomes, starts, ends, is_reverse
+
+
+_path_indexes = None
+
+
+def _set_path_indexes(path_indexes):
+    global _path_indexes
+    _path_indexes = path_indexes
+
+
+def convert_chunk(data, path_indexes):
+    """Returns a dict from chromosome to the intervalcollection lines of
+    its reads in data, and the number of reads skipped because they are
+    empty or outside the linear path"""
+    chromosomes, starts, ends, is_reverse = parse_bed_chunk(data)
+    lines = {}
+    n_skipped = 0
+    for chromosome, path_index in path_indexes.items():
+        is_chromosome = chromosomes == chromosome
+        is_valid = is_chromosome & (starts >= 0) & (ends > starts) & \
+            (ends <= path_index.length)
+        n_skipped += np.count_nonzero(is_chromosome & ~is_valid)
+        lines[chromosome] = to_file_lines(*path_index.get_intervals(
+            starts[is_valid], ends[is_valid], is_reverse[is_valid]))
+    return lines, n_skipped
+
+
+def _convert_file_chunk(args):
+    file_name, start, end = args
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        data = f.read(end-start)
+    return convert_chunk(data, _path_indexes)
+
+
+class LinearReadsConverter:
+    """Moves reads in a bed file to intervals on graphs, one
+    intervalcollection file per chromosome. Chunks of the bed file are
+    converted in parallel worker processes and written in order.
+    Reads on other chromosomes are ignored"""
+
+    def __init__(self, path_indexes, chunk_size=64*1024*1024,
+                 n_processes=1):
+        self._path_indexes = path_indexes
+        self._chunk_size = chunk_size
+        self._n_processes = n_processes
+
+    def _get_chunk_results(self, file_name):
+        chunks = find_chunk_boundaries(file_name, self._chunk_size)
+        logging.info("Converting %s in %d chunks using %d processes",
+                     file_name, len(chunks), self._n_processes)
+        args = ((file_name, start, end) for start, end in chunks)
+        if self._n_processes == 1:
+            _set_path_indexes(self._path_indexes)
+            yield from map(_convert_file_chunk, args)
+            return
+        with Pool(self._n_processes, initializer=_set_path_indexes,
+                  initargs=(self._path_indexes,)) as pool:
+            yield from pool.imap(_convert_file_chunk, args)
+
+    def convert(self, bed_file_name, out_base_name):
+        out_files = {chromosome: open(
+            out_base_name + "_" + chromosome + ".intervalcollection", "w",
+            buffering=16*1024*1024) for chromosome in self._path_indexes}
+        n_skipped = 0
+        for i, (lines, n_chunk_skipped) in enumerate(
+                self._get_chunk_results(bed_file_name)):
+            logging.info("Chunk #%d", i)
+            for chromosome, chromosome_lines in lines.items():
+                out_files[chromosome].write(chromosome_lines)
+            n_skipped += n_chunk_skipped
+        for f in out_files.values():
+            f.close()
+        if n_skipped:
+            logging.warning("Skipped %d reads that were empty or outside "
+                            "the linear paths", n_skipped)
+        return n_skipped
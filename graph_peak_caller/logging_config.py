@@ -1,8 +1,6 @@
 import logging
 import sys
 import warnings
-import numpy as np
-import scipy
 
 def customwarn(message, category, filename, lineno, file=None, line=None):
     sys.stdout.write(warnings.formatwarning(message, category, filename, lineno))
@@ -12,7 +10,7 @@ def set_logging_config(chosen_level=1):
     # Remove handlers already set (if not, new config will not be set)
     root = logging.getLogger()
     if root.handlers:
-        for handler in root.handlers:
+        for handler in list(root.handlers):
             root.removeHandler(handler)
 
     class InfoFilter(logging.Filter):
@@ -51,5 +49,13 @@ def set_logging_config(chosen_level=1):
     )
 
     warnings.showwarning = customwarn
+
+
+def set_numpy_error_config():
+    """Print numpy floating point errors instead of warning. Only done
+    if numpy is already imported, so that subcommands not using numpy
+    do not pay for importing it"""
+    if "numpy" not in sys.modules:
+        return
+    import numpy as np
     np.seterr(all='print')
-    scipy.seterr(all='print')
@@ -4,11 +4,58 @@ import offsetbasedgraph as obg
 from pyvg.conversion import vg_json_file_to_interval_collection
 from . import CallPeaks
 from .sparsepvalues import PToQValuesMapper
-from .sparsediffs import SparseValues
-from .intervals import Intervals, UniqueIntervals
+from .intervals import Intervals, UniqueIntervals, AlignmentIntervals
+from .linearprojection import AlignmentArrays
+from .sharding import ShardedCallPeaks
+from .scheduler import MemoryEstimator, MemoryScheduler
+from .prefetch import Prefetcher
 
 from .peakfasta import PeakFasta
-from offsetbasedgraph import NumpyIndexedInterval
+from .control import get_shared_background, get_extensions
+from .control.backgroundcache import BackgroundCache
+from .control.linearmap import LinearMap
+from . import resources
+
+
+def parse_intervals(reads, graph):
+    """Intervals in the file reads, streamed from the file"""
+    if reads.endswith(".intervalcollection"):
+        try:
+            return obg.IntervalCollection.from_file(reads, graph=graph)
+        except OSError:
+            return obg.IntervalCollection.from_file(
+                reads, graph=graph, text_file=True)
+    return vg_json_file_to_interval_collection(reads, graph)
+
+
+def read_intervals(reads, graph, keep_duplicates=False):
+    if isinstance(reads, Intervals) or isinstance(reads, UniqueIntervals):
+        # New instance so that read counts start at zero for each pass
+        return reads.__class__(reads._intervals)
+    if isinstance(reads, AlignmentArrays):
+        reads = AlignmentIntervals(reads, graph)
+    else:
+        reads = parse_intervals(reads, graph)
+
+    if keep_duplicates:
+        return Intervals(reads)
+    return UniqueIntervals(reads)
+
+
+def get_background(graph, control, config, linear_map, cache=None):
+    """SharedBackground for the control reads. If a cache is given and
+    control is a file name, the track is looked up in and stored to
+    the cache"""
+    def create():
+        return get_shared_background(
+            graph, read_intervals(control, graph, config.keep_duplicates),
+            config, linear_map)
+
+    if cache is None or not isinstance(control, str):
+        return create()
+    key = cache.get_key(control, graph, linear_map,
+                        get_extensions(config), config)
+    return cache.get_or_create(key, create, graph)
 
 
 class MultipleGraphsCallpeaks:
@@ -71,100 +118,327 @@ class MultipleGraphsCallpeaks:
         self.run_to_p_values()
         if self.stop_after_p_values:
             logging.info("Stopping, as planned, after p-values")
+            self._reporter.flush()
             return
         self.create_joined_q_value_mapping()
         self.run_from_p_values()
+        self._reporter.flush()
 
     def get_intervals(self, sample, control, graph):
         if isinstance(sample, Intervals) or isinstance(sample, UniqueIntervals):
             logging.info("Sample is already intervalcollection.")
             return sample, control
-        elif sample.endswith(".intervalcollection"):
-            try:
-                sample = obg.IntervalCollection.from_file(
-                    sample, graph=graph)
-            except OSError:
-                sample = obg.IntervalCollection.from_file(
-                    sample, graph=graph, text_file=True)
-            try:
-                control = obg.IntervalCollection.from_file(
-                    control, graph=graph)
-            except:
-                control = obg.IntervalCollection.from_file(
-                    control, graph=graph, text_file=True)
-        else:
-            logging.info("Creating interval collections from files")
-            sample = vg_json_file_to_interval_collection(sample, graph)
-            control = vg_json_file_to_interval_collection(control, graph)
-
         if self._config.keep_duplicates:
             logging.warning("Keeping duplicates. Should only be used for testing.")
-            return Intervals(sample), Intervals(control)
-        else:
-            return UniqueIntervals(sample), UniqueIntervals(control)
+        return (read_intervals(sample, graph, self._config.keep_duplicates),
+                read_intervals(control, graph, self._config.keep_duplicates))
 
     def run_to_p_values(self):
-        for name, graph_file_name, sample, control, lin_map in \
-            zip(self.names, self.graph_file_names,
-                self.samples, self.controls, self.linear_maps):
-            logging.info("Running to p values, %s" % name)
-            ob_graph = obg.Graph.from_file(
-                graph_file_name)
-            sample, control = self.get_intervals(sample, control, ob_graph)
-            config = self._config.copy()
-            config.linear_map_name = lin_map
-            caller = CallPeaks(ob_graph, config,
-                               self._reporter.get_sub_reporter(name))
+        if self._config.memory_limit is not None:
+            self._run_scheduled_to_p_values()
+            return
+        inputs = Prefetcher(self._get_p_values_input, range(len(self.names)),
+                            self._config.prefetch_depth)
+        for i, graph_input in enumerate(inputs):
+            self._run_graph_to_p_values(i, graph_input)
+            self._release_if_needed(self._reporter.get_sub_reporter(
+                self.names[i]))
+
+    def _release_if_needed(self, reporter):
+        """Keep the results of the p value stage in memory for calling
+        peaks as long as they fit in config.handoff_memory. Else they are
+        read back from file, to keep memory use down with many graphs"""
+        if not self._reporter.write_files or len(self.names) == 1:
+            return
+        if self._reporter.memory_use() > self._config.handoff_memory:
+            logging.info("Results kept in memory use more than %.1f GB. "
+                         "Will read them back from file",
+                         self._config.handoff_memory/1024**3)
+            reporter.release()
+
+    def _get_p_values_input(self, i, prefetch=None):
+        """Graph, linear map, sample and control for graph i. When
+        prefetching, the linear map is loaded here as well, and reads
+        are parsed into AlignmentArrays, so that this is done in the
+        prefetch thread. A control that is the same file as the sample
+        is parsed only once. With a background cache, the control is
+        left as a file name, since it is looked up by file"""
+        if prefetch is None:
+            prefetch = self._config.prefetch_depth > 0
+        ob_graph = resources.get_graph(self.graph_file_names[i])
+        lin_map, sample, control = \
+            self.linear_maps[i], self.samples[i], self.controls[i]
+        if not prefetch:
+            return ob_graph, lin_map, sample, control
+        if isinstance(lin_map, str):
+            lin_map = resources.get_linear_map(lin_map, ob_graph)
+        sample_file = sample
+        if isinstance(sample, str):
+            logging.info("Prefetching reads from %s", sample)
+            sample = AlignmentArrays.from_intervals(
+                parse_intervals(sample, ob_graph))
+        is_cached = BackgroundCache.from_config(self._config) is not None
+        if isinstance(control, str) and not is_cached:
+            if control == sample_file:
+                control = sample
+            else:
+                logging.info("Prefetching reads from %s", control)
+                control = AlignmentArrays.from_intervals(
+                    parse_intervals(control, ob_graph))
+        return ob_graph, lin_map, sample, control
+
+    def _run_scheduled_to_p_values(self):
+        """Run graphs in parallel processes, largest first, keeping the
+        estimated total memory use below config.memory_limit"""
+        if not self._reporter.write_files:
+            raise ValueError("Results must be written to files when graphs "
+                             "are run in separate processes")
+        estimator = MemoryEstimator(self._config.memory_history)
+        features = [estimator.get_features(graph_file_name, [sample, control])
+                    for graph_file_name, sample, control in
+                    zip(self.graph_file_names, self.samples, self.controls)]
+        estimates = [estimator.estimate(f) for f in features]
+        scheduler = MemoryScheduler(self._config.memory_limit)
+        peak_memory = scheduler.run(
+            self._run_scheduled_graph, list(range(len(self.names))),
+            estimates)
+        for f, memory in zip(features, peak_memory):
+            estimator.add(f, memory)
+        estimator.save()
+
+    def _run_scheduled_graph(self, i):
+        self._run_graph_to_p_values(i)
+        self._reporter.flush()
+
+    def _run_graph_to_p_values(self, i, graph_input=None):
+        cache = BackgroundCache.from_config(self._config)
+        name = self.names[i]
+        logging.info("Running to p values, %s" % name)
+        if graph_input is None:
+            graph_input = self._get_p_values_input(i, prefetch=False)
+        ob_graph, lin_map, sample, control = graph_input
+        config = self._config.copy()
+        config.linear_map_name = lin_map
+        if config.window_size is not None:
+            caller = ShardedCallPeaks(
+                ob_graph, config, self._reporter.get_sub_reporter(name))
+            sample, control = self.get_intervals(sample, control,
+                                                 ob_graph)
             caller.run_to_p_values(sample, control)
-            logging.info("Done until p values.")
-            logging.info("In total %d duplicates were removed from sample" % sample.n_duplicates)
+            return
+        caller = CallPeaks(ob_graph, config,
+                           self._reporter.get_sub_reporter(name))
+        if cache is not None and isinstance(control, str):
+            background = get_background(ob_graph, control, config,
+                                        lin_map, cache)
+            sample = read_intervals(sample, ob_graph,
+                                    config.keep_duplicates)
+            caller.run_to_p_values(sample, None, background)
+        else:
+            sample, control = self.get_intervals(sample, control,
+                                                 ob_graph)
+            caller.run_to_p_values(sample, control)
+        logging.info("Done until p values.")
+        logging.info("In total %d duplicates were removed from sample" % sample.n_duplicates)
 
     def create_joined_q_value_mapping(self):
-        mapper = PToQValuesMapper.from_files(self._reporter._base_name)
+        # P values still in memory are used from there, others are
+        # read from file
+        mapper = PToQValuesMapper.from_p_values_tracks(
+            self._reporter.get_sub_reporter(name).get("pvalues")
+            for name in self.names)
         self._q_value_mapping = mapper.get_p_to_q_values()
 
     def run_from_p_values(self, only_chromosome=None):
+        indices = []
         for i, name in enumerate(self.names):
+            if only_chromosome is not None and only_chromosome != name:
+                logging.info("Skipping %s" % str(name))
+                continue
+            indices.append(i)
+        inputs = Prefetcher(self._get_from_p_values_input, indices,
+                            self._config.prefetch_depth)
+        for i, graph_input in zip(indices, inputs):
+            name = self.names[i]
             logging.info("Name: %s" % name)
-            if only_chromosome is not None:
-                if only_chromosome != name:
-                    logging.info("Skipping %s" % str(name))
-                    continue
-            graph_file_name = self.graph_file_names[i]
-            ob_graph = obg.Graph.from_numpy_file(
-                graph_file_name)
-
-            variant_maps = None
-            if self.variant_maps_path is not None:
-                from offsetbasedgraph.vcfmap import load_variant_maps
-                logging.info("Will use variant maps when calling peaks (in max path finding)")
-                variant_maps = load_variant_maps(name, self.variant_maps_path)
-
-            linear_path = None
-            if self.linear_path_file_names is not None:
-                linear_path = NumpyIndexedInterval.from_file(self.linear_path_file_names[i])
-
+            ob_graph, linear_path, variant_maps, sequence_graph = graph_input
             assert ob_graph is not None
-            caller = CallPeaks(ob_graph, self._config,
-                               self._reporter.get_sub_reporter(name),
+            if self._config.window_size is not None:
+                caller = ShardedCallPeaks(
+                    ob_graph, self._config,
+                    self._reporter.get_sub_reporter(name),
+                    variant_maps=variant_maps)
+                caller.p_to_q_values_mapping = self._q_value_mapping
+                caller.call_peaks_from_q_values(linear_path)
+                self._write_sequences(caller, sequence_graph)
+                continue
+            reporter = self._reporter.get_sub_reporter(name)
+            caller = CallPeaks(ob_graph, self._config, reporter,
                                variant_maps=variant_maps)
             caller.p_to_q_values_mapping = self._q_value_mapping
-            if name != "":
-                name += "_"
-            caller.p_values_pileup = SparseValues.from_sparse_files(
-                self._reporter._base_name + name + "pvalues")
-            caller.touched_nodes = set(np.load(
-                self._reporter._base_name + name + "touched_nodes.npy"))
+            caller.p_values_pileup = reporter.get("pvalues")
+            caller.touched_nodes = reporter.get("touched_nodes")
             caller.get_q_values()
             caller.call_peaks_from_q_values(linear_path)
-            if self.sequence_retrievers is not None:
+            reporter.release()
+            self._write_sequences(caller, sequence_graph)
+
+    def _get_from_p_values_input(self, i):
+        """Graph, linear path, variant maps and sequence graph for graph i"""
+        ob_graph = resources.get_graph(self.graph_file_names[i])
+
+        variant_maps = None
+        if self.variant_maps_path is not None:
+            from offsetbasedgraph.vcfmap import load_variant_maps
+            logging.info("Will use variant maps when calling peaks (in max path finding)")
+            variant_maps = load_variant_maps(self.names[i],
+                                             self.variant_maps_path)
+
+        linear_path = None
+        if self.linear_path_file_names is not None:
+            linear_path = resources.get_linear_path(
+                self.linear_path_file_names[i])
+
+        sequence_graph = None
+        if self.sequence_retrievers is not None:
+            try:
+                sequence_graph = next(self.sequence_retrievers)
+            except (FileNotFoundError, StopIteration):
+                logging.warning("Could not find sequence graphs. Will not store max paths.")
+        return ob_graph, linear_path, variant_maps, sequence_graph
+
+    def _write_sequences(self, caller, sequence_graph):
+        if sequence_graph is None:
+            return
+        for reporter, max_paths in caller.peak_sets:
+            PeakFasta(sequence_graph).write_max_path_sequences(
+                reporter._base_name + "sequences.fasta", max_paths)
+
+
+class MultipleSamplesCallpeaks:
+    """Calls peaks for many samples on the same set of graphs.
+
+    Each chromosome's graph and linear map is read only once, and the
+    background track of each distinct control is created once (for the
+    whole graph) and shared by all samples using that control.
+    samples is a dict from sample name to a list of reads (file names
+    or Intervals) per graph. controls is a similar dict, where missing
+    or None controls means the sample is used as its own control.
+    Output files are prefixed with <out_name><sample_name>_<graph_name>_
+    """
+
+    def __init__(self, graph_names, graph_file_names, sample_names,
+                 samples, controls, linear_maps, config, reporter,
+                 sequence_graph_file_names=None,
+                 linear_path_file_names=None):
+        self._config = config
+        self._reporter = reporter
+        self.names = graph_names
+        self.graph_file_names = graph_file_names
+        self.sample_names = sample_names
+        self.samples = samples
+        self.controls = controls if controls is not None else {}
+        self.linear_maps = linear_maps
+        self.sequence_graph_file_names = sequence_graph_file_names
+        self.linear_path_file_names = linear_path_file_names
+        self._q_value_mappings = {}
+
+    def run(self):
+        self.run_to_p_values()
+        self.create_q_value_mappings()
+        self.run_from_p_values()
+        self._reporter.flush()
+
+    def has_control(self, sample_name):
+        return self.controls.get(sample_name) is not None
+
+    def get_config(self, sample_name, linear_map_name=None):
+        config = self._config.copy()
+        config.has_control = self.has_control(sample_name)
+        config.linear_map_name = linear_map_name
+        return config
+
+    def get_reporter(self, sample_name, name):
+        return self._reporter.get_sub_reporter(
+            sample_name).get_sub_reporter(name)
+
+    def _get_control_key(self, sample_name, i):
+        if not self.has_control(sample_name):
+            return ("input", sample_name)
+        control = self.controls[sample_name][i]
+        if isinstance(control, str):
+            return ("control", control)
+        return ("control", id(control))
+
+    def run_to_p_values(self):
+        cache = BackgroundCache.from_config(self._config)
+        for i, name in enumerate(self.names):
+            logging.info("Running %d samples to p values, %s",
+                         len(self.sample_names), name)
+            graph = resources.get_graph(self.graph_file_names[i])
+            linear_map = resources.get_linear_map(self.linear_maps[i], graph)
+            backgrounds = {}
+            for sample_name in self.sample_names:
+                logging.info("Sample %s", sample_name)
+                config = self.get_config(sample_name, self.linear_maps[i])
+                sample = read_intervals(self.samples[sample_name][i], graph,
+                                        config.keep_duplicates)
+                key = self._get_control_key(sample_name, i)
+                if key not in backgrounds:
+                    control = self.samples[sample_name][i] \
+                        if key[0] == "input" else self.controls[sample_name][i]
+                    backgrounds[key] = get_background(
+                        graph, control, config, linear_map, cache)
+                else:
+                    logging.info("Reusing background track")
+                caller = CallPeaks(graph, config,
+                                   self.get_reporter(sample_name, name))
+                caller.run_to_p_values(sample, None, backgrounds[key])
+                logging.info("In total %d duplicates were removed from sample",
+                             sample.n_duplicates)
+                if self._reporter.write_files and \
+                        self._reporter.memory_use() > \
+                        self._config.handoff_memory:
+                    self.get_reporter(sample_name, name).release()
+
+    def create_q_value_mappings(self):
+        for sample_name in self.sample_names:
+            mapper = PToQValuesMapper.from_p_values_tracks(
+                self.get_reporter(sample_name, name).get("pvalues")
+                for name in self.names)
+            self._q_value_mappings[sample_name] = mapper.get_p_to_q_values()
+
+    def run_from_p_values(self):
+        for i, name in enumerate(self.names):
+            logging.info("Calling peaks from p values, %s", name)
+            graph = resources.get_graph(self.graph_file_names[i])
+            linear_path = None
+            if self.linear_path_file_names is not None:
+                linear_path = resources.get_linear_path(
+                    self.linear_path_file_names[i])
+            sequence_graph = None
+            if self.sequence_graph_file_names is not None:
                 try:
-                    sequencegraph = self.sequence_retrievers.__next__()
+                    sequence_graph = resources.get_sequence_graph(
+                        self.sequence_graph_file_names[i])
                 except FileNotFoundError:
-                    logging.warning("Could not find sequence graphs. Will not store max paths.")
+                    logging.warning("Could not find sequence graph %s. "
+                                    "Will not store max path sequences.",
+                                    self.sequence_graph_file_names[i])
+            for sample_name in self.sample_names:
+                reporter = self.get_reporter(sample_name, name)
+                caller = CallPeaks(graph, self.get_config(sample_name),
+                                   reporter)
+                caller.p_to_q_values_mapping = \
+                    self._q_value_mappings[sample_name]
+                caller.p_values_pileup = reporter.get("pvalues")
+                caller.touched_nodes = reporter.get("touched_nodes")
+                caller.get_q_values()
+                caller.call_peaks_from_q_values(linear_path, chromosome=name)
+                reporter.release()
+                if sequence_graph is None:
                     continue
-
-                PeakFasta(sequencegraph).write_max_path_sequences(
-                  self._reporter._base_name + name + "sequences.fasta", caller.max_path_peaks)
-                #caller.save_max_path_sequences_to_fasta_file(
-                #    "sequences.fasta", self.sequence_retrievers.__next__())
+                for sub_reporter, max_paths in caller.peak_sets:
+                    PeakFasta(sequence_graph).write_max_path_sequences(
+                        sub_reporter._base_name + "sequences.fasta",
+                        max_paths)
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+def get_node_sizes(graph, nodes):
+    return np.diff(graph.node_indexes.astype("int64"))[
+        np.abs(nodes)-graph.min_node]
+
+
+class OverlapIndex:
+    """Index of the area each interval covers on each (directed) node,
+    stored as rows (node, interval_id, start, end) sorted by node and
+    start offset. Used to join two collections of intervals on overlap
+    without comparing all pairs of intervals."""
+
+    def __init__(self, nodes, interval_ids, starts, ends, lengths):
+        order = np.lexsort((starts, nodes))
+        self.nodes = nodes[order]
+        self.interval_ids = interval_ids[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.lengths = lengths
+
+    def __len__(self):
+        return self.lengths.size
+
+    @classmethod
+    def from_region_paths(cls, region_paths, region_path_indptr,
+                          start_offsets, end_offsets, graph):
+        n_rps = np.diff(region_path_indptr)
+        interval_ids = np.repeat(np.arange(n_rps.size), n_rps)
+        nodes = np.asanyarray(region_paths, dtype="int64")
+        starts = np.zeros(nodes.size, dtype="int64")
+        ends = get_node_sizes(graph, nodes)
+        starts[region_path_indptr[:-1]] = start_offsets
+        ends[region_path_indptr[1:]-1] = end_offsets
+        ends = np.maximum(ends, starts)
+        lengths = np.bincount(interval_ids, ends-starts,
+                              minlength=n_rps.size).astype("int64")
+        return cls(nodes, interval_ids, starts, ends, lengths)
+
+    @classmethod
+    def from_intervals(cls, intervals, graph=None):
+        intervals = list(intervals)
+        if graph is None and intervals:
+            graph = intervals[0].graph
+        assert graph is not None or not intervals, \
+            "Graph is needed to create overlap index"
+        rp_lengths = [len(interval.region_paths) for interval in intervals]
+        return cls.from_region_paths(
+            np.concatenate([[]] + [i.region_paths for i in intervals]),
+            np.insert(np.cumsum(rp_lengths, dtype="int64"), 0, 0),
+            [i.start_position.offset for i in intervals],
+            [i.end_position.offset for i in intervals], graph)
+
+    @classmethod
+    def from_peak_arrays(cls, peaks, graph):
+        return cls.from_region_paths(
+            peaks.region_paths, peaks.region_path_indptr,
+            peaks.starts, peaks.ends, graph)
+
+    def get_overlaps(self, other):
+        """All pairs of intervals (id in self, id in other) covering
+        some common area, with the size of the overlap"""
+        if not self.nodes.size or not other.nodes.size:
+            empty = np.array([], dtype="int64")
+            return empty, empty, empty
+        min_node = min(self.nodes[0], other.nodes[0])
+        scale = max(self.ends.max(), other.ends.max())+1
+        other_keys = (other.nodes-min_node)*scale+other.starts
+        node_keys = (self.nodes-min_node)*scale
+        lo = np.searchsorted(other_keys, node_keys)
+        hi = np.searchsorted(other_keys, node_keys+self.ends)
+        n_candidates = hi-lo
+        rows = np.repeat(np.arange(self.nodes.size), n_candidates)
+        other_rows = np.arange(rows.size) - np.repeat(
+            np.cumsum(n_candidates)-n_candidates-lo, n_candidates)
+        overlaps = np.minimum(self.ends[rows], other.ends[other_rows]) - \
+            np.maximum(self.starts[rows], other.starts[other_rows])
+        mask = overlaps > 0
+        pair_keys = self.interval_ids[rows[mask]]*len(other) + \
+            other.interval_ids[other_rows[mask]]
+        unique_keys, inverse = np.unique(pair_keys, return_inverse=True)
+        pair_overlaps = np.bincount(inverse, overlaps[mask]).astype("int64")
+        return (unique_keys // len(other), unique_keys % len(other),
+                pair_overlaps)
+
+    def overlapping_pairs(self, other, minimum_overlap=1):
+        ids, other_ids, overlaps = self.get_overlaps(other)
+        mask = overlaps >= minimum_overlap
+        return ids[mask], other_ids[mask]
+
+    def similar_pairs(self, other, allowed_mismatches=1):
+        """Pairs where the overlap covers all but allowed_mismatches
+        of the interval in self (Interval.is_approx_equal)"""
+        ids, other_ids, overlaps = self.get_overlaps(other)
+        mask = overlaps >= self.lengths[ids]-allowed_mismatches
+        return ids[mask], other_ids[mask]
+
+    def identical_pairs(self, other):
+        """Pairs covering exactly the same area"""
+        ids, other_ids, overlaps = self.get_overlaps(other)
+        mask = (overlaps == self.lengths[ids]) & \
+            (overlaps == other.lengths[other_ids])
+        return ids[mask], other_ids[mask]
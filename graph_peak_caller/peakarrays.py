@@ -0,0 +1,234 @@
+import logging
+import os
+import numpy as np
+
+from .peakcollection import Peak, PeakCollection
+
+
+class PeakArrays:
+    """Columnar representation of a collection of peaks. Region paths
+    are stored as a CSR array (region_paths, region_path_indptr) and
+    chromosomes as codes into chromosome_names (-1 for None).
+    Peak objects are only created when asked for."""
+
+    def __init__(self, starts, ends, region_paths, region_path_indptr,
+                 scores, directions=None, is_diff=None, is_ambigous=None,
+                 unique_ids=None, chromosome_codes=None,
+                 chromosome_names=None):
+        n = len(starts)
+        self.starts = np.asanyarray(starts, dtype="int64")
+        self.ends = np.asanyarray(ends, dtype="int64")
+        self.region_paths = np.asanyarray(region_paths, dtype="int64")
+        self.region_path_indptr = np.asanyarray(region_path_indptr,
+                                                dtype="int64")
+        self.scores = np.asanyarray(scores, dtype="float64")
+        self.directions = np.ones(n, dtype="int8") if directions is None \
+            else np.asanyarray(directions, dtype="int8")
+        self.is_diff = np.zeros(n, dtype="int8") if is_diff is None \
+            else np.asanyarray(is_diff, dtype="int8")
+        self.is_ambigous = np.zeros(n, dtype="int8") if is_ambigous is None \
+            else np.asanyarray(is_ambigous, dtype="int8")
+        self.unique_ids = np.full(n, "None") if unique_ids is None \
+            else np.asanyarray(unique_ids, dtype="str")
+        self.chromosome_codes = np.full(n, -1, dtype="int16") \
+            if chromosome_codes is None \
+            else np.asanyarray(chromosome_codes, dtype="int16")
+        self.chromosome_names = np.array([], dtype="str") \
+            if chromosome_names is None \
+            else np.asanyarray(chromosome_names, dtype="str")
+
+    def __len__(self):
+        return self.starts.size
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(
+            np.array_equal(getattr(self, name), getattr(other, name))
+            for name in ("starts", "ends", "region_paths",
+                         "region_path_indptr", "scores", "directions",
+                         "is_diff", "is_ambigous", "unique_ids"))\
+            and self.get_chromosomes() == other.get_chromosomes()
+
+    def __repr__(self):
+        return "PeakArrays(%d peaks)" % len(self)
+
+    def get_region_paths(self, i):
+        return self.region_paths[
+            self.region_path_indptr[i]:self.region_path_indptr[i+1]]
+
+    def get_chromosomes(self):
+        names = list(self.chromosome_names) + [None]
+        return [names[code] for code in self.chromosome_codes]
+
+    def get_peak(self, i):
+        peak = Peak(int(self.starts[i]), int(self.ends[i]),
+                    [int(rp) for rp in self.get_region_paths(i)],
+                    direction=int(self.directions[i]),
+                    score=float(self.scores[i]),
+                    unique_id=str(self.unique_ids[i]))
+        peak.info = (int(self.is_diff[i]), int(self.is_ambigous[i]))
+        code = self.chromosome_codes[i]
+        if code >= 0:
+            peak.chromosome = str(self.chromosome_names[code])
+        return peak
+
+    def __iter__(self):
+        return (self.get_peak(i) for i in range(len(self)))
+
+    def to_peak_collection(self):
+        return PeakCollection(list(self))
+
+    def subset(self, idxs):
+        """Select peaks by index array or boolean mask, keeping order"""
+        idxs = np.arange(len(self))[idxs]
+        rp_lengths = np.diff(self.region_path_indptr)[idxs]
+        indptr = np.insert(np.cumsum(rp_lengths), 0, 0)
+        rp_starts = self.region_path_indptr[idxs]
+        rp_idxs = np.arange(indptr[-1]) + np.repeat(
+            rp_starts-indptr[:-1], rp_lengths)
+        return self.__class__(
+            self.starts[idxs], self.ends[idxs], self.region_paths[rp_idxs],
+            indptr, self.scores[idxs], self.directions[idxs],
+            self.is_diff[idxs], self.is_ambigous[idxs],
+            self.unique_ids[idxs], self.chromosome_codes[idxs],
+            self.chromosome_names)
+
+    def filter_by_score(self, min_score):
+        return self.subset(self.scores >= min_score)
+
+    def get_chromosome(self, chromosome):
+        codes = np.flatnonzero(self.chromosome_names == chromosome)
+        if not codes.size:
+            return self.subset(np.zeros(len(self), dtype="bool"))
+        return self.subset(self.chromosome_codes == codes[0])
+
+    def split_by_chromosome(self):
+        return {str(name): self.subset(self.chromosome_codes == code)
+                for code, name in enumerate(self.chromosome_names)}
+
+    @classmethod
+    def from_peaks(cls, peaks):
+        peaks = list(peaks)
+        rp_lengths = [len(peak.region_paths) for peak in peaks]
+        region_paths = np.concatenate(
+            [[]] + [peak.region_paths for peak in peaks])
+        chromosomes = [peak.chromosome for peak in peaks]
+        chromosome_names = sorted(set(c for c in chromosomes if c is not None))
+        code_lookup = {name: code for code, name in
+                       enumerate(chromosome_names)}
+        code_lookup[None] = -1
+        return cls([peak.start_position.offset for peak in peaks],
+                   [peak.end_position.offset for peak in peaks],
+                   region_paths,
+                   np.insert(np.cumsum(rp_lengths, dtype="int64"), 0, 0),
+                   [peak.score for peak in peaks],
+                   [peak.direction for peak in peaks],
+                   [peak.info[0] for peak in peaks],
+                   [peak.info[1] for peak in peaks],
+                   [str(peak.unique_id) for peak in peaks],
+                   [code_lookup[c] for c in chromosomes],
+                   chromosome_names)
+
+    def to_approx_linear_offsets(self, linear_path):
+        """Approximate start and end of all peaks on linear_path, as in
+        Peak.to_approx_linear_peak: from the lowest to the highest node
+        id of the peak that is on the path. Also returns a mask of the
+        peaks that have nodes on the path"""
+        node_offsets = get_path_node_offsets(linear_path)
+        if not len(self):
+            return self.starts.copy(), self.ends.copy(), \
+                np.zeros(0, dtype="bool")
+        node_idxs = self.region_paths-linear_path.min_node
+        in_range = (node_idxs >= 0) & (node_idxs < node_offsets.size)
+        is_on_path = np.zeros(in_range.size, dtype="bool")
+        is_on_path[in_range] = node_offsets[node_idxs[in_range]] >= 0
+        max_int = np.iinfo("int64").max
+        first_idxs = self.region_path_indptr[:-1]
+        last_idxs = self.region_path_indptr[1:]-1
+        first_nodes = np.minimum.reduceat(
+            np.where(is_on_path, self.region_paths, max_int), first_idxs)
+        last_nodes = np.maximum.reduceat(
+            np.where(is_on_path, self.region_paths, -max_int), first_idxs)
+        has_nodes = first_nodes != max_int
+        first_nodes[~has_nodes] = last_nodes[~has_nodes] = linear_path.min_node
+        starts = node_offsets[first_nodes-linear_path.min_node] + np.where(
+            first_nodes == self.region_paths[first_idxs], self.starts, 0)
+        ends = node_offsets[last_nodes-linear_path.min_node] + np.where(
+            last_nodes == self.region_paths[last_idxs], self.ends, 0)
+        return starts, ends, has_nodes
+
+    def to_approx_linear_bed_file(self, file_name, linear_path, chromosome):
+        """Write the approximate linear positions of the peaks as in
+        NonGraphPeakCollection.to_bed_file. Peaks with no nodes on
+        linear_path are skipped"""
+        starts, ends, has_nodes = self.to_approx_linear_offsets(linear_path)
+        if not np.all(has_nodes):
+            logging.warning("Skipping %d peaks with no nodes on the linear path",
+                            np.count_nonzero(~has_nodes))
+        with open(file_name, "w") as f:
+            f.write("".join(
+                "%s\t%d\t%d\t.\t.\t.\t.\t.\t%.2f\n" % (
+                    chromosome, start, end, score)
+                for start, end, score in zip(starts[has_nodes].tolist(),
+                                             ends[has_nodes].tolist(),
+                                             self.scores[has_nodes].tolist())))
+        logging.info("Wrote to bed-file %s" % file_name)
+
+    def to_file(self, file_name):
+        with open(file_name, "wb") as f:
+            np.savez(f, starts=self.starts, ends=self.ends,
+                     region_paths=self.region_paths,
+                     region_path_indptr=self.region_path_indptr,
+                     scores=self.scores, directions=self.directions,
+                     is_diff=self.is_diff, is_ambigous=self.is_ambigous,
+                     unique_ids=self.unique_ids,
+                     chromosome_codes=self.chromosome_codes,
+                     chromosome_names=self.chromosome_names)
+        return file_name
+
+    @classmethod
+    def from_file(cls, file_name):
+        with np.load(file_name) as data:
+            return cls(data["starts"], data["ends"], data["region_paths"],
+                       data["region_path_indptr"], data["scores"],
+                       data["directions"], data["is_diff"],
+                       data["is_ambigous"], data["unique_ids"],
+                       data["chromosome_codes"], data["chromosome_names"])
+
+    def to_text_file(self, file_name):
+        PeakCollection(list(self)).to_file(file_name, text_file=True)
+        return file_name
+
+    def to_files(self, text_file_name):
+        """Write both the text intervalcollection and the .npz file"""
+        self.to_text_file(text_file_name)
+        self.to_file(get_arrays_file_name(text_file_name))
+
+    @classmethod
+    def from_intervalcollection_file(cls, file_name):
+        """Read from the .npz file next to the text file if it is
+        up to date, else parse the text file"""
+        arrays_file_name = get_arrays_file_name(file_name)
+        if os.path.isfile(arrays_file_name) and (
+                not os.path.isfile(file_name) or
+                os.path.getmtime(arrays_file_name) >= os.path.getmtime(file_name)):
+            return cls.from_file(arrays_file_name)
+        logging.info("No up to date %s found. Parsing %s",
+                     arrays_file_name, file_name)
+        return cls.from_peaks(
+            PeakCollection.from_file(file_name, text_file=True))
+
+
+def get_path_node_offsets(linear_path):
+    """Offset of each node (from linear_path.min_node) on the linear
+    path, -1 for nodes not on the path"""
+    node_to_distance = np.asanyarray(linear_path._node_to_distance)
+    node_offsets = np.full(node_to_distance.size, -1, dtype="int64")
+    path_idxs = np.unique(np.asanyarray(
+        linear_path._distance_to_node, dtype="int64"))-linear_path.min_node
+    path_idxs = path_idxs[(path_idxs >= 0) & (path_idxs < node_offsets.size)]
+    node_offsets[path_idxs] = node_to_distance[path_idxs]
+    return node_offsets
+
+
+def get_arrays_file_name(text_file_name):
+    return text_file_name + ".npz"
@@ -3,8 +3,8 @@ import offsetbasedgraph as obg
 import logging
 from collections import defaultdict
 import numpy as np
-from .analysis.nongraphpeaks import NonGraphPeakCollection, NonGraphPeak
 from .summits import find_summits
+from .overlapindex import OverlapIndex
 
 
 class Peak(obg.DirectedInterval):
@@ -83,6 +83,7 @@ class Peak(obg.DirectedInterval):
 
         linear_start_pos = linear_path.get_offset_at_node(first_node) + start_offset
         linear_end_pos = linear_path.get_offset_at_node(last_node) + end_offset
+        from .analysis.nongraphpeaks import NonGraphPeak
         return NonGraphPeak(chromosome, linear_start_pos, linear_end_pos, score=self.score)
 
     def get_subinterval(self, start_offset, end_offset):
@@ -210,46 +211,95 @@ class PeakCollection(obg.IntervalCollection):
 
         return cls(intervals_on_graph)
 
-    def contains_interval(self, interval):
-        for i in self.intervals:
-            if i == interval:
-                return True
+    @staticmethod
+    def _interval_key(interval):
+        return (interval.start_position.region_path_id,
+                interval.start_position.offset,
+                interval.end_position.region_path_id,
+                interval.end_position.offset,
+                tuple(interval.region_paths))
+
+    @property
+    def intervals(self):
+        return self._intervals
+
+    @intervals.setter
+    def intervals(self, intervals):
+        # Setting the intervals drops the indexes made from the old ones
+        self._intervals = intervals
+        self._cached = {}
+
+    def _get_cached(self, name, create):
+        """Index of the intervals made by create, kept until intervals
+        is set again. The intervals must not be changed in place after
+        they have been indexed"""
+        if name not in self._cached:
+            if not isinstance(self._intervals, list):
+                self._intervals = list(self._intervals)
+            self._cached[name] = create()
+        return self._cached[name]
+
+    def get_overlap_index(self, graph=None):
+        return self._get_cached(
+            "overlap_index",
+            lambda: OverlapIndex.from_intervals(self.intervals, graph))
 
-        return False
+    def contains_interval(self, interval):
+        keys = self._get_cached(
+            "interval_keys",
+            lambda: {self._interval_key(i) for i in self.intervals})
+        return self._interval_key(interval) in keys
 
     def get_similar_intervals(self, interval, allowed_mismatches):
-        similar = []
-        for i in self.intervals:
-            if i.is_approx_equal(interval, allowed_mismatches):
-                similar.append(i)
-
-        return similar
+        ids, _ = self.get_overlap_index(interval.graph).similar_pairs(
+            OverlapIndex.from_intervals([interval]), allowed_mismatches)
+        return [self.intervals[i] for i in ids]
 
     def get_identical_intervals(self, other_peak_collection):
-        identical_intervals = []
-        for interval in self.intervals:
-            if other_peak_collection.contains_interval(interval):
-                identical_intervals.append(interval)
-
-        return identical_intervals
+        return [interval for interval in self.intervals
+                if other_peak_collection.contains_interval(interval)]
 
     def get_overlapping_intervals(self, interval, minimum_overlap=1):
-        overlapping = []
-        for i in self.intervals:
-            if i.overlaps(interval, minimum_overlap=minimum_overlap):
-                overlapping.append(i)
-        return overlapping
+        ids, _ = self.get_overlap_index(interval.graph).overlapping_pairs(
+            OverlapIndex.from_intervals([interval]), minimum_overlap)
+        return [self.intervals[i] for i in ids]
+
+    def get_overlapping_pairs(self, other_peak_collection, minimum_overlap=1,
+                              graph=None):
+        """All pairs (peak, other_peak) overlapping by at least
+        minimum_overlap base pairs"""
+        ids, other_ids = self.get_overlap_index(graph).overlapping_pairs(
+            other_peak_collection.get_overlap_index(graph), minimum_overlap)
+        return [(self.intervals[i], other_peak_collection.intervals[j])
+                for i, j in zip(ids, other_ids)]
+
+    def get_similar_pairs(self, other_peak_collection, allowed_mismatches=1,
+                          graph=None):
+        """All pairs (peak, other_peak) where other_peak covers all but
+        allowed_mismatches base pairs of peak"""
+        ids, other_ids = self.get_overlap_index(graph).similar_pairs(
+            other_peak_collection.get_overlap_index(graph), allowed_mismatches)
+        return [(self.intervals[i], other_peak_collection.intervals[j])
+                for i, j in zip(ids, other_ids)]
 
     def to_approx_linear_peaks(self, linear_path, chromosome):
-        linear_peaks = []
-        i = 0
-        for peak in self.intervals:
-            if i % 500 == 0:
-                logging.info("Converting peak %d" % i)
-            i += 1
-            linear_peaks.append(peak.to_approx_linear_peak(linear_path, chromosome))
-
-        return NonGraphPeakCollection(linear_peaks)
+        from .analysis.nongraphpeaks import NonGraphPeak, NonGraphPeakCollection
+        from .peakarrays import PeakArrays
+        peaks = list(self.intervals)
+        starts, ends, has_nodes = PeakArrays.from_peaks(
+            peaks).to_approx_linear_offsets(linear_path)
+        if not np.all(has_nodes):
+            logging.warning("Skipping %d peaks with no nodes on the linear path",
+                            np.count_nonzero(~has_nodes))
+        return NonGraphPeakCollection(
+            [NonGraphPeak(chromosome, start, end, score=peak.score)
+             for peak, start, end, has_node in zip(
+                     peaks, starts.tolist(), ends.tolist(),
+                     has_nodes) if has_node])
+
+    def to_arrays(self):
+        from .peakarrays import PeakArrays
+        return PeakArrays.from_peaks(self.intervals)
 
     def to_fasta_file(self, file_name, sequence_graph):
         from .peakfasta import PeakFasta
@@ -281,3 +331,11 @@ class PeakCollection(obg.IntervalCollection):
 
         return cls(peaks)
 
+
+def __getattr__(name):
+    # The linear peak classes pull in Bio and pyfaidx, so they are only
+    # imported when used (PEP 562)
+    if name in ("NonGraphPeak", "NonGraphPeakCollection"):
+        from .analysis import nongraphpeaks
+        return getattr(nongraphpeaks, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
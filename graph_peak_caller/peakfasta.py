@@ -1,30 +1,144 @@
 import logging
+import heapq
+import json
+import numpy as np
+
+LETTERS = np.frombuffer(b"nactgm", dtype="uint8")
+COMPLEMENTS = np.array([0, 3, 4, 1, 2, 5], dtype="uint8")
+
+
+def get_interval_sequences(sequence_graph, intervals):
+    """Get the sequences of all intervals with one gather from the
+    sequence array of the sequence graph"""
+    if not intervals:
+        return []
+    lengths = np.array([len(i.region_paths) for i in intervals])
+    nodes = np.concatenate([i.region_paths for i in intervals]).astype("int")
+    last_idxs = np.cumsum(lengths)-1
+    first_idxs = last_idxs-lengths+1
+    node_idxs = np.abs(nodes) - sequence_graph._node_id_offset
+    node_sizes = sequence_graph._node_sizes[node_idxs].astype("int")
+    starts = np.zeros(nodes.size, dtype="int")
+    ends = node_sizes.copy()
+    starts[first_idxs] = [i.start_position.offset for i in intervals]
+    ends[last_idxs] = [i.end_position.offset for i in intervals]
+
+    is_reverse = nodes < 0
+    fw_starts = np.where(is_reverse, node_sizes-ends, starts)
+    fw_ends = np.where(is_reverse, node_sizes-starts, ends)
+    segment_lengths = fw_ends-fw_starts
+    node_positions = sequence_graph._indices[node_idxs].astype("int")
+    first_positions = np.where(is_reverse, node_positions+fw_ends-1,
+                               node_positions+fw_starts)
+    steps = np.where(is_reverse, -1, 1)
+    segment_offsets = np.cumsum(segment_lengths)-segment_lengths
+    local = np.arange(np.sum(segment_lengths)) - np.repeat(
+        segment_offsets, segment_lengths)
+    positions = np.repeat(first_positions, segment_lengths) + \
+        np.repeat(steps, segment_lengths)*local
+    codes = sequence_graph._sequence_array[positions]
+    reverse_bases = np.repeat(is_reverse, segment_lengths)
+    codes[reverse_bases] = COMPLEMENTS[codes[reverse_bases]]
+    text = LETTERS[codes].tobytes().decode()
+
+    interval_lengths = np.add.reduceat(segment_lengths, first_idxs)
+    bounds = np.insert(np.cumsum(interval_lengths), 0, 0)
+    return [text[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def write_fasta_entries(f, headers, sequences, start_number=0,
+                        chunk_size=10000):
+    entries = [">peak%d %s\n%s\n" % (i, header, sequence)
+               for i, (header, sequence) in
+               enumerate(zip(headers, sequences), start=start_number)]
+    for i in range(0, len(entries), chunk_size):
+        f.write("".join(entries[i:i+chunk_size]))
+
+
+class UnsortedFastaFile(Exception):
+    pass
+
+
+def read_fasta_entries(file_name, check_sorted=True):
+    """Yield (score, header, sequence) for each peak in a peak fasta
+    file. Raises UnsortedFastaFile if scores are increasing"""
+    prev_score = np.inf
+    with open(file_name) as f:
+        while True:
+            header = f.readline()
+            sequence = f.readline()
+            if not header:
+                break
+            interval_json = "{%s" % header.rstrip().split(" {", 1)[1]
+            score = json.loads(interval_json)["average_q_value"]
+            if check_sorted and score > prev_score:
+                raise UnsortedFastaFile(file_name)
+            prev_score = score
+            yield score, interval_json, sequence.rstrip()
+
+
+def merge_peak_fasta_files(file_names, out_fasta_file_name,
+                           out_intervalcollection_file_name,
+                           chunk_size=10000):
+    """Merge peak fasta files sorted by descending score into one file
+    sorted by score. Falls back to sorting everything in memory if any
+    of the files is not sorted"""
+    try:
+        entries = heapq.merge(*(read_fasta_entries(file_name)
+                                for file_name in file_names),
+                              key=lambda entry: -entry[0])
+        _write_merged_entries(entries, out_fasta_file_name,
+                              out_intervalcollection_file_name, chunk_size)
+    except UnsortedFastaFile as e:
+        logging.info("%s is not sorted by score. Sorting all peaks." % e)
+        entries = [entry for file_name in file_names for entry in
+                   read_fasta_entries(file_name, check_sorted=False)]
+        entries.sort(key=lambda entry: -entry[0])
+        _write_merged_entries(entries, out_fasta_file_name,
+                              out_intervalcollection_file_name, chunk_size)
+
+
+def _write_merged_entries(entries, out_fasta_file_name,
+                          out_intervalcollection_file_name, chunk_size):
+    entries = iter(entries)
+    i = 0
+    with open(out_fasta_file_name, "w") as out_fasta, \
+            open(out_intervalcollection_file_name, "w") as out_intervals:
+        while True:
+            chunk = [entry for _, entry in zip(range(chunk_size), entries)]
+            if not chunk:
+                break
+            _, headers, sequences = zip(*chunk)
+            write_fasta_entries(out_fasta, headers, sequences, i, chunk_size)
+            out_intervals.write("".join("%s\n" % h for h in headers))
+            i += len(chunk)
 
 
 class PeakFasta:
     def __init__(self, sequence_retriever):
         self._sequence_retriever = sequence_retriever
 
+    def get_sequences(self, intervals):
+        if hasattr(self._sequence_retriever, "_sequence_array"):
+            return get_interval_sequences(self._sequence_retriever, intervals)
+        return [self._sequence_retriever.get_interval_sequence(interval)
+                for interval in intervals]
+
+    def _write_intervals(self, file_name, intervals, chunk_size=10000):
+        intervals = list(intervals)
+        with open(file_name, "w") as f:
+            for i in range(0, len(intervals), chunk_size):
+                chunk = intervals[i:i+chunk_size]
+                write_fasta_entries(
+                    f, [interval.to_file_line() for interval in chunk],
+                    self.get_sequences(chunk), i, chunk_size)
+                logging.info("Wrote %d sequences" % (i+len(chunk)))
+
     def write_max_path_sequences(self, file_name, max_paths):
-        f = open(file_name, "w")
-        i = 0
-        for max_path in max_paths:
-            seq = self._sequence_retriever.get_interval_sequence(max_path)
-            f.write(">peak" + str(i) + " " +
-                    max_path.to_file_line() + "\n" + seq + "\n")
-            i += 1
-        f.close()
+        self._write_intervals(file_name, max_paths)
         logging.info("Wrote max path sequences to fasta file: %s" %
                      (file_name))
 
     def save_intervals(self, out_fasta_file_name, interval_collection):
-        f = open(out_fasta_file_name, "w")
-        i = 0
-        for max_path in interval_collection.intervals:
-            seq = self._sequence_retriever.get_interval_sequence(max_path)
-            f.write(">peak" + str(i) + " " +
-                    max_path.to_file_line() + "\n" + seq + "\n")
-            i += 1
-            if i % 10000 == 0:
-                logging.info("Writing sequence # %d" % i)
-        f.close()
+        self._write_intervals(out_fasta_file_name,
+                              interval_collection.intervals)
@@ -3,13 +3,46 @@ from itertools import chain
 import scipy.sparse.csgraph as csgraph
 import numpy as np
 from scipy.sparse import csr_matrix
+from offsetbasedgraph.graph import AdjListAsNumpyArrays
 from .subgraphanalyzer import SubGraphAnalyzer
+from ..touchednodes import as_touched_nodes
 
 
 class DummyTouched:
     def __contains__(self, item):
         return True
 
+    def contains(self, node_ids):
+        return np.ones(np.shape(node_ids), dtype="bool")
+
+
+def get_edges(adj_list, nodes):
+    """All edges out of nodes as flat arrays (idxs, adjs), where
+    adjs[i] is in adj_list[nodes[idxs[i]]]. Vectorized for numpy
+    backed adjacency lists"""
+    nodes = np.asanyarray(nodes, dtype="int64")
+    if not isinstance(adj_list, AdjListAsNumpyArrays):
+        edges = [list(adj_list[int(node)]) for node in nodes]
+        idxs = np.repeat(np.arange(nodes.size),
+                         [len(adjs) for adjs in edges])
+        return idxs, np.array(list(chain.from_iterable(edges)),
+                              dtype="int64")
+    positions = nodes-adj_list.node_id_offset
+    is_valid = (positions >= 0) & (positions < adj_list._indices.size)
+    n_edges = np.zeros(nodes.size, dtype="int64")
+    first_edges = np.zeros(nodes.size, dtype="int64")
+    n_edges[is_valid] = adj_list._n_edges[positions[is_valid]]
+    first_edges[is_valid] = adj_list._indices[positions[is_valid]]
+    idxs = np.repeat(np.arange(nodes.size), n_edges)
+    edge_idxs = np.arange(idxs.size) + np.repeat(
+        first_edges-np.cumsum(n_edges)+n_edges, n_edges)
+    return idxs, adj_list._values[edge_idxs].astype("int64")
+
+
+def get_n_edges(adj_list, nodes):
+    idxs, _ = get_edges(adj_list, nodes)
+    return np.bincount(idxs, minlength=len(nodes))
+
 
 class StubsFilter:
     def __init__(self, starts, fulls, ends, graph,
@@ -20,7 +53,7 @@ class StubsFilter:
         self._fulls = fulls
         self._ends = ends
 
-        self._touched_nodes = touched_nodes
+        self._touched_nodes = as_touched_nodes(touched_nodes, graph)
         if touched_nodes is None:
             self._touched_nodes = DummyTouched()
 
@@ -45,25 +78,30 @@ class StubsFilter:
             self.find_sub_ends(self.filtered_starts))
 
     def find_sub_starts(self, nodes):
-        r = np.array([not all(-adj in self._pos_from_nodes or -adj
-                              not in self._touched_nodes
-                              for adj in self._graph.reverse_adj_list[-node])
-                      for node in nodes], dtype="bool")
+        idxs, adjs = get_edges(self._graph.reverse_adj_list,
+                               -np.asanyarray(nodes, dtype="int64"))
+        is_sub_start = ~np.isin(-adjs, self._pos_from_nodes) & \
+            self._touched_nodes.contains(-adjs)
+        r = np.zeros(len(nodes), dtype="bool")
+        r[idxs[is_sub_start]] = True
         return r
 
     def find_sub_ends(self, nodes):
-        a = np.array([not all(adj in self._pos_to_nodes or adj > self._last_node or adj not in self._touched_nodes
-                              for adj in self._graph.adj_list[node])
-                      for node in nodes], dtype="bool")
+        idxs, adjs = get_edges(self._graph.adj_list, nodes)
+        is_sub_end = ~np.isin(adjs, self._pos_to_nodes) & \
+            self._touched_nodes.contains(adjs)
+        if self._last_node is not None:
+            is_sub_end &= adjs <= self._last_node
+        a = np.zeros(len(nodes), dtype="bool")
+        a[idxs[is_sub_end]] = True
         return a
 
     def _get_start_filter(self, nodes):
-        return np.array([len(self._graph.reverse_adj_list[-node_id])
-                         for node_id in nodes], dtype="bool")
+        return get_n_edges(self._graph.reverse_adj_list,
+                           -np.asanyarray(nodes, dtype="int64")) > 0
 
     def _get_ends_filter(self, nodes):
-        return np.array([len(self._graph.adj_list[node_id])
-                         for node_id in nodes], dtype="bool")
+        return get_n_edges(self._graph.adj_list, nodes) > 0
 
     def filter_start_stubs(self):
         """ Locate nodes that are start_nodes of graph"""
@@ -75,25 +113,25 @@ class StubsFilter:
         self._fulls_mask &= self._get_ends_filter(self._fulls)
 
     def _set_pos_nodes(self):
-        self._pos_to_nodes = set(chain(self._fulls, self._ends))
-        self._pos_from_nodes = set(chain(self._starts, self._fulls))
+        self._pos_to_nodes = np.r_[self._fulls, self._ends].astype("int64")
+        self._pos_from_nodes = np.r_[
+            self._starts, self._fulls].astype("int64")
 
 
 class PosStubFilter(StubsFilter):
 
-    def _set_pos_nodes(self):
-        self._pos_to_nodes = set(chain(self._fulls, self._ends))
-        self._pos_from_nodes = set(chain(self._starts, self._fulls))
-
     def find_sub_starts(self, nodes):
-        return np.array([not any(-adj in self._pos_from_nodes
-                                 for adj in self._graph.reverse_adj_list[-int(node)])
-                         for node in nodes], dtype="bool")
+        idxs, adjs = get_edges(self._graph.reverse_adj_list,
+                               -np.asanyarray(nodes, dtype="int64"))
+        r = np.ones(len(nodes), dtype="bool")
+        r[idxs[np.isin(-adjs, self._pos_from_nodes)]] = False
+        return r
 
     def find_sub_ends(self, nodes):
-        return np.array([not any(adj in self._pos_to_nodes
-                                 for adj in self._graph.adj_list[int(node)])
-                         for node in nodes], dtype="bool")
+        idxs, adjs = get_edges(self._graph.adj_list, nodes)
+        r = np.ones(len(nodes), dtype="bool")
+        r[idxs[np.isin(adjs, self._pos_to_nodes)]] = False
+        return r
 
     def filter_start_stubs(self):
         """ Locate nodes that are start_nodes of graph"""
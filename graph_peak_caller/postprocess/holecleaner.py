@@ -4,6 +4,7 @@ import numpy as np
 from .segmentanalyzer import SegmentAnalyzer
 from .graphs import DividedLinegraph, DummyTouched
 from ..sparsediffs import SparseValues
+from ..touchednodes import as_touched_nodes
 
 
 class HolesCleaner:
@@ -16,7 +17,8 @@ class HolesCleaner:
         self._node_ids = self.get_node_ids()
         self._max_size = max_size
         self._kept = []
-        self._touched_nodes = touched_nodes
+        self._not_touched = np.array([], dtype="int")
+        self._touched_nodes = as_touched_nodes(touched_nodes, graph)
         if touched_nodes is None:
             self._touched_nodes = DummyTouched()
 
@@ -61,13 +63,10 @@ class HolesCleaner:
     def _filter_touched_nodes(self, node_values):
         if not self._touched_nodes:
             return node_values
-        touched = [i for i, node in enumerate(node_values[0])
-                   if node+self._graph.min_node-1 in self._touched_nodes]
-        self._not_touched = np.array(
-            [i for i in node_values[0]
-             if i+self._graph.min_node-1 not in self._touched_nodes],
-            dtype="int")
-        return node_values[:, touched]
+        is_touched = self._touched_nodes.contains(
+            node_values[0]+self._graph.min_node-1)
+        self._not_touched = node_values[0][~is_touched].astype("int")
+        return node_values[:, is_touched]
 
     def run(self):
         analyzer = SegmentAnalyzer(
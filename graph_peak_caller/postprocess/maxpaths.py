@@ -5,7 +5,7 @@ from scipy.sparse import csr_matrix
 from .segmentanalyzer import SegmentSplitter
 from ..peakcollection import Peak
 from .graphs import PosDividedLineGraph, SubGraph
-from .reference_based_max_path import max_path_func
+from .reference_based_max_path import ReferenceMaxPaths
 
 
 class SparseMaxPaths:
@@ -80,12 +80,8 @@ class SparseMaxPaths:
         components, subgraphs = linegraph.get_connected_components()
         components = self._convert_connected_components(components)
         subgraphs = [SubGraph(*pair) for pair in zip(components, subgraphs)]
-        get_max_path = max_path_func(self._score_pileup, self._graph, self._variant_maps)
-        max_paths = []
-        for i, component in enumerate(components):
-            if i % 100 == 0:
-                print("path: ", i)
-            max_paths.append(get_max_path(component))
+        max_paths = ReferenceMaxPaths(
+            self._score_pileup, self._graph, self._variant_maps).run(components)
         start_offset = self.get_start_offsets([max_path[0] for max_path in max_paths])
         end_offset = self.get_end_offsets([max_path[-1] for max_path in max_paths])
         peaks = [Peak(start, end, path, graph=self._graph) for path, start, end in
@@ -1,53 +1,143 @@
+import logging
+from collections import defaultdict
 import numpy as np
 from .indel_scores import get_end_values_func, get_start_values_func
+from .graphs import get_edges
+
+REF, SNP, INS, DEL = range(4)
+
+
+def get_deletion_keys(deletions, min_node, n_nodes):
+    """Sorted keys (from_node-min_node)*n_nodes+to_node-min_node for
+    all edges that skip a deletion, i.e. where from_ids[from_node] and
+    to_ids[to_node] share a deletion id. Edges with a node outside
+    the graph are skipped"""
+    from_nodes = defaultdict(list)
+    for node, deletion_ids in deletions.from_ids.items():
+        for deletion_id in deletion_ids:
+            from_nodes[deletion_id].append(node)
+    keys = [(from_node-min_node)*n_nodes+to_node-min_node
+            for to_node, deletion_ids in deletions.to_ids.items()
+            for deletion_id in deletion_ids
+            for from_node in from_nodes[deletion_id]
+            if 0 <= from_node-min_node < n_nodes and
+            0 <= to_node-min_node < n_nodes]
+    return np.unique(np.array(keys, dtype="int64"))
+
+
+class ReferenceMaxPaths:
+    """Reference guided max paths through many components at once.
+
+    Each (component, node) pair is a row. The candidate edges of all
+    rows are classified (REF/SNP/INS/DEL) in one pass, the next node
+    of every row is chosen with array operations, and then all paths
+    are followed in lockstep from their start nodes"""
+
+    def __init__(self, pileup, graph, variant_maps):
+        self._graph = graph
+        self._min_node = graph.min_node
+        self._n_nodes = graph.node_indexes.size-1
+        self._snps = np.asanyarray(variant_maps.snps) != 0
+        self._insertions = np.asanyarray(variant_maps.insertions) != 0
+        self._not_variant = ~(self._snps | self._insertions)
+        self._deletion_keys = get_deletion_keys(
+            variant_maps.deletions, self._min_node, self._n_nodes)
+        self._get_end_values = get_end_values_func(pileup, graph)
+        self._get_start_values = get_start_values_func(pileup, graph)
+
+    def _get_rows(self, components):
+        sizes = [len(component) for component in components]
+        component_ids = np.repeat(np.arange(len(components)), sizes)
+        nodes = np.concatenate(
+            [[]]+[np.asanyarray(c) for c in components]).astype("int64")
+        keys, idxs = np.unique(
+            component_ids*self._n_nodes+nodes-self._min_node,
+            return_index=True)
+        return keys, nodes[idxs], component_ids[idxs]
+
+    def _get_start_rows(self, keys, nodes, component_ids):
+        first_rows = np.flatnonzero(
+            np.r_[True, component_ids[1:] != component_ids[:-1]])
+        no_node = nodes.max()+1
+        candidates = np.where(self._not_variant[nodes-self._min_node],
+                              nodes, no_node)
+        starts = np.minimum.reduceat(candidates, first_rows)
+        starts = np.where(starts == no_node, nodes[first_rows], starts)
+        return np.searchsorted(
+            keys, component_ids[first_rows]*self._n_nodes +
+            starts-self._min_node)
+
+    def _classify_edges(self, from_nodes, to_nodes):
+        edge_keys = (from_nodes-self._min_node)*self._n_nodes + \
+            to_nodes-self._min_node
+        to_idxs = to_nodes-self._min_node
+        return np.where(
+            np.isin(edge_keys, self._deletion_keys), DEL,
+            np.where(self._insertions[to_idxs], INS,
+                     np.where(self._snps[to_idxs], SNP, REF)))
+
+    def _get_next_rows(self, keys, nodes, component_ids):
+        rows, adjs = get_edges(self._graph.adj_list, nodes)
+        adj_keys = component_ids[rows]*self._n_nodes+adjs-self._min_node
+        adj_rows = np.minimum(np.searchsorted(keys, adj_keys), keys.size-1)
+        in_component = keys[adj_rows] == adj_keys
+        rows, adjs, adj_rows = (rows[in_component], adjs[in_component],
+                                adj_rows[in_component])
+        classes = self._classify_edges(nodes[rows], adjs)
+        values = self._get_start_values(adjs-self._min_node)
+
+        groups = rows*4+classes
+        order = np.lexsort((adjs, values, groups))
+        sorted_groups = groups[order]
+        best = order[np.r_[sorted_groups[1:] != sorted_groups[:-1], True]]
+        best_values = np.full((nodes.size, 4), -1.)
+        best_rows = np.full((nodes.size, 4), -1, dtype="int64")
+        best_values[rows[best], classes[best]] = values[best]
+        best_rows[rows[best], classes[best]] = adj_rows[best]
+
+        cur_values = best_values[:, REF]
+        next_rows = best_rows[:, REF]
+        for variant, is_better in (
+                (SNP, best_values[:, SNP] > cur_values),
+                (INS, best_values[:, INS] >= cur_values/2)):
+            cur_values = np.where(is_better, best_values[:, variant],
+                                  cur_values)
+            next_rows = np.where(is_better, best_rows[:, variant], next_rows)
+        end_values = self._get_end_values(nodes-self._min_node)
+        use_deletion = (cur_values <= end_values/2) & \
+            (cur_values <= best_values[:, DEL]/2)
+        return np.where(use_deletion, best_rows[:, DEL], next_rows)
+
+    def run(self, components):
+        if not len(components):
+            return []
+        keys, nodes, component_ids = self._get_rows(components)
+        next_rows = self._get_next_rows(keys, nodes, component_ids)
+        cur_rows = self._get_start_rows(keys, nodes, component_ids)
+        active = np.arange(cur_rows.size)
+        path_rows, path_ids = [], []
+        for _ in range(nodes.size):
+            path_rows.append(cur_rows)
+            path_ids.append(active)
+            cur_rows = next_rows[cur_rows]
+            is_active = cur_rows >= 0
+            cur_rows, active = cur_rows[is_active], active[is_active]
+            if not active.size:
+                break
+        path_ids = np.concatenate(path_ids)
+        order = np.argsort(path_ids, kind="stable")
+        path_nodes = nodes[np.concatenate(path_rows)[order]].tolist()
+        path_ends = np.cumsum(np.bincount(path_ids,
+                                          minlength=len(components)))
+        logging.info("Found reference guided max paths for %s components",
+                     len(components))
+        return [path_nodes[end-length:end] for end, length in
+                zip(path_ends, np.diff(np.r_[0, path_ends]))]
 
 
 def max_path_func(pileup, graph, variant_maps):
-    not_variant = (variant_maps.snps == 0) & (variant_maps.insertions == 0)
-    get_end_value = get_end_values_func(pileup, graph)
-    get_start_value = get_start_values_func(pileup, graph)
-
-    def classify_node(prev_node, node):
-        if variant_maps.deletions.from_ids[prev_node] & variant_maps.deletions.to_ids[node]:
-            return "DEL"
-        if variant_maps.insertions[node-graph.min_node]:
-            return "INS"
-        if variant_maps.snps[node-graph.min_node]:
-            return "SNP"
-        return "REF"
+    max_paths = ReferenceMaxPaths(pileup, graph, variant_maps)
 
     def get_max_path(node_ids):
-        node_set = set(node_ids)
-        node_ids = np.asanyarray(node_ids)
-        start_values = dict(zip(node_ids, get_start_value(node_ids-graph.min_node)))
-        end_values = dict(zip(node_ids, get_end_value(node_ids-graph.min_node)))
-
-        node_ids = node_ids-graph.min_node
-        non_variants = node_ids[not_variant[node_ids]]
-        start = np.min(non_variants) if len(non_variants) else np.min(node_ids)
-        cur_node = start+graph.min_node
-        path = []
-        while True:
-            path.append(cur_node)
-            next_nodes = [node for node in graph.adj_list[int(cur_node)]
-                          if node in node_set]
-            if not next_nodes:
-                break
-            var_dict = {"REF": [], "INS": [], "DEL": [], "SNP": []}
-            for node in next_nodes:
-                var_dict[classify_node(cur_node, node)].append(node)
-            best_vars = {key: max((start_values[node], node) for node in nodes) if len(nodes) else (-1, -1)
-                         for key, nodes in var_dict.items()}
-            current_best = best_vars["REF"]
-            if best_vars["SNP"][0] > best_vars["REF"][0]:
-                current_best = best_vars["SNP"]
-            # current_best = max(best_vars["REF"], best_vars["SNP"])
-            if best_vars["INS"][0] >= current_best[0]/2:
-                current_best = best_vars["INS"]
-            cur_value = end_values[cur_node]
-            if current_best[0] <= cur_value/2:
-                if current_best[0] <= best_vars["DEL"][0]/2:
-                    current_best = best_vars["DEL"]
-            cur_node = current_best[1]
-        return path
+        return max_paths.run([node_ids])[0]
     return get_max_path
@@ -0,0 +1,78 @@
+import logging
+import threading
+
+
+class _Failed:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Prefetcher:
+    """Iterates over load_func(key) for all keys, loading the next
+    items in a background thread while the current one is used.
+
+    At most depth items are loaded ahead of the one being used, so
+    that memory use is bounded. An item is counted as used until the
+    next one is asked for. With depth 0, items are loaded when asked
+    for, as with a plain generator. Exceptions from load_func are
+    raised when the failing item is asked for"""
+
+    def __init__(self, load_func, keys, depth=1):
+        self._load_func = load_func
+        self._keys = list(keys)
+        self._depth = depth
+        self._items = []
+        self._condition = threading.Condition()
+        self._is_closed = False
+        self._thread = None
+
+    def _load_all(self):
+        for key in self._keys:
+            with self._condition:
+                while len(self._items) >= self._depth and not self._is_closed:
+                    self._condition.wait()
+                if self._is_closed:
+                    return
+            logging.debug("Prefetching %s", key)
+            try:
+                item = self._load_func(key)
+            except Exception as e:
+                item = _Failed(e)
+            with self._condition:
+                self._items.append(item)
+                self._condition.notify_all()
+            if isinstance(item, _Failed):
+                return
+
+    def _next_item(self):
+        with self._condition:
+            while not self._items:
+                self._condition.wait()
+            item = self._items.pop(0)
+            self._condition.notify_all()
+        if isinstance(item, _Failed):
+            raise item.exception
+        return item
+
+    def __iter__(self):
+        if self._depth == 0:
+            for key in self._keys:
+                yield self._load_func(key)
+            return
+        self._thread = threading.Thread(target=self._load_all, daemon=True)
+        self._thread.start()
+        try:
+            for _ in self._keys:
+                yield self._next_item()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop loading. Items being loaded are finished, but dropped"""
+        with self._condition:
+            self._is_closed = True
+            self._items = []
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -6,6 +6,7 @@ from graph_peak_caller.shiftestimation.shift_estimation_multigraph \
     import MultiGraphShiftEstimator
 from graph_peak_caller.util import create_linear_map
 from graph_peak_caller.multiplegraphscallpeaks import MultipleGraphsCallpeaks
+from graph_peak_caller.readsplitter import ChromosomeReadSplitter
 
 
 def count_unique_reads_interface(args):
@@ -98,48 +99,9 @@ def split_vg_json_reads_into_chromosomes(args):
         logging.info("   Chr%s: %d-%d" % (chrom, start, end))
         f.close()
 
-    
-    chromosomes.append("unmapped")
-    out_files = {chrom: open(reads_base_name + "_" + chrom + ".json", "w")
-                 for chrom in chromosomes}
-
-    reads_file = open(args.vg_json_reads_file_name)
-    i = 0
-    import re
-    regex = re.compile(r"node_id\":\s?\"?([0-9]+)\"?")
-
-    def get_mapped_chrom(node):
-        mapped_chrom = None
-        for chrom in chromosomes:
-            if node >= chromosome_limits[chrom][0] and node <= chromosome_limits[chrom][1]:
-                mapped_chrom = chrom
-                break
-        return mapped_chrom
-
-    n_without_node_id = 0
-    for line in reads_file:
-        if i % 100000 == 0:
-            logging.info("Line #%d" % i)
-        i += 1
-
-        groups = regex.search(line)
-        if groups is None:
-            out_files["unmapped"].writelines([line])
-            n_without_node_id += 1
-            continue
-        groups = groups.groups()
-        if len(groups) > 0:
-            node = int(groups[0])
-            mapped_chrom = get_mapped_chrom(node)
-            if mapped_chrom is None:
-                n_without_node_id += 1
-                out_files["unmapped"].writelines([line])
-                continue
-            out_files[mapped_chrom].writelines([line])
-        else:
-            print("No groups fond")
-
-    for file in out_files.values():
-        file.close()
-
+    n_processes = 1 if args.n_processes is None else int(args.n_processes)
+    splitter = ChromosomeReadSplitter(chromosome_limits,
+                                      n_processes=n_processes)
+    n_without_node_id = splitter.split(args.vg_json_reads_file_name,
+                                       reads_base_name)
     logging.info("Done. Found %d lines without node id or not matching into the given list of chromosomes" % n_without_node_id)
@@ -0,0 +1,118 @@
+import logging
+import os
+import re
+from multiprocessing import Pool
+import numpy as np
+
+NODE_ID_REGEX = re.compile(rb"node_id\":\s?\"?([0-9]+)\"?[^\n]*")
+
+
+def find_chunk_boundaries(file_name, chunk_size):
+    """Byte offsets splitting the file into chunks that end on newlines"""
+    file_size = os.path.getsize(file_name)
+    boundaries = [0]
+    with open(file_name, "rb") as f:
+        while boundaries[-1] < file_size:
+            f.seek(min(boundaries[-1] + chunk_size, file_size))
+            f.readline()
+            boundaries.append(min(f.tell(), file_size))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def classify_nodes(nodes, range_starts, range_ends):
+    """Index of the (sorted) node range containing each node, or -1"""
+    idxs = np.searchsorted(range_starts, nodes, side="right")-1
+    inside = (idxs >= 0) & (nodes <= range_ends[np.maximum(idxs, 0)])
+    idxs[~inside] = -1
+    return idxs
+
+
+def split_chunk(data, range_starts, range_ends):
+    """Split the lines in data by the range of their first node id.
+
+    Returns a dict from range index (-1 for unmapped) to the bytes
+    of the lines belonging to it, in the order they appear in data
+    """
+    if not data:
+        return {}
+    byte_array = np.frombuffer(data, dtype="uint8")
+    line_ends = np.flatnonzero(byte_array == ord("\n"))+1
+    if not line_ends.size or line_ends[-1] != len(data):
+        line_ends = np.append(line_ends, len(data))
+    line_starts = np.insert(line_ends[:-1], 0, 0)
+    matches = [(m.start(), int(m.group(1)))
+               for m in NODE_ID_REGEX.finditer(data)]
+    line_chroms = np.full(line_ends.size, -1, dtype="int")
+    if matches:
+        positions, nodes = (np.array(v) for v in zip(*matches))
+        line_idxs = np.searchsorted(line_ends, positions, side="right")
+        line_chroms[line_idxs] = classify_nodes(
+            nodes, range_starts, range_ends)
+    # Join runs of consecutive lines with the same range, grouped by range
+    is_run_start = np.r_[True, line_chroms[1:] != line_chroms[:-1]]
+    run_chroms = line_chroms[is_run_start]
+    run_starts = line_starts[is_run_start].tolist()
+    run_ends = np.r_[line_starts[is_run_start][1:], len(data)].tolist()
+    order = np.argsort(run_chroms, kind="stable")
+    bounds = np.r_[0, np.flatnonzero(np.diff(run_chroms[order]))+1,
+                   order.size].tolist()
+    order = order.tolist()
+    result = {}
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        result[int(run_chroms[order[start]])] = b"".join(
+            data[run_starts[i]:run_ends[i]] for i in order[start:end])
+    return result
+
+
+def _split_file_chunk(args):
+    file_name, start, end, range_starts, range_ends = args
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        data = f.read(end-start)
+    return split_chunk(data, range_starts, range_ends)
+
+
+class ChromosomeReadSplitter:
+    """Splits a vg json alignment file into one file per chromosome
+    based on the node id of the first mapping of each alignment.
+    Chunks of the file are classified in parallel worker processes
+    and written to the output files in the original order"""
+
+    def __init__(self, chromosome_limits, chunk_size=64*1024*1024,
+                 n_processes=1):
+        self._chromosomes = sorted(chromosome_limits,
+                                   key=lambda c: chromosome_limits[c][0])
+        self._range_starts = np.array(
+            [chromosome_limits[c][0] for c in self._chromosomes])
+        self._range_ends = np.array(
+            [chromosome_limits[c][1] for c in self._chromosomes])
+        self._chunk_size = chunk_size
+        self._n_processes = n_processes
+
+    def _get_chunk_results(self, file_name):
+        chunks = find_chunk_boundaries(file_name, self._chunk_size)
+        logging.info("Splitting %s in %d chunks using %d processes",
+                     file_name, len(chunks), self._n_processes)
+        args = ((file_name, start, end, self._range_starts, self._range_ends)
+                for start, end in chunks)
+        if self._n_processes == 1:
+            yield from map(_split_file_chunk, args)
+            return
+        with Pool(self._n_processes) as pool:
+            yield from pool.imap(_split_file_chunk, args)
+
+    def split(self, file_name, out_base_name):
+        names = self._chromosomes + ["unmapped"]
+        out_files = {i if i < len(self._chromosomes) else -1:
+                     open(out_base_name + "_" + chrom + ".json", "wb",
+                          buffering=16*1024*1024)
+                     for i, chrom in enumerate(names)}
+        n_unmapped = 0
+        for i, result in enumerate(self._get_chunk_results(file_name)):
+            logging.info("Chunk #%d", i)
+            for chrom, lines in result.items():
+                out_files[chrom].write(lines)
+            n_unmapped += result.get(-1, b"").count(b"\n")
+        for f in out_files.values():
+            f.close()
+        return n_unmapped
@@ -1,12 +1,98 @@
 import logging
+import os
+import queue
+import threading
 import numpy as np
 
 from .peakcollection import PeakCollection
+from .peakarrays import PeakArrays, get_arrays_file_name
+from .sparsediffs import SparseValues
+from .touchednodes import TouchedNodes, read_touched_nodes
+
+
+def get_nbytes(data):
+    """Bytes used by the arrays of a track or touched nodes"""
+    return sum(getattr(data, name).nbytes
+               for name in ("indices", "values", "_mask")
+               if hasattr(data, name))
+
+
+class WriteBehind:
+    """Runs write functions in order in a background thread. Errors are
+    raised from flush. A forked process gets a thread of its own"""
+
+    def __init__(self):
+        self._pid = None
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._errors = []
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except Exception as e:
+                logging.exception("Failed writing in the background")
+                self._errors.append(e)
+            self._queue.task_done()
+
+    def submit(self, func, *args):
+        if self._pid != os.getpid():
+            self._start()
+        self._queue.put((func, args))
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        self._queue.join()
+        if self._errors:
+            error = self._errors[0]
+            self._errors = []
+            raise error
 
 
 class Reporter:
-    def __init__(self, base_name):
+    """Writes the results of each stage of the peak calling to files
+    prefixed with base_name.
+
+    The results used by later stages (HANDOFF_NAMES) are also kept in
+    memory, with 32 bit indices and values where that loses nothing,
+    and are read from there by get, so that stages run in the
+    same process do not read them back from disk. With write_files=False
+    nothing is written, and with write_behind=True files are written in
+    a background thread. Sub reporters share the results and the
+    writing thread of their parent. Call flush before the files are
+    read by another process"""
+
+    HANDOFF_NAMES = ("direct_pileup", "touched_nodes", "pvalues")
+
+    def __init__(self, base_name, compact=False, chunked=False,
+                 write_files=True, write_behind=False):
         self._base_name = base_name
+        self.compact = compact
+        self.chunked = chunked
+        self.write_files = write_files
+        self.write_behind = write_behind
+        self._results = {}
+        self._writer = WriteBehind() if write_behind else None
+
+    @staticmethod
+    def _compact(data):
+        """Tracks kept in memory are compacted as far as it does not
+        change them"""
+        if isinstance(data, SparseValues):
+            return data.compact(lossless=True)
+        return data
+
+    def _write_track(self, data, name):
+        if self.compact:
+            data = data.compact()
+        data.to_sparse_files(self._base_name + name, chunked=self.chunked)
 
     def sub_graphs(self, data):
         np.savez(self._base_name + "sub_graphs.graphs",
@@ -15,51 +101,98 @@ class Reporter:
                  **{"peak%s" % i: p._node_ids for i, p in enumerate(data)})
 
     def qvalues(self, data):
-        data.to_sparse_files(
-            self._base_name + "qvalues")
+        self._write_track(data, "qvalues")
 
     def pvalues(self, data):
-        data.to_sparse_files(
-            self._base_name + "pvalues")
+        # Never compacted, since q values are computed from them
+        data.to_sparse_files(self._base_name + "pvalues", chunked=self.chunked)
+
+    def _write_peaks(self, data, file_name):
+        PeakCollection(data).to_file(file_name, text_file=True)
+        PeakArrays.from_peaks(data).to_file(get_arrays_file_name(file_name))
 
     def all_max_paths(self, data):
-        PeakCollection(data).to_file(
-            self._base_name+"all_max_paths.intervalcollection",
-            text_file=True)
+        self._write_peaks(
+            data, self._base_name+"all_max_paths.intervalcollection")
 
     def max_paths(self, data):
-        PeakCollection(data).to_file(
-            self._base_name+"max_paths.intervalcollection",
-            text_file=True)
+        self._write_peaks(
+            data, self._base_name+"max_paths.intervalcollection")
 
     def hole_cleaned(self, data):
-        data.to_sparse_files(self._base_name+"hole_cleaned")
+        self._write_track(data, "hole_cleaned")
 
     def fragment_pileup(self, data):
-        data.to_sparse_files(self._base_name+"fragment_pileup")
+        self._write_track(data, "fragment_pileup")
 
     def background_track(self, data):
-        data.to_sparse_files(self._base_name+"background_track")
+        self._write_track(data, "background_track")
 
     def thersholded(self, data):
-        data.to_sparse_files(self._base_name+"thresholded")
+        self._write_track(data, "thresholded")
 
     def direct_pileup(self, data):
-        data.to_sparse_files(self._base_name+"direct_pileup")
+        self._write_track(data, "direct_pileup")
 
     def touched_nodes(self, data):
-        np.save(self._base_name + "touched_nodes.npy",
-                np.array(list(data), dtype="int"))
+        if not isinstance(data, TouchedNodes):
+            data = TouchedNodes.from_node_ids(data)
+        data.to_file(self._base_name + "touched_nodes.npz")
 
     def add(self, name, data):
-        if hasattr(self, name):
-            getattr(self, name)(data)
-            logging.info("Wrote %s to file", name)
-        else:
+        if not hasattr(self, name):
             logging.info("Skipping reporting of %s", name)
+            return
+        if name in self.HANDOFF_NAMES:
+            self._results[self._base_name + name] = self._compact(data)
+        if not self.write_files:
+            return
+        if self._writer is not None:
+            self._writer.submit(getattr(self, name), data)
+            logging.info("Writing %s to file in the background", name)
+            return
+        getattr(self, name)(data)
+        logging.info("Wrote %s to file", name)
+
+    def get(self, name):
+        """The result name, from memory if it was added in this
+        process, or else from file"""
+        key = self._base_name + name
+        if key in self._results:
+            return self._results[key]
+        if not self.write_files:
+            raise KeyError("%s was not added to the reporter" % key)
+        self.flush()
+        logging.info("Reading %s from file", key)
+        if name == "touched_nodes":
+            return read_touched_nodes(self._base_name)
+        return SparseValues.from_sparse_files(key)
+
+    def memory_use(self):
+        """Bytes used by the results kept in memory (by all reporters
+        sharing them)"""
+        return sum(get_nbytes(data) for data in self._results.values())
+
+    def release(self):
+        """Drop the results of this reporter (and its sub reporters) from
+        memory. Later calls to get read them from file"""
+        for key in [key for key in self._results
+                    if key.startswith(self._base_name)]:
+            del self._results[key]
+
+    def flush(self):
+        """Wait until all files are written"""
+        if self._writer is not None:
+            self._writer.flush()
 
     def get_sub_reporter(self, name):
         if name != "":
             name += "_"
 
-        return self.__class__(self._base_name + name)
+        sub_reporter = self.__class__(
+            self._base_name + name, self.compact, self.chunked,
+            self.write_files)
+        sub_reporter.write_behind = self.write_behind
+        sub_reporter._results = self._results
+        sub_reporter._writer = self._writer
+        return sub_reporter
@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+
+# Commands the server can run. Kept here rather than in server.py so
+# that the command line interface can list them without importing the
+# server
+SERVER_COMMANDS = ("callpeaks", "callpeaks_whole_genome_from_p_values",
+                   "get_summits", "peaks_to_fasta", "peaks_to_linear")
+
+_cache = None
+_lock = threading.Lock()
+
+
+def enable_cache():
+    """Keep loaded graphs, sequence graphs and linear paths/maps in
+    memory, so that later loads of the same (unchanged) file are free.
+    Only the last loaded copy of each file is kept.
+    Used by the server, where many jobs use the same files"""
+    global _cache
+    if _cache is None:
+        _cache = {}
+
+
+def clear_cache():
+    if _cache is not None:
+        _cache.clear()
+
+
+def cached_files():
+    if _cache is None:
+        return []
+    return sorted(set(key[1] for key in _cache))
+
+
+def _load(kind, loader, file_name, *args):
+    if _cache is None:
+        return loader(file_name, *args)
+    path = os.path.abspath(file_name)
+    key = (kind, path, os.path.getmtime(path)) + tuple(id(a) for a in args)
+    with _lock:
+        if key not in _cache:
+            # Keep one copy per file, so that copies of earlier versions
+            # of the file (or for earlier graphs) are freed
+            for old_key in [old_key for old_key in _cache
+                            if old_key[:2] == key[:2]]:
+                logging.info("Dropping old copy of %s %s", kind, file_name)
+                del _cache[old_key]
+            logging.info("Loading %s %s", kind, file_name)
+            _cache[key] = loader(file_name, *args)
+        else:
+            logging.info("Using already loaded %s %s", kind, file_name)
+        return _cache[key]
+
+
+def get_graph(file_name):
+    from offsetbasedgraph import Graph
+    return _load("graph", Graph.from_file, file_name)
+
+
+def get_sequence_graph(file_name):
+    from offsetbasedgraph import SequenceGraph
+    return _load("sequence graph", SequenceGraph.from_file, file_name)
+
+
+def get_linear_path(file_name):
+    from offsetbasedgraph import NumpyIndexedInterval
+    return _load("linear path", NumpyIndexedInterval.from_file, file_name)
+
+
+def get_linear_map(file_name, graph):
+    from .control.linearmap import LinearMap
+    return _load("linear map", LinearMap.from_file, file_name, graph)
+
+
+def preload(graph_file_names):
+    """Load graphs, and their sequence graphs if found, into the cache"""
+    enable_cache()
+    for file_name in graph_file_names:
+        get_graph(file_name)
+        if os.path.isfile(file_name + ".sequences"):
+            get_sequence_graph(file_name + ".sequences")
@@ -1,8 +1,11 @@
 import numpy as np
 import logging
+import multiprocessing
 from itertools import chain
 from collections import defaultdict
+from ..linearprojection import AlignmentArrays, chunks
 from ..sparsediffs import SparseDiffs
+from ..touchednodes import TouchedNodes
 from ..custom_exceptions import InvalidPileupInterval
 
 
@@ -34,6 +37,28 @@ class SparseGraphPileup:
                           str(self.node_starts)]))
 
 
+def merge_pileups(graph, pileups):
+    """Pileup with the starts, ends and node starts of all pileups added
+    together, and the nodes touched in any of them"""
+    merged = SparseGraphPileup(graph)
+    merged.starts = np.concatenate(
+        [np.asanyarray(p.starts, dtype="int64") for p in pileups])
+    merged.ends = np.concatenate(
+        [np.asanyarray(p.ends, dtype="int64") for p in pileups])
+    for pileup in pileups:
+        merged.node_starts += pileup.node_starts
+        merged.touched_nodes |= pileup.touched_nodes
+    return merged
+
+
+def _as_arrays(pileup):
+    """Pileup with starts and ends as arrays, which are faster to send
+    between processes"""
+    pileup.starts = np.asanyarray(pileup.starts, dtype="int64")
+    pileup.ends = np.asanyarray(pileup.ends, dtype="int64")
+    return pileup
+
+
 class ReadsAdder:
     def __init__(self, graph, pileup, keep_ends=False):
         self._graph = graph
@@ -118,6 +143,13 @@ class ReadsAdderWDirect(ReadsAdder):
             self.pos_read_ends.append(
                 self._node_indexes[abs(rp)-self.min_id]+end_pos.offset)
 
+    def get_read_ends_pileup(self):
+        """The ends of the reads themselves (not extended), as a pileup"""
+        pileup = SparseGraphPileup(self._graph)
+        pileup.ends = self.pos_read_ends
+        pileup.starts = self.neg_read_ends
+        return pileup
+
 
 class SparseExtender:
     def __init__(self, graph, pileup, fragment_length):
@@ -211,24 +243,75 @@ class ReverseSparseExtender(SparseExtender):
         self._pileup.starts.append(self._graph_size-index)
 
 
+# Reads per batch when the reads are added in several processes
+READ_BATCH_SIZE = 100000
+
+_graph = None
+
+
+def _set_graph(graph):
+    global _graph
+    _graph = graph
+
+
+def extend_strand(graph, ends, extension, is_reverse):
+    """Extend the read ends of one strand, into a pileup of their own"""
+    pileup = SparseGraphPileup(graph)
+    extender = ReverseSparseExtender if is_reverse else SparseExtender
+    extender(graph, pileup, extension).run_linear(ends)
+    return pileup
+
+
+def _extend_strand(args):
+    return _as_arrays(extend_strand(_graph, *args))
+
+
+def _add_batch(alignments):
+    graph = _graph
+    pileup = SparseGraphPileup(graph)
+    reads_adder = ReadsAdderWDirect(graph, pileup)
+    reads_adder.add_reads(alignments.to_intervals(graph))
+    pos_ends = {node_id: ends for node_id, ends
+                in reads_adder.get_pos_ends().items() if ends}
+    neg_ends = {node_id: ends for node_id, ends
+                in reads_adder.get_neg_ends().items() if ends}
+    return (_as_arrays(pileup), _as_arrays(reads_adder.get_read_ends_pileup()),
+            pos_ends, neg_ends)
+
+
 class SamplePileupGenerator:
-    def __init__(self, graph, extension):
+    """Creates the fragment pileup of reads, by extending them on each
+    strand. The extensions of each strand are written to pileups of
+    their own, which are added to the pileup of the reads at the end.
+
+    With n_processes > 1 the two strands are extended in worker
+    processes while the direct pileup is created. With more than two
+    processes, or with run_batches, batches of reads are added in
+    parallel as well. Workers are started from a fork server, so that
+    threads of this process (e.g. prefetching or writing files) are not
+    forked while they hold locks"""
+
+    def __init__(self, graph, extension, n_processes=1):
         logging.info("Using extension %d when extending reads. " % extension)
         if extension < 0:
             raise Exception("Invalid extension size %d used. Must be positive. Is fragment length < read length?" % extension)
         self._pileup = SparseGraphPileup(graph)
         self._graph = graph
+        self._extension = extension
+        self._n_processes = n_processes
         self._reads_adder = ReadsAdderWDirect(graph, self._pileup)
-        self._pos_extender = SparseExtender(graph, self._pileup, extension)
-        self._neg_extender = ReverseSparseExtender(
-            graph, self._pileup, extension)
+        self._batch_pileups = []
+        self._batch_read_ends = []
 
-    def get_direct_pileup(self):
-        new_pileup = SparseGraphPileup(self._graph)
-        new_pileup.ends = self._pileup.ends + self._reads_adder.pos_read_ends
-        new_pileup.starts = self._pileup.starts + self._reads_adder.neg_read_ends
-        new_pileup.node_starts = self._pileup.node_starts
+    def _get_pool(self, n_processes):
+        return multiprocessing.get_context("forkserver").Pool(
+            n_processes, initializer=_set_graph, initargs=(self._graph,))
 
+    def get_direct_pileup(self):
+        new_pileup = merge_pileups(
+            self._graph,
+            [self._pileup, self._reads_adder.get_read_ends_pileup()] +
+            self._batch_pileups + self._batch_read_ends)
         sparsediff = SparseDiffs.from_pileup(
             new_pileup, self._graph.node_indexes)
         sparsediff.clean()
@@ -236,15 +319,62 @@ class SamplePileupGenerator:
         sparse_values.track_size = self._graph.node_indexes[-1]
         return sparse_values
 
+    def _get_strand_args(self):
+        return [(self._reads_adder.get_pos_ends(), self._extension, False),
+                (self._reads_adder.get_neg_ends(), self._extension, True)]
+
+    def _run_extenders(self, reporter):
+        if self._n_processes == 1:
+            if reporter is not None:
+                reporter.add("direct_pileup", self.get_direct_pileup())
+            return [extend_strand(self._graph, *args)
+                    for args in self._get_strand_args()]
+        with self._get_pool(2) as pool:
+            strand_pileups = pool.map_async(_extend_strand,
+                                            self._get_strand_args())
+            if reporter is not None:
+                reporter.add("direct_pileup", self.get_direct_pileup())
+            return strand_pileups.get()
+
+    def _add_batch_result(self, result):
+        pileup, read_ends_pileup, pos_ends, neg_ends = result
+        self._batch_pileups.append(pileup)
+        self._batch_read_ends.append(read_ends_pileup)
+        for node_id, ends in pos_ends.items():
+            self._reads_adder.get_pos_ends()[node_id].extend(ends)
+        for node_id, ends in neg_ends.items():
+            self._reads_adder.get_neg_ends()[node_id].extend(ends)
+
+    def _get_fragment_pileup(self, reporter):
+        strand_pileups = self._run_extenders(reporter)
+        pileup = merge_pileups(
+            self._graph, [self._pileup] + self._batch_pileups + strand_pileups)
+        sdiffs = SparseDiffs.from_pileup(pileup, self._graph.node_indexes)
+        sdiffs.touched_nodes = TouchedNodes(
+            pileup.touched_nodes[:-2], self._graph.min_node)
+        return sdiffs
+
     def run(self, reads, reporter=None):
+        if self._n_processes > 2:
+            return self.run_batches(chunks(reads, READ_BATCH_SIZE), reporter)
         self._reads_adder.add_reads(reads)
-        if reporter is not None:
-            reporter.add("direct_pileup", self.get_direct_pileup())
-        self._pos_extender.run_linear(self._reads_adder.get_pos_ends())
-        self._neg_extender.run_linear(self._reads_adder.get_neg_ends())
-        sdiffs = SparseDiffs.from_pileup(self._pileup,
-                                         self._graph.node_indexes)
-        sdiffs.touched_nodes = set(
-            np.flatnonzero(
-                self._pileup.touched_nodes[:-2]) + self._graph.min_node)
-        return sdiffs
+        return self._get_fragment_pileup(reporter)
+
+    def run_batches(self, read_batches, reporter=None):
+        """As run, for reads given in batches (lists of intervals or
+        AlignmentArrays). With n_processes > 1, the batches are added in
+        worker processes and merged before the reads are extended"""
+        if self._n_processes == 1:
+            for batch in read_batches:
+                if isinstance(batch, AlignmentArrays):
+                    batch = batch.to_intervals(self._graph)
+                self._reads_adder.add_reads(batch)
+            return self._get_fragment_pileup(reporter)
+        batches = (batch if isinstance(batch, AlignmentArrays)
+                   else AlignmentArrays.from_intervals(batch)
+                   for batch in read_batches)
+        with self._get_pool(self._n_processes) as pool:
+            for i, result in enumerate(pool.imap(_add_batch, batches)):
+                logging.info("Added batch %d of reads", i)
+                self._add_batch_result(result)
+        return self._get_fragment_pileup(reporter)
@@ -0,0 +1,168 @@
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+from multiprocessing.connection import wait
+import numpy as np
+
+
+def get_peak_memory():
+    """Peak resident memory of this process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss*1024
+
+
+def get_read_bytes(reads):
+    """Size of a read file, or an approximate size for reads in memory"""
+    if isinstance(reads, str):
+        return os.path.getsize(reads) if os.path.isfile(reads) else 0
+    if hasattr(reads, "_intervals") and hasattr(reads._intervals, "__len__"):
+        return 500*len(reads._intervals)
+    return 0
+
+
+class MemoryEstimator:
+    """Estimates the peak memory used to run one chromosome to p-values.
+
+    The estimate is a linear model in the graph size (bases, nodes and
+    edges) and the size of the read files. Measurements from earlier
+    runs are stored in history_file (json), and used to scale the model:
+    by the largest ratio measured/model for the same graph, or else by
+    the median ratio for all graphs"""
+
+    base = 200*1024**2
+    bytes_per_base = 2
+    bytes_per_node = 64
+    bytes_per_edge = 16
+    bytes_per_read_byte = 0.5
+    safety_factor = 1.1
+
+    def __init__(self, history_file=None):
+        self._history_file = history_file
+        self._history = []
+        if history_file is not None and os.path.isfile(history_file):
+            with open(history_file) as f:
+                self._history = json.load(f)
+            logging.info("Read %d memory measurements from %s",
+                         len(self._history), history_file)
+
+    @staticmethod
+    def get_features(graph_file_name, reads):
+        with np.load(graph_file_name) as data:
+            blocks = data["blocks"]
+            n_edges = data["adj_list_values"].size
+        return {"graph": os.path.abspath(graph_file_name),
+                "n_bases": int(blocks.sum()),
+                "n_nodes": int(blocks.size-1),
+                "n_edges": int(n_edges),
+                "read_bytes": int(sum(get_read_bytes(r) for r in reads))}
+
+    def model(self, features):
+        return (self.base +
+                self.bytes_per_base*features["n_bases"] +
+                self.bytes_per_node*features["n_nodes"] +
+                self.bytes_per_edge*features["n_edges"] +
+                self.bytes_per_read_byte*features["read_bytes"])
+
+    def estimate(self, features):
+        ratios = [record["peak_memory"]/self.model(record["features"])
+                  for record in self._history]
+        same_graph = [ratio for ratio, record in zip(ratios, self._history)
+                      if record["features"]["graph"] == features["graph"]]
+        if same_graph:
+            scale = max(same_graph)
+        elif ratios:
+            scale = float(np.median(ratios))
+        else:
+            scale = 1
+        return int(self.safety_factor*scale*self.model(features))
+
+    def add(self, features, peak_memory):
+        self._history.append({"features": features,
+                              "peak_memory": int(peak_memory)})
+
+    def save(self):
+        if self._history_file is None:
+            return
+        try:
+            with open(self._history_file, "w") as f:
+                json.dump(self._history, f)
+        except OSError as e:
+            logging.warning("Could not write memory history: %s", e)
+
+
+def _run_job(func, job, connection):
+    start_memory = get_peak_memory()
+    try:
+        func(job)
+        is_ok = True
+    except Exception:
+        logging.exception("Job %s failed", job)
+        is_ok = False
+    connection.send((is_ok, get_peak_memory()-start_memory))
+    connection.close()
+
+
+class MemoryScheduler:
+    """Runs jobs in forked processes, largest estimate first, starting
+    a job only if the estimates of all running jobs plus its own fit in
+    memory_limit (bytes). A job larger than the limit is run alone"""
+
+    def __init__(self, memory_limit, n_processes=None):
+        self.memory_limit = memory_limit
+        self.n_processes = n_processes or os.cpu_count() or 1
+        self._context = multiprocessing.get_context("fork")
+
+    def _start(self, func, job):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_job,
+                                        args=(func, job, sender))
+        process.start()
+        sender.close()
+        return process, receiver
+
+    def run(self, func, jobs, estimates):
+        """Run func(job) for all jobs. Returns the measured peak memory
+        (bytes, above that of this process) of each job"""
+        pending = sorted(range(len(jobs)), key=lambda i: -estimates[i])
+        running = {}
+        peak_memory = [None]*len(jobs)
+        failed = []
+        while pending or running:
+            used = sum(estimates[i] for i in running.values())
+            for i in list(pending):
+                if len(running) >= self.n_processes:
+                    break
+                if running and used + estimates[i] > self.memory_limit:
+                    continue
+                if estimates[i] > self.memory_limit:
+                    logging.warning(
+                        "Estimated memory for %s (%.1f GB) is above the "
+                        "limit. Running it alone.", jobs[i], estimates[i]/1024**3)
+                logging.info("Starting %s (estimated %.2f GB, %.2f GB in use)",
+                             jobs[i], estimates[i]/1024**3, used/1024**3)
+                pending.remove(i)
+                running[self._start(func, jobs[i])] = i
+                used += estimates[i]
+            finished = wait([receiver for _, receiver in running])
+            for key in [key for key in running if key[1] in finished]:
+                process, receiver = key
+                i = running.pop(key)
+                try:
+                    is_ok, peak_memory[i] = receiver.recv()
+                except EOFError:
+                    is_ok = False
+                process.join()
+                if not is_ok or process.exitcode != 0:
+                    failed.append(jobs[i])
+                else:
+                    logging.info("Finished %s using %.2f GB", jobs[i],
+                                 peak_memory[i]/1024**3)
+        if failed:
+            raise RuntimeError("Failed running %s" % ", ".join(
+                str(job) for job in failed))
+        return peak_memory
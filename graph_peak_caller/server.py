@@ -0,0 +1,292 @@
+"""Local server that keeps graphs, sequence graphs and linear paths
+loaded between jobs.
+
+Jobs are command lines for one of SERVER_COMMANDS, sent as JSON lines
+over a Unix socket. Each job is run by a pool of worker processes in
+its own directory <jobs_dir>/jobNNNN/, where relative output file names
+end up and where the log of the job is written (job.log). The log is
+streamed back to the client while the job runs.
+"""
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from . import resources
+
+SERVER_COMMANDS = resources.SERVER_COMMANDS
+LOG_NAME = "job.log"
+MAX_FINISHED_JOBS = 1000
+
+
+def run_job(job_args, job_dir):
+    """Run one command line in job_dir, with stdout and stderr (and so
+    the log) going to job_dir/job.log. Returns the exit code"""
+    from .command_line_interface import run_argument_parser
+    os.chdir(job_dir)
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(LOG_NAME, "a", buffering=1) as log_file:
+        sys.stdout = sys.stderr = log_file
+        try:
+            run_argument_parser(job_args)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+    return code
+
+
+class Job:
+    def __init__(self, job_id, job_args, job_dir, future):
+        self.job_id = job_id
+        self.job_args = job_args
+        self.job_dir = job_dir
+        self.future = future
+
+    def status(self):
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+        return "done" if self.exit_code() == 0 else "failed"
+
+    def is_finished(self):
+        return self.future.done()
+
+    def exit_code(self):
+        try:
+            return self.future.result()
+        except Exception as e:
+            logging.error("Job %s crashed: %s", self.job_id, e)
+            return 1
+
+    def follow_log(self, poll_interval=0.1):
+        """Yield the lines of the job log as they are written, until
+        the job is finished"""
+        log_name = os.path.join(self.job_dir, LOG_NAME)
+        while not os.path.isfile(log_name) and not self.future.done():
+            time.sleep(poll_interval)
+        if not os.path.isfile(log_name):
+            return
+        with open(log_name) as f:
+            line = ""
+            while True:
+                is_done = self.future.done()
+                line += f.readline()
+                if line.endswith("\n"):
+                    yield line
+                    line = ""
+                elif is_done:
+                    break
+                else:
+                    time.sleep(poll_interval)
+            if line:
+                yield line
+
+
+class JobQueue:
+    """Runs jobs in a pool of worker processes. Workers are forked from
+    the server, so files preloaded by the server are shared, and keep
+    files they load themselves for later jobs. Only the last
+    max_finished_jobs finished jobs are kept track of"""
+
+    def __init__(self, jobs_dir, n_workers=1,
+                 max_finished_jobs=MAX_FINISHED_JOBS):
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(
+            n_workers, mp_context=multiprocessing.get_context("fork"),
+            initializer=resources.enable_cache)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _create_job_dir(self):
+        n = len(os.listdir(self.jobs_dir))
+        while True:
+            job_id = "job%04d" % n
+            try:
+                os.makedirs(os.path.join(self.jobs_dir, job_id))
+                return job_id
+            except FileExistsError:
+                n += 1
+
+    def submit(self, job_args):
+        if not job_args or job_args[0] not in SERVER_COMMANDS:
+            raise ValueError("Can only run %s, not %s" % (
+                ", ".join(SERVER_COMMANDS), " ".join(job_args)))
+        with self._lock:
+            job_id = self._create_job_dir()
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            with open(os.path.join(job_dir, "job.json"), "w") as f:
+                json.dump({"args": job_args}, f)
+            future = self._executor.submit(run_job, job_args, job_dir)
+            job = Job(job_id, job_args, job_dir, future)
+            self._jobs[job_id] = job
+            self._prune_jobs()
+        logging.info("Queued %s: %s", job_id, " ".join(job_args))
+        return job
+
+    def _prune_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.is_finished()]
+        for job_id in finished[:max(len(finished)-self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def get_job(self, job_id):
+        return self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles one JSON line request. {"args": [...]} submits a job and
+    streams back its log, {"status": true} lists all jobs"""
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            if request.get("status"):
+                self._send({"jobs": [
+                    {"job_id": job.job_id, "status": job.status(),
+                     "args": job.job_args}
+                    for job in self.server.jobs._jobs.values()]})
+                return
+            try:
+                job = self.server.jobs.submit(request["args"])
+            except ValueError as e:
+                self._send({"error": str(e)})
+                return
+            self._send({"job_id": job.job_id, "out_dir": job.job_dir})
+            for line in job.follow_log():
+                self._send({"log": line})
+            self._send({"job_id": job.job_id, "status": job.status(),
+                        "exit_code": job.exit_code(),
+                        "out_dir": job.job_dir})
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info("Client disconnected")
+
+
+def remove_stale_socket(socket_path):
+    """Remove the socket left at socket_path by a server that is no
+    longer running. Raises ValueError if socket_path is something else,
+    or a server is listening on it"""
+    if not os.path.exists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise ValueError("%s exists and is not a socket" % socket_path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except ConnectionRefusedError:
+        logging.info("Removing stale socket %s", socket_path)
+        os.remove(socket_path)
+        return
+    finally:
+        client.close()
+    raise ValueError("A server is already running on %s" % socket_path)
+
+
+class PeakCallerServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, jobs):
+        remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               RequestHandler)
+        self.jobs = jobs
+
+
+def absolute_path_args(job_args):
+    """Make arguments that are existing files (or glob patterns
+    matching files) absolute, since jobs are run in their own
+    directories. Other arguments, e.g. output names, are kept"""
+    new_args = []
+    for arg in job_args:
+        if not arg.startswith("-") and glob.glob(arg):
+            new_arg = os.path.abspath(arg)
+            if arg.endswith("/"):
+                new_arg += "/"
+            arg = new_arg
+        new_args.append(arg)
+    return new_args
+
+
+def submit_job(socket_path, job_args, out=None):
+    """Send a job to the server, writing its log to out. Returns the
+    final message from the server"""
+    out = sys.stdout if out is None else out
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    with client, client.makefile("rwb") as stream:
+        stream.write((json.dumps({"args": job_args}) + "\n").encode())
+        stream.flush()
+        message = {}
+        for line in stream:
+            message = json.loads(line.decode())
+            if "log" in message:
+                out.write(message["log"])
+            elif "error" in message:
+                logging.error(message["error"])
+            elif "status" not in message:
+                logging.info("Submitted %s (output in %s)",
+                             message["job_id"], message["out_dir"])
+    return message
+
+
+def serve(args):
+    socket_path = args.socket if args.socket is not None \
+        else "graph_peak_caller.sock"
+    jobs_dir = args.jobs_dir if args.jobs_dir is not None else "jobs"
+    n_workers = int(args.n_workers) if args.n_workers is not None else 1
+    if args.preload is not None:
+        resources.preload(args.preload.split(","))
+    resources.enable_cache()
+    try:
+        remove_stale_socket(socket_path)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    jobs = JobQueue(jobs_dir, n_workers)
+    server = PeakCallerServer(socket_path, jobs)
+    logging.info("Serving on %s with %d workers. Job output in %s",
+                 socket_path, n_workers, jobs.jobs_dir)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down")
+    finally:
+        server.server_close()
+        jobs.shutdown()
+        os.remove(socket_path)
+
+
+def submit(args):
+    socket_path = args.socket if args.socket is not None \
+        else "graph_peak_caller.sock"
+    message = submit_job(socket_path, absolute_path_args(args.job))
+    if "error" in message:
+        sys.exit(1)
+    logging.info("%s %s. Output in %s", message["job_id"],
+                 message["status"], message["out_dir"])
+    if message["exit_code"] != 0:
+        sys.exit(message["exit_code"])
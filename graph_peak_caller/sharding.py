@@ -0,0 +1,436 @@
+import logging
+import os
+import numpy as np
+from offsetbasedgraph.graph import BlockArray, AdjListAsNumpyArrays
+from offsetbasedgraph.vcfmap import VariantMap
+
+from .callpeaks import CallPeaks, CallPeaksFromQvalues
+from .control import get_extensions
+from .control.linearmap import LinearMap
+from .linearprojection import AlignmentArrays
+from .postprocess.graphs import get_edges
+from .reporter import Reporter
+from . import resources
+from .sparsediffs import SparseValues, get_index_dtype
+from .sparsepvalues import PToQValuesMapper, QValuesFinder
+from .touchednodes import TouchedNodes
+from .trackstore import ChunkedTrackWriter
+
+
+def find_cut_nodes(graph):
+    """Nodes that no edge jumps over, i.e. nodes every path from
+    before to after them has to pass through. Assumes that node ids
+    are topologically sorted"""
+    node_indexes = graph.node_indexes.astype("int64")
+    node_sizes = np.diff(node_indexes)
+    node_ids = np.arange(node_sizes.size)+graph.min_node
+    idxs, adjs = get_edges(graph.adj_list, node_ids)
+    firsts = np.minimum(node_ids[idxs], np.abs(adjs))-graph.min_node
+    lasts = np.maximum(node_ids[idxs], np.abs(adjs))-graph.min_node
+    n_jumps = np.cumsum(
+        np.bincount(firsts+1, minlength=node_ids.size+1) -
+        np.bincount(lasts, minlength=node_ids.size+1))[:-1]
+    return node_ids[(n_jumps == 0) & (node_sizes > 0)]
+
+
+def get_windows(graph, window_size, halo_size):
+    """Split the graph at cut nodes into windows of about window_size
+    base pairs. Returns (starts, ends, firsts, lasts) where the cores
+    (starts[i] <= node < ends[i]) partition the graph, and the windows
+    (firsts[i] <= node <= lasts[i]) add a halo on each side. Every path
+    from a core to a node outside its window passes fully through cut
+    nodes of total length at least halo_size"""
+    min_node = graph.min_node
+    node_indexes = graph.node_indexes.astype("int64")
+    max_node = min_node+node_indexes.size-2
+    cut_nodes = find_cut_nodes(graph)
+    cut_offsets = node_indexes[cut_nodes-min_node]
+    starts = [min_node]
+    while True:
+        i = np.searchsorted(
+            cut_offsets, node_indexes[starts[-1]-min_node]+window_size)
+        if i >= cut_nodes.size:
+            break
+        starts.append(int(cut_nodes[i]))
+    starts = np.array(starts, dtype="int64")
+    ends = np.r_[starts[1:], max_node+1]
+
+    cum_lengths = np.r_[0, np.cumsum(
+        node_indexes[cut_nodes-min_node+1]-cut_offsets)]
+    start_cuts = np.searchsorted(cut_nodes, starts)
+    first_cuts = np.searchsorted(
+        cum_lengths, cum_lengths[start_cuts]-halo_size, side="right")-1
+    firsts = np.where(first_cuts >= 0,
+                      cut_nodes[np.maximum(first_cuts, 0)], min_node)
+    end_cuts = np.searchsorted(cut_nodes, ends)
+    last_cuts = np.searchsorted(
+        cum_lengths, cum_lengths[end_cuts]+halo_size)-1
+    lasts = np.where(last_cuts < cut_nodes.size,
+                     cut_nodes[np.minimum(last_cuts, cut_nodes.size-1)],
+                     max_node)
+    return starts, ends, firsts, lasts
+
+
+def get_sub_adj_list(adj_list, node_ids, first, last):
+    """Edges out of node_ids (sorted) to nodes in first..last"""
+    idxs, adjs = get_edges(adj_list, node_ids)
+    keep = (np.abs(adjs) >= first) & (np.abs(adjs) <= last)
+    n_edges = np.bincount(idxs[keep], minlength=node_ids.size)
+    return AdjListAsNumpyArrays(
+        (np.cumsum(n_edges)-n_edges).astype("int32"),
+        adjs[keep].astype("int32"), n_edges.astype("int32"),
+        int(node_ids[0]))
+
+
+def get_subgraph(graph, first, last):
+    """Numpy backed graph of the nodes first..last, keeping node ids"""
+    assert graph.uses_numpy_backend()
+    offset = graph.blocks.node_id_offset
+    blocks = BlockArray(np.r_[0, graph.blocks._array[
+        first-offset:last-offset+1]].astype(graph.blocks._array.dtype))
+    blocks.node_id_offset = first-1
+    adj_list = get_sub_adj_list(
+        graph.adj_list, np.arange(first, last+1), first, last)
+    reverse_adj_list = get_sub_adj_list(
+        graph.reverse_adj_list, np.arange(-last, -first+1), first, last)
+    return graph.__class__(blocks, adj_list, create_reverse_adj_list=False,
+                           rev_adj_list=reverse_adj_list)
+
+
+def get_sub_linear_map(linear_map, graph):
+    """Part of linear_map covering the nodes in graph (a subgraph),
+    keeping the linear coordinates of the whole graph"""
+    first = graph.min_node-linear_map._graph.min_node
+    last = first+graph.node_indexes.size-1
+    return LinearMap(linear_map._node_starts[first:last],
+                     linear_map._node_ends[first:last], graph)
+
+
+def get_sub_variant_maps(variant_maps, first, last, min_node):
+    if variant_maps is None:
+        return None
+    idxs = slice(first-min_node, last-min_node+1)
+    return VariantMap(snps=variant_maps.snps[idxs],
+                      insertions=variant_maps.insertions[idxs],
+                      deletions=variant_maps.deletions,
+                      trails=variant_maps.trails[idxs])
+
+
+def get_track_slice(track, start, end):
+    """The part start..end of a SparseValues track, as a track
+    starting at 0"""
+    first = np.searchsorted(track.indices, start, side="right")-1
+    last = np.searchsorted(track.indices, end)
+    new = SparseValues(np.r_[start, track.indices[first+1:last]]-start,
+                       track.values[first:last])
+    new.track_size = end-start
+    return new
+
+
+def join_tracks(tracks, offsets, track_size):
+    """Concatenate SparseValues tracks starting at offsets"""
+    track = SparseValues(
+        np.concatenate([t.indices+offset for t, offset
+                        in zip(tracks, offsets)]),
+        np.concatenate([t.values for t in tracks]))
+    track.track_size = track_size
+    return track
+
+
+def write_joined_track(file_base_name, part_base_names, offsets, track_size,
+                       compact=False, chunked=False):
+    """Write the SparseValues tracks in the files part_base_names,
+    starting at offsets, as one track, reading one part at a time.
+    With compact, indices and values are written with 32 bits"""
+    index_dtype = get_index_dtype(track_size) if compact else np.int64
+    if chunked:
+        with ChunkedTrackWriter(file_base_name, track_size,
+                                index_dtype) as writer:
+            for part_base_name, offset in zip(part_base_names, offsets):
+                part = SparseValues.from_sparse_files(part_base_name)
+                if compact:
+                    part = part.compact()
+                writer.add(part, offset)
+        return
+    sizes = [np.load(name + "_values.npy", mmap_mode="r").size
+             for name in part_base_names]
+    values_dtype = np.load(part_base_names[0] + "_values.npy",
+                           mmap_mode="r").dtype
+    if compact and values_dtype.kind == "f":
+        values_dtype = np.float32
+    indices = np.lib.format.open_memmap(
+        file_base_name + "_indexes.npy", mode="w+", dtype=index_dtype,
+        shape=(sum(sizes)+1,))
+    values = np.lib.format.open_memmap(
+        file_base_name + "_values.npy", mode="w+", dtype=values_dtype,
+        shape=(sum(sizes),))
+    bounds = np.r_[0, np.cumsum(sizes)]
+    for i, (part_base_name, offset) in enumerate(
+            zip(part_base_names, offsets)):
+        part = SparseValues.from_sparse_files(part_base_name)
+        indices[bounds[i]:bounds[i+1]] = part.indices + offset
+        values[bounds[i]:bounds[i+1]] = part.values
+    indices[-1] = track_size
+    indices.flush()
+    values.flush()
+    del indices, values
+    logging.info("Wrote to %s_indexes/values.npy" % file_base_name)
+
+
+class WindowIntervals:
+    """Reads of one window, read from an AlignmentArrays file. n_reads
+    is the number of reads on the whole graph, so that the tracks of
+    the window are scaled as in a run on the whole graph"""
+
+    def __init__(self, file_name, graph, n_reads):
+        self._file_name = file_name
+        self._graph = graph
+        self.n_reads = n_reads
+        self.n_duplicates = 0
+
+    def __iter__(self):
+        return AlignmentArrays.from_file(self._file_name).to_intervals(
+            self._graph)
+
+
+class ShardedCallPeaks:
+    """Calls peaks on one graph window by window, so that memory use
+    is bounded by the window size instead of the graph size.
+
+    The graph is split at cut nodes (see get_windows). Pileups,
+    background and p-values are computed for each window including its
+    halo, which makes them the same as for the whole graph inside the
+    core. The p to q value mapping is made from the p-values of all
+    cores. Peaks are called on groups of cores, split at core starts
+    with no peak area that are longer than the read length, where no
+    peak or filled hole can cross. Apart from floating point rounding
+    in the background track, results are the same as for CallPeaks.
+
+    Files for each window and core are written to work_dir (default
+    <out_name>windows/). The p-values and q-values of the cores are
+    written one core at a time to the files CallPeaks would write with
+    reporter, and touched nodes and max paths are written with reporter
+    as by CallPeaks"""
+
+    def __init__(self, graph, config, reporter, variant_maps=None,
+                 work_dir=None):
+        self.graph = graph
+        self.config = config
+        self._reporter = reporter
+        self.variant_maps = variant_maps
+        self._work_dir = work_dir
+        if work_dir is None:
+            self._work_dir = reporter._base_name + "windows"
+        os.makedirs(self._work_dir, exist_ok=True)
+        halo_size = config.halo_size
+        if halo_size is None:
+            halo_size = max([config.fragment_length] + get_extensions(config))
+        self.starts, self.ends, self.firsts, self.lasts = get_windows(
+            graph, config.window_size, halo_size)
+        self._node_indexes = graph.node_indexes.astype("int64")
+        logging.info("Split graph in %d windows", self.starts.size)
+
+    def _get_file_name(self, name, i=None):
+        if i is not None:
+            name = name % i
+        return os.path.join(self._work_dir, name)
+
+    def _get_read_windows(self, alignments):
+        """Pairs of (read, window) for every window containing a read,
+        sorted by window"""
+        if not len(alignments):
+            return np.zeros((2, 0), dtype="int64")
+        nodes = np.abs(alignments.region_paths)
+        first_rps = alignments.region_path_indptr[:-1]
+        first_windows = np.searchsorted(
+            self.lasts, np.maximum.reduceat(nodes, first_rps))
+        end_windows = np.searchsorted(
+            self.firsts, np.minimum.reduceat(nodes, first_rps), side="right")
+        n_windows = np.maximum(end_windows-first_windows, 0)
+        read_ids = np.repeat(np.arange(len(alignments)), n_windows)
+        window_ids = np.arange(read_ids.size) + np.repeat(
+            first_windows-(np.cumsum(n_windows)-n_windows), n_windows)
+        order = np.argsort(window_ids, kind="stable")
+        return np.vstack([read_ids[order], window_ids[order]])
+
+    def _split_reads(self, intervals, name):
+        """Write the reads of each window (the reads within it) to an
+        AlignmentArrays file per window"""
+        alignments = AlignmentArrays.from_intervals(intervals)
+        read_ids, window_ids = self._get_read_windows(alignments)
+        bounds = np.searchsorted(window_ids, np.arange(self.starts.size+1))
+        file_names = []
+        for i in range(self.starts.size):
+            file_names.append(alignments.subset(
+                read_ids[bounds[i]:bounds[i+1]]).to_file(
+                    self._get_file_name(name + "%d_reads.npz", i)))
+        return file_names, len(alignments)
+
+    def _run_window_to_p_values(self, i, sample_file, control_file,
+                                n_sample_reads, n_control_reads,
+                                linear_map, min_value):
+        logging.info("Running window %d to p values (nodes %d-%d)",
+                     i, self.firsts[i], self.lasts[i])
+        graph = get_subgraph(self.graph, self.firsts[i], self.lasts[i])
+        config = self.config.copy()
+        config.linear_map_name = get_sub_linear_map(linear_map, graph)
+        config.global_min = min_value
+        config.background_cache_dir = None
+        reporter = Reporter(self._get_file_name("window%d_", i),
+                            self.config.compact_tracks)
+        caller = CallPeaks(graph, config, reporter)
+        caller.run_to_p_values(
+            WindowIntervals(sample_file, graph, n_sample_reads),
+            WindowIntervals(control_file, graph, n_control_reads))
+
+        node_indexes = graph.node_indexes.astype("int64")
+        core_start = node_indexes[self.starts[i]-self.firsts[i]]
+        core_end = node_indexes[self.ends[i]-self.firsts[i]]
+        get_track_slice(caller.p_values_pileup, core_start, core_end
+                        ).to_sparse_files(self._get_file_name("core%d_pvalues", i))
+        direct_pileup = reporter.get("direct_pileup")
+        get_track_slice(direct_pileup, core_start, core_end).to_sparse_files(
+            self._get_file_name("core%d_direct_pileup", i))
+        TouchedNodes(caller.touched_nodes._mask[
+            self.starts[i]-self.firsts[i]:self.ends[i]-self.firsts[i]],
+                     self.starts[i]).to_file(
+            self._get_file_name("core%d_touched_nodes.npz", i))
+
+    def _join_core_tracks(self, name, window_ids):
+        tracks = [SparseValues.from_sparse_files(
+            self._get_file_name("core%d_" + name, i)) for i in window_ids]
+        offsets = self._node_indexes[self.starts[window_ids]-self.graph.min_node]
+        return join_tracks(
+            tracks, offsets-offsets[0],
+            self._node_indexes[self.ends[window_ids[-1]]-self.graph.min_node] -
+            offsets[0])
+
+    def _write_core_tracks(self, name, compact=False):
+        """Write the track name of all cores to the reporter's file for
+        name, without joining it in memory. If the reporter does not
+        write files, the joined track is added to it instead"""
+        window_ids = np.arange(self.starts.size)
+        if not self._reporter.write_files:
+            self._reporter.add(name, self._join_core_tracks(name, window_ids))
+            return
+        self._reporter.flush()
+        write_joined_track(
+            self._reporter._base_name + name,
+            [self._get_file_name("core%d_" + name, i) for i in window_ids],
+            self._node_indexes[self.starts-self.graph.min_node],
+            int(self._node_indexes[-1]),
+            compact, self._reporter.chunked)
+
+    def _join_touched_nodes(self, window_ids):
+        return TouchedNodes(np.concatenate([
+            TouchedNodes.from_file(
+                self._get_file_name("core%d_touched_nodes.npz", i))._mask
+            for i in window_ids]), self.starts[window_ids[0]])
+
+    def run_to_p_values(self, input_intervals, control_intervals):
+        sample_files, _ = self._split_reads(input_intervals, "sample")
+        control_files, n_mapped = self._split_reads(
+            control_intervals, "control")
+        n_sample_reads = input_intervals.n_reads
+        n_control_reads = control_intervals.n_reads
+        linear_map = self.config.linear_map_name
+        if not isinstance(linear_map, LinearMap):
+            linear_map = resources.get_linear_map(linear_map, self.graph)
+        min_value = self.config.global_min
+        if min_value is None:
+            min_value = n_mapped*self.config.fragment_length / \
+                linear_map._length
+        for i in range(self.starts.size):
+            self._run_window_to_p_values(
+                i, sample_files[i], control_files[i], n_sample_reads,
+                n_control_reads, linear_map, min_value)
+        window_ids = np.arange(self.starts.size)
+        self._write_core_tracks("pvalues")
+        self.touched_nodes = self._join_touched_nodes(window_ids)
+        self._reporter.add("touched_nodes", self.touched_nodes)
+
+    def get_p_to_q_values_mapping(self):
+        self.p_to_q_values_mapping = PToQValuesMapper.from_p_values_files(
+            [self._get_file_name("core%d_pvalues", i)
+             for i in range(self.starts.size)]).get_p_to_q_values()
+
+    def _get_cutoffs(self):
+        if self.config.q_values_thresholds:
+            return list(self.config.q_values_thresholds)
+        return [self.config.q_values_threshold]
+
+    def get_q_values(self):
+        """Write q values for each core, and find the cores that can
+        start a new group of cores to call peaks on"""
+        threshold = -np.log10(max(self._get_cutoffs()))
+        node_sizes = np.diff(self._node_indexes)[self.starts-self.graph.min_node]
+        self.is_group_start = np.zeros(self.starts.size, dtype="bool")
+        self.is_group_start[0] = True
+        for i in range(self.starts.size):
+            p_values = SparseValues.from_sparse_files(
+                self._get_file_name("core%d_pvalues", i))
+            q_values = QValuesFinder(
+                p_values, self.p_to_q_values_mapping).get_q_values()
+            q_values.track_size = p_values.track_size
+            q_values.to_sparse_files(self._get_file_name("core%d_qvalues", i))
+            peaks = q_values.threshold_copy(threshold)
+            start_values = peaks.values[:np.searchsorted(
+                peaks.indices, node_sizes[i])]
+            if node_sizes[i] > self.config.read_length and \
+                    not np.any(start_values):
+                self.is_group_start[i] = True
+        self._write_core_tracks("qvalues", self._reporter.compact)
+
+    def _call_group_peaks(self, window_ids, chromosome):
+        first = self.starts[window_ids[0]]
+        last = self.ends[window_ids[-1]]-1
+        logging.info("Calling peaks on nodes %d-%d", first, last)
+        graph = get_subgraph(self.graph, first, last)
+        caller = CallPeaksFromQvalues(
+            graph, self._join_core_tracks("qvalues", window_ids),
+            self.config, Reporter(
+                self._get_file_name("group%d_", window_ids[0]),
+                self.config.compact_tracks),
+            raw_pileup=self._join_core_tracks("direct_pileup", window_ids),
+            touched_nodes=self._join_touched_nodes(window_ids),
+            config=self.config,
+            variant_maps=get_sub_variant_maps(
+                self.variant_maps, first, last, self.graph.min_node),
+            chromosome=chromosome)
+        caller.callpeaks()
+        return caller
+
+    def call_peaks_from_q_values(self, linear_path=None, chromosome=None):
+        if chromosome is None:
+            chromosome = self._reporter._base_name.replace("_", "")
+        self.get_q_values()
+        cutoffs = self._get_cutoffs()
+        pairs = {cutoff: [] for cutoff in cutoffs}
+        all_max_paths = {cutoff: [] for cutoff in cutoffs}
+        for window_ids in np.split(np.arange(self.starts.size),
+                                   np.flatnonzero(self.is_group_start)[1:]):
+            caller = self._call_group_peaks(window_ids, chromosome)
+            for cutoff in cutoffs:
+                all_max_paths[cutoff].extend(
+                    caller.all_max_paths_by_cutoff[cutoff])
+                pairs[cutoff].extend(zip(caller.max_paths_by_cutoff[cutoff],
+                                         caller.sub_graphs_by_cutoff[cutoff]))
+        self.peak_sets = []
+        for cutoff in cutoffs:
+            reporter = self._reporter if len(cutoffs) == 1 else \
+                self._reporter.get_sub_reporter("q%g" % cutoff)
+            cutoff_pairs = sorted(pairs[cutoff], key=lambda p: p[0].score,
+                                  reverse=True)
+            max_paths = [pair[0] for pair in cutoff_pairs]
+            for max_path in all_max_paths[cutoff]:
+                max_path.graph = self.graph
+            reporter.add("all_max_paths", all_max_paths[cutoff])
+            reporter.add("sub_graphs", [pair[1] for pair in cutoff_pairs])
+            reporter.add("max_paths", max_paths)
+            self.peak_sets.append((reporter, max_paths))
+        self.max_path_peaks = self.peak_sets[0][1]
+
+    def run(self, input_intervals, control_intervals):
+        self.run_to_p_values(input_intervals, control_intervals)
+        self.get_p_to_q_values_mapping()
+        self.call_peaks_from_q_values()
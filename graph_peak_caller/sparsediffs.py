@@ -1,7 +1,59 @@
 import logging
+import os
 import numpy as np
 
 
+def get_index_dtype(max_index):
+    """Smallest of int32/int64 that can hold all indices up to max_index"""
+    if max_index is not None and max_index < np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+# Use a histogram instead of sorting when there are at least
+# 1/DENSE_HISTOGRAM_RATIO as many positions as track positions
+DENSE_HISTOGRAM_RATIO = 4
+
+
+def is_sorted_array(array):
+    return np.all(array[1:] >= array[:-1])
+
+
+def get_merge_positions(a, b):
+    """Positions of the elements of sorted arrays a and b in the
+    stably merged array (elements of a come first for ties)"""
+    a_positions = np.arange(a.size) + np.searchsorted(b, a, side="left")
+    b_positions = np.arange(b.size) + np.searchsorted(a, b, side="right")
+    return a_positions, b_positions
+
+
+def get_merge_args(a, b):
+    """Same as np.argsort(np.r_[a, b], kind="mergesort") for sorted
+    a and b, in linear time"""
+    a_positions, b_positions = get_merge_positions(a, b)
+    args = np.empty(a.size+b.size, dtype="int")
+    args[a_positions] = np.arange(a.size)
+    args[b_positions] = np.arange(a.size, a.size+b.size)
+    return args
+
+
+def is_chunked_track(file_base_name):
+    """True if the track is stored as a chunked track (see trackstore)
+    that is newer than any _indexes/_values.npy files"""
+    chunked_name = file_base_name + "_track.npz"
+    indexes_name = file_base_name + "_indexes.npy"
+    return os.path.isfile(chunked_name) and (
+        not os.path.isfile(indexes_name) or
+        os.path.getmtime(chunked_name) >= os.path.getmtime(indexes_name))
+
+
+def get_compact_indices(indices, track_size=None):
+    max_index = indices[-1] if indices.size else 0
+    if track_size is not None:
+        max_index = max(max_index, track_size)
+    return indices.astype(get_index_dtype(max_index), copy=False)
+
+
 class SparseValues:
     def __init__(self, indices, values, sanitize=False):
         self.indices = np.asanyarray(indices)
@@ -21,6 +73,10 @@ class SparseValues:
 
     @classmethod
     def from_sparse_files(cls, file_base_name):
+        if is_chunked_track(file_base_name):
+            from .trackstore import ChunkedTrack
+            with ChunkedTrack.from_base_name(file_base_name) as track:
+                return track.to_sparse_values()
         indices = np.load(file_base_name + "_indexes.npy")
         values = np.load(file_base_name + "_values.npy")
         size = indices[-1]
@@ -28,7 +84,12 @@ class SparseValues:
         obj.track_size = size
         return obj
 
-    def to_sparse_files(self, file_base_name):
+    def to_sparse_files(self, file_base_name, chunked=False):
+        """Write to <file_base_name>_indexes/values.npy, or to a chunked
+        track (see trackstore) if chunked"""
+        if chunked:
+            from .trackstore import write_chunked_track
+            return write_chunked_track(file_base_name, self)
         np.save(file_base_name + "_indexes.npy",
                 np.r_[self.indices, self.track_size])
         np.save(file_base_name + "_values.npy", self.values)
@@ -55,6 +116,20 @@ class SparseValues:
     def to_bed_file(self, filename):
         logging.warning("Not writing to %s", filename)
 
+    def compact(self, lossless=False):
+        """Copy with int32 indices (if they fit) and float32 values.
+        Runs that become equal after rounding are merged. With
+        lossless, values are only made float32 if none of them change"""
+        values = self.values
+        if values.dtype.kind == "f":
+            compact_values = values.astype(np.float32, copy=False)
+            if not lossless or np.array_equal(compact_values, values):
+                values = compact_values
+        new = SparseValues(get_compact_indices(self.indices, self.track_size),
+                           values, sanitize=True)
+        new.track_size = self.track_size
+        return new
+
     def threshold_copy(self, cutoff):
         values = self.values >= cutoff
         new = SparseValues(self.indices, values, sanitize=True)
@@ -64,6 +139,9 @@ class SparseValues:
     def to_dense_pileup(self, size):
         if self.values.dtype == np.bool:
             values = self.values.astype("int")
+        elif self.values.dtype == np.float32:
+            # Accumulate in float64 to get the exact values back
+            values = self.values.astype("float")
         else:
             values = self.values
         diffs = np.ediff1d(values, to_begin=values[0])
@@ -71,8 +149,8 @@ class SparseValues:
         indices = self.indices[:diffs.size]
         pileup[indices] = diffs
         pileup = np.cumsum(pileup[:-1])
-        if self.values.dtype == np.bool:
-            pileup = pileup.astype("bool")
+        if self.values.dtype != values.dtype:
+            pileup = pileup.astype(self.values.dtype)
         return pileup
 
     @classmethod
@@ -86,9 +164,12 @@ class SparseValues:
 
 
 class SparseDiffs:
-    def __init__(self, indices, diffs, sanitize=False):
+    def __init__(self, indices, diffs, sanitize=False, is_sorted=False):
         self._indices = np.asanyarray(indices)
         self._diffs = np.asanyarray(diffs)
+        # Set if indices are known to be sorted, so that sorting
+        # can be skipped
+        self._sorted = is_sorted
         if sanitize:
             self._sanitize()
 
@@ -99,7 +180,12 @@ class SparseDiffs:
         # pileup[self._indices] = self._diffs
         # return np.cumsum(pileup[:-1])
 
-    def to_sparse_files(self, file_base_name):
+    def to_sparse_files(self, file_base_name, chunked=False):
+        if chunked:
+            from .trackstore import write_chunked_track
+            sparse_values = self.get_sparse_values()
+            sparse_values.track_size = getattr(self, "track_size", None)
+            return write_chunked_track(file_base_name, sparse_values)
         np.save(file_base_name + "_indexes.npy",
                 self._indices)
         np.save(file_base_name + "_values.npy", self._diffs)
@@ -108,6 +194,8 @@ class SparseDiffs:
 
     @classmethod
     def from_sparse_files(cls, file_base_name):
+        if is_chunked_track(file_base_name):
+            return SparseValues.from_sparse_files(file_base_name)
         indices = np.load(file_base_name + "_indexes.npy")
         values = np.load(file_base_name + "_values.npy")
         size = indices[-1] + 10  # hack
@@ -121,11 +209,21 @@ class SparseDiffs:
     def __repr__(self):
         return "SD(%s, %s)" % (self._indices, self._diffs)
 
+    def compact(self, lossless=False):
+        """Copy with int32 indices if they fit. Diffs are kept in
+        float64, since errors would accumulate in the cumulative sum"""
+        new = SparseDiffs(get_compact_indices(self._indices), self._diffs,
+                          is_sorted=self._sorted)
+        if hasattr(self, "track_size"):
+            new.track_size = self.track_size
+        return new
+
     def clean(self):
         sparse_values = self.get_sparse_values()
         self._indices = sparse_values.indices
         self._diffs = np.ediff1d(sparse_values.values,
                                  to_begin=sparse_values.values[0])
+        self._sorted = True
 
     def clip_min(self, min_value):
         values = np.cumsum(self._diffs)
@@ -135,14 +233,23 @@ class SparseDiffs:
         self._sanitize()
 
     def get_sparse_values(self):
+        if self._sorted:
+            return SparseValues(self._indices, np.cumsum(self._diffs),
+                                sanitize=True)
         args = np.argsort(self._indices, kind="mergesort")
         diffs = self._diffs[args]
         values = np.cumsum(diffs)
         return SparseValues(self._indices[args], values, sanitize=True)
 
+    def _get_merge_args(self, other):
+        if self._sorted and other._sorted:
+            return get_merge_args(self._indices, other._indices)
+        return np.argsort(np.r_[self._indices, other._indices],
+                          kind="mergesort")
+
     def maximum(self, other):
         all_indices = np.r_[self._indices, other._indices]
-        sorted_args = np.argsort(all_indices, kind="mergesort")
+        sorted_args = self._get_merge_args(other)
         new_indexes = all_indices[sorted_args]
         unique_mask = np.ediff1d(new_indexes, to_end=1) != 0
         new_indexes = new_indexes[unique_mask]
@@ -156,7 +263,7 @@ class SparseDiffs:
         max_values = max_values[unique_mask]
         new_diffs = np.ediff1d(
             max_values, to_begin=max_values[0])
-        return SparseDiffs(new_indexes, new_diffs, True)
+        return SparseDiffs(new_indexes, new_diffs, True, is_sorted=True)
 
     def _sanitize(self):
         # Remove duplicated values
@@ -170,24 +277,55 @@ class SparseDiffs:
 
     @classmethod
     def from_starts_and_ends(cls, starts_ends):
-        indices = starts_ends.ravel(order="C")
-        args = np.argsort(indices)
-        indices = indices[args]
+        """Diffs from a 2xN array of starts and ends. The rows are
+        sorted separately and merged (sorting is skipped for rows that
+        are already sorted, e.g. extended sorted read positions)"""
+        starts, ends = starts_ends
+        if not is_sorted_array(starts):
+            starts = np.sort(starts)
+        if not is_sorted_array(ends):
+            ends = np.sort(ends)
+        start_positions, end_positions = get_merge_positions(starts, ends)
+        indices = np.empty(starts.size+ends.size, dtype=starts_ends.dtype)
+        indices[start_positions] = starts
+        indices[end_positions] = ends
         diffs = np.ones(indices.size)
-        diffs[args >= starts_ends.shape[1]] *= -1
-        return cls(indices, diffs)
+        diffs[end_positions] = -1
+        return cls(indices, diffs, is_sorted=True)
 
     @classmethod
-    def from_pileup(cls, pileup, node_indexes):
-        indices = np.r_[pileup.starts, pileup.ends, node_indexes]
+    def from_positions(cls, positions, weights, size):
+        """Sorted diffs with the sum of the weights at each of the
+        integer positions in [0, size]. Uses a histogram (counting sort)
+        if the positions are dense compared to size, else a sort"""
+        positions = np.asanyarray(positions, dtype="int64")
+        weights = np.asanyarray(weights, dtype="float")
+        # The start of the track is kept even if its diff is zero
+        if positions.size*DENSE_HISTOGRAM_RATIO >= size:
+            histogram = np.bincount(positions, weights, minlength=size+1)
+            nonzero = histogram != 0
+            nonzero[0] = True
+            indices = np.flatnonzero(nonzero)
+            return cls(indices, histogram[indices], is_sorted=True)
+        args = np.argsort(positions)
+        positions = positions[args]
+        firsts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+        indices = positions[firsts]
+        diffs = np.add.reduceat(weights[args], firsts) \
+            if firsts.size else weights
+        keep = (diffs != 0) | (indices == 0)
+        return cls(indices[keep], diffs[keep], is_sorted=True)
 
-        diffs = np.r_[np.ones(len(pileup.starts)),
-                      -1*np.ones(len(pileup.ends)),
-                      pileup.node_starts]
-        args = np.argsort(indices)
-        indices = indices[args]
-        diffs = diffs[args]
-        return cls(indices, diffs)
+    @classmethod
+    def from_pileup(cls, pileup, node_indexes):
+        node_indexes = np.asanyarray(node_indexes, dtype="int64")
+        positions = np.r_[np.asanyarray(pileup.starts, dtype="int64"),
+                          np.asanyarray(pileup.ends, dtype="int64"),
+                          node_indexes]
+        weights = np.r_[np.ones(len(pileup.starts)),
+                        -1*np.ones(len(pileup.ends)),
+                        pileup.node_starts[:node_indexes.size]]
+        return cls.from_positions(positions, weights, node_indexes[-1])
 
     @classmethod
     def from_dense_pileup(cls, pileup):
@@ -207,7 +345,7 @@ class SparseDiffs:
 
     def apply_binary_func(self, func, other, return_values=False):
         all_indices = np.r_[self._indices, other._indices]
-        sorted_args = np.argsort(all_indices, kind="mergesort")
+        sorted_args = self._get_merge_args(other)
         new_indexes = all_indices[sorted_args]
         unique_mask = np.ediff1d(new_indexes, to_end=1) != 0
         new_indexes = new_indexes[unique_mask]
@@ -221,4 +359,4 @@ class SparseDiffs:
         if return_values:
             return SparseValues(new_indexes, ret, sanitize=True)
         return SparseDiffs(
-            new_indexes, np.ediff1d(ret, to_begin=ret[0]))
+            new_indexes, np.ediff1d(ret, to_begin=ret[0]), is_sorted=True)
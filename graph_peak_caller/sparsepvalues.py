@@ -77,13 +77,26 @@ class PToQValuesMapper:
     def from_files(cls, base_file_name):
         search = base_file_name
         logging.info("Searching for files starting with %s" % search)
-        files = glob(base_file_name + "*pvalues_indexes.npy")
+        files = glob(base_file_name + "*pvalues_indexes.npy") + \
+            glob(base_file_name + "*pvalues_track.npz")
+        return cls.from_p_values_files(sorted(set(
+            filename.rsplit("_", 1)[0] for filename in files)))
+
+    @classmethod
+    def from_p_values_files(cls, base_file_names):
+        def read_tracks():
+            for base_file_name in base_file_names:
+                logging.info("Reading p values from file %s" % base_file_name)
+                yield SparseValues.from_sparse_files(base_file_name)
+
+        return cls.from_p_values_tracks(read_tracks())
+
+    @classmethod
+    def from_p_values_tracks(cls, tracks):
+        """Mapping for the p values in all tracks (SparseValues)"""
         sub_counts = []
         p_values = []
-        for filename in files:
-            base_file_name = filename.replace("_indexes.npy", "")
-            logging.info("Reading p values from file %s" % base_file_name)
-            chr_p_values = SparseValues.from_sparse_files(base_file_name)
+        for chr_p_values in tracks:
             sub_counts.append(cls.__get_sub_counts(chr_p_values))
             p_values.append(chr_p_values.values)
             assert sub_counts[-1].size == p_values[-1].size
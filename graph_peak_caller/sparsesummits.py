@@ -0,0 +1,128 @@
+import logging
+import numpy as np
+
+
+class PeakSegments:
+    """The node segments of a set of peaks as flat arrays, in the
+    order of the forward directed peak (reverse peaks are reversed
+    like in DensePileup.get_interval_values)."""
+
+    def __init__(self, peaks, graph):
+        rps = peaks.region_paths
+        indptr = peaks.region_path_indptr
+        n_rps = np.diff(indptr)
+        self.peak_ids = np.repeat(np.arange(len(peaks)), n_rps)
+        first = indptr[:-1]
+        last = indptr[1:]-1
+        is_reverse = rps[first] < 0
+        node_indexes = graph.node_indexes.astype("int64")
+        node_sizes = np.diff(node_indexes)
+        first_sizes = node_sizes[np.abs(rps[first])-graph.min_node]
+        last_sizes = node_sizes[np.abs(rps[last])-graph.min_node]
+        start_offsets = np.where(is_reverse, last_sizes-peaks.ends,
+                                 peaks.starts)
+        end_offsets = np.where(is_reverse, first_sizes-peaks.starts,
+                               peaks.ends)
+        local = np.arange(rps.size)-np.repeat(first, n_rps)
+        order = np.where(np.repeat(is_reverse, n_rps),
+                         np.repeat(last, n_rps)-local, local+np.repeat(first, n_rps))
+        nodes = np.abs(rps[order])
+        node_starts = node_indexes[nodes-graph.min_node]
+        self.starts = node_starts.copy()
+        self.ends = node_starts + node_sizes[nodes-graph.min_node]
+        self.starts[first] += start_offsets
+        self.ends[last] = node_starts[last] + end_offsets
+        lengths = self.ends-self.starts
+        self.peak_offsets = np.cumsum(lengths)-lengths
+        self.peak_offsets -= np.repeat(self.peak_offsets[first], n_rps)
+        self.peak_lengths = np.bincount(self.peak_ids, lengths,
+                                        minlength=len(peaks)).astype("int")
+
+
+def get_summit_positions(peaks, qvalues, graph):
+    """Offset in each peak of the median position with max q-value.
+
+    Only the runs of the sparse qvalues (SparseValues) overlapping
+    the peaks are looked at, the track is never made dense"""
+    segments = PeakSegments(peaks, graph)
+    first_runs = np.maximum(np.searchsorted(
+        qvalues.indices, segments.starts, side="right")-1, 0)
+    last_runs = np.maximum(np.searchsorted(
+        qvalues.indices, segments.ends-1, side="right")-1, 0)
+    n_runs = np.where(segments.ends > segments.starts,
+                      last_runs-first_runs+1, 0)
+    segment_ids = np.repeat(np.arange(n_runs.size), n_runs)
+    runs = np.arange(segment_ids.size) - np.repeat(
+        np.cumsum(n_runs)-n_runs, n_runs) + first_runs[segment_ids]
+    run_bounds = np.append(qvalues.indices, np.inf)
+    piece_starts = np.maximum(run_bounds[runs],
+                              segments.starts[segment_ids]).astype("int")
+    piece_ends = np.minimum(run_bounds[runs+1],
+                            segments.ends[segment_ids]).astype("int")
+    piece_values = qvalues.values[runs]
+    piece_peaks = segments.peak_ids[segment_ids]
+
+    peak_first_pieces = np.flatnonzero(
+        np.r_[True, piece_peaks[1:] != piece_peaks[:-1]])
+    max_values = np.maximum.reduceat(piece_values, peak_first_pieces)
+    is_max = piece_values == max_values[piece_peaks]
+    max_lengths = np.where(is_max, piece_ends-piece_starts, 0)
+    n_max_positions = np.bincount(piece_peaks, max_lengths,
+                                  minlength=len(peaks)).astype("int")
+    median_ranks = n_max_positions // 2
+    cum_max = np.cumsum(max_lengths)
+    cum_before = cum_max - max_lengths - np.repeat(
+        (cum_max-max_lengths)[peak_first_pieces],
+        np.diff(np.append(peak_first_pieces, piece_peaks.size)))
+    rank_in_piece = median_ranks[piece_peaks]-cum_before
+    summit_pieces = np.flatnonzero(
+        is_max & (rank_in_piece >= 0) & (rank_in_piece < max_lengths))
+    summit_peaks = piece_peaks[summit_pieces]
+    piece_local_starts = segments.peak_offsets[segment_ids] + \
+        piece_starts - segments.starts[segment_ids]
+    positions = np.zeros(len(peaks), dtype="int")
+    positions[summit_peaks] = piece_local_starts[summit_pieces] + \
+        rank_in_piece[summit_pieces]
+    return positions, segments.peak_lengths
+
+
+def get_subpeaks(peaks, graph, start_offsets, end_offsets):
+    """Vectorized Interval.get_subinterval for all peaks"""
+    from .peakarrays import PeakArrays
+    rps = peaks.region_paths
+    indptr = peaks.region_path_indptr
+    n_rps = np.diff(indptr)
+    peak_ids = np.repeat(np.arange(len(peaks)), n_rps)
+    is_first = np.zeros(rps.size, dtype="bool")
+    is_first[indptr[:-1]] = True
+    lengths = np.diff(graph.node_indexes.astype("int64"))[
+        np.abs(rps)-graph.min_node]
+    lengths = lengths - np.where(is_first, peaks.starts[peak_ids], 0)
+    cum_ends = np.cumsum(lengths)
+    cum_ends -= np.repeat(cum_ends[indptr[:-1]]-lengths[indptr[:-1]], n_rps)
+    cum_starts = cum_ends-lengths
+    keep = (cum_starts < end_offsets[peak_ids]) & \
+        (cum_ends > start_offsets[peak_ids])
+    new_n_rps = np.bincount(peak_ids[keep], minlength=len(peaks))
+    new_indptr = np.insert(np.cumsum(new_n_rps), 0, 0)
+    kept = np.flatnonzero(keep)
+    first_kept = kept[new_indptr[:-1]]
+    last_kept = kept[new_indptr[1:]-1]
+    extra = np.where(is_first, peaks.starts[peak_ids], 0)
+    new_starts = start_offsets-cum_starts[first_kept]+extra[first_kept]
+    new_ends = end_offsets-cum_starts[last_kept]+extra[last_kept]
+    return PeakArrays(new_starts, new_ends, rps[kept], new_indptr,
+                      peaks.scores, peaks.directions, peaks.is_diff,
+                      peaks.is_ambigous, peaks.unique_ids,
+                      peaks.chromosome_codes, peaks.chromosome_names)
+
+
+def cut_around_summits(peaks, qvalues, graph, n_base_pairs_around=60):
+    """Sparse and vectorized version of PeakCollection.cut_around_summit
+    working on PeakArrays"""
+    logging.info("Finding summits for %d peaks", len(peaks))
+    summits, lengths = get_summit_positions(peaks, qvalues, graph)
+    return get_subpeaks(
+        peaks, graph,
+        np.maximum(0, summits-n_base_pairs_around),
+        np.minimum(summits+n_base_pairs_around, lengths))
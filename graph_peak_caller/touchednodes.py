@@ -0,0 +1,93 @@
+import logging
+import os
+import numpy as np
+
+
+class TouchedNodes:
+    """Set of node ids stored as a boolean mask indexed by
+    node_id-min_node. Supports the membership tests of a set
+    (node_id in touched) as well as vectorized lookups (contains)"""
+
+    def __init__(self, mask, min_node):
+        self._mask = np.asanyarray(mask, dtype="bool")
+        self._min_node = int(min_node)
+
+    @classmethod
+    def from_node_ids(cls, node_ids, min_node=None, n_nodes=None):
+        node_ids = np.asanyarray(list(node_ids), dtype="int64")
+        if min_node is None:
+            min_node = node_ids.min() if node_ids.size else 0
+        idxs = node_ids-min_node
+        if n_nodes is None:
+            n_nodes = idxs.max()+1 if idxs.size else 0
+        mask = np.zeros(n_nodes, dtype="bool")
+        mask[idxs] = True
+        return cls(mask, min_node)
+
+    @classmethod
+    def from_graph(cls, node_ids, graph):
+        n_nodes = graph.node_indexes.size-1 \
+            if hasattr(graph, "node_indexes") else None
+        return cls.from_node_ids(node_ids, graph.min_node, n_nodes)
+
+    def contains(self, node_ids):
+        """Boolean array telling which of node_ids are touched"""
+        idxs = np.asanyarray(node_ids, dtype="int64")-self._min_node
+        is_valid = (idxs >= 0) & (idxs < self._mask.size)
+        result = np.zeros(idxs.shape, dtype="bool")
+        result[is_valid] = self._mask[idxs[is_valid]]
+        return result
+
+    def get_node_ids(self):
+        return np.flatnonzero(self._mask)+self._min_node
+
+    def __contains__(self, node_id):
+        idx = int(node_id)-self._min_node
+        return 0 <= idx < self._mask.size and bool(self._mask[idx])
+
+    def __len__(self):
+        return int(np.count_nonzero(self._mask))
+
+    def __iter__(self):
+        return iter(self.get_node_ids().tolist())
+
+    def __eq__(self, other):
+        if not isinstance(other, TouchedNodes):
+            other = TouchedNodes.from_node_ids(other)
+        return np.array_equal(self.get_node_ids(), other.get_node_ids())
+
+    def __repr__(self):
+        return "TouchedNodes(%d of %d nodes)" % (len(self), self._mask.size)
+
+    def to_file(self, file_name):
+        with open(file_name, "wb") as f:
+            np.savez(f, bits=np.packbits(self._mask),
+                     size=self._mask.size, min_node=self._min_node)
+        return file_name
+
+    @classmethod
+    def from_file(cls, file_name):
+        with np.load(file_name) as data:
+            size = int(data["size"])
+            mask = np.unpackbits(data["bits"], count=size).astype("bool")
+            return cls(mask, int(data["min_node"]))
+
+
+def as_touched_nodes(touched_nodes, graph):
+    """Convert any collection of node ids to TouchedNodes. None and
+    objects already supporting vectorized lookups are kept as is"""
+    if touched_nodes is None or hasattr(touched_nodes, "contains"):
+        return touched_nodes
+    return TouchedNodes.from_graph(touched_nodes, graph)
+
+
+def read_touched_nodes(base_name):
+    """Read touched nodes written by Reporter, falling back to the
+    old list of node ids in touched_nodes.npy"""
+    file_name = base_name + "touched_nodes.npz"
+    if os.path.isfile(file_name):
+        return TouchedNodes.from_file(file_name)
+    logging.info("No %s found. Reading node ids from %s",
+                 file_name, base_name + "touched_nodes.npy")
+    return TouchedNodes.from_node_ids(
+        np.load(base_name + "touched_nodes.npy"))
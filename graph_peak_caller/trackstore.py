@@ -0,0 +1,235 @@
+"""Chunked, compressed storage of sparse tracks.
+
+The graph coordinate space of a track is split in chunks of
+chunk_size positions. For each chunk, the indices (delta encoded from
+the chunk start) and values of the runs starting in the chunk are
+stored as compressed members of one npz file, together with the value
+in force at each chunk start. Since npz members are read lazily, a
+range of the track can be read by decompressing only the chunks
+overlapping it.
+"""
+import logging
+import zipfile
+import numpy as np
+
+from .sparsediffs import SparseValues
+
+CHUNK_SIZE = 2**20
+TRACK_SUFFIX = "_track.npz"
+
+
+def get_track_file_name(file_base_name):
+    return file_base_name + TRACK_SUFFIX
+
+
+def write_chunked_track(file_base_name, sparse_values, chunk_size=CHUNK_SIZE):
+    index_dtype = np.asanyarray(sparse_values.indices).dtype
+    indices = np.asanyarray(sparse_values.indices, dtype="int64")
+    values = sparse_values.values
+    track_size = sparse_values.track_size
+    if track_size is None:
+        track_size = int(indices[-1])+1 if indices.size else 0
+    n_chunks = max(-(-int(track_size)//chunk_size), 1)
+    chunk_starts = np.arange(n_chunks+1, dtype="int64")*chunk_size
+    chunk_offsets = np.searchsorted(indices, chunk_starts)
+    first_runs = np.searchsorted(indices, chunk_starts[:-1], side="right")-1
+    first_values = np.zeros(n_chunks, dtype=values.dtype)
+    has_value = first_runs >= 0
+    first_values[has_value] = values[first_runs[has_value]]
+    members = {"track_size": track_size, "chunk_size": chunk_size,
+               "chunk_offsets": chunk_offsets, "first_values": first_values,
+               "index_dtype": str(index_dtype)}
+    delta_dtype = np.uint32 if chunk_size <= 2**32 else np.uint64
+    for i in range(n_chunks):
+        chunk_indices = indices[chunk_offsets[i]:chunk_offsets[i+1]]
+        members["indices%d" % i] = np.diff(
+            chunk_indices, prepend=chunk_starts[i]).astype(delta_dtype)
+        members["values%d" % i] = values[chunk_offsets[i]:chunk_offsets[i+1]]
+    file_name = get_track_file_name(file_base_name)
+    with open(file_name, "wb") as f:
+        np.savez_compressed(f, **members)
+    logging.info("Wrote to %s" % file_name)
+    return file_name
+
+
+class ChunkedTrackWriter:
+    """Writes a chunked track, as write_chunked_track, from parts added
+    in order. Only the parts overlapping chunks that are not yet written
+    are kept in memory"""
+
+    def __init__(self, file_base_name, track_size, index_dtype="int64",
+                 chunk_size=CHUNK_SIZE):
+        self.track_size = int(track_size)
+        self.chunk_size = chunk_size
+        self._index_dtype = np.dtype(index_dtype)
+        self._delta_dtype = np.uint32 if chunk_size <= 2**32 else np.uint64
+        self._n_chunks = max(-(-self.track_size//chunk_size), 1)
+        self.file_name = get_track_file_name(file_base_name)
+        self._zip = zipfile.ZipFile(self.file_name, "w",
+                                    compression=zipfile.ZIP_DEFLATED,
+                                    allowZip64=True)
+        self._indices = []
+        self._values = []
+        self._chunk_offsets = []
+        self._first_values = []
+        self._last_value = None
+        self._n_runs = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_member(self, name, array):
+        with self._zip.open(name + ".npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(array),
+                                      allow_pickle=False)
+
+    def _write_chunks(self, n_chunks):
+        indices = np.concatenate(self._indices)
+        values = np.concatenate(self._values)
+        if self._last_value is None:
+            self._last_value = np.zeros(1, dtype=values.dtype)[0]
+        for i in range(len(self._first_values), n_chunks):
+            chunk_start = i*self.chunk_size
+            start, end = np.searchsorted(
+                indices, [chunk_start, chunk_start+self.chunk_size])
+            first_run = np.searchsorted(indices, chunk_start, side="right")-1
+            self._first_values.append(
+                values[first_run] if first_run >= 0 else self._last_value)
+            self._chunk_offsets.append(self._n_runs+start)
+            self._write_member("indices%d" % i, np.diff(
+                indices[start:end], prepend=chunk_start).astype(
+                    self._delta_dtype))
+            self._write_member("values%d" % i, values[start:end])
+        written = np.searchsorted(indices, n_chunks*self.chunk_size)
+        if written > 0:
+            self._last_value = values[written-1]
+        self._n_runs += written
+        self._indices = [indices[written:]]
+        self._values = [values[written:]]
+
+    def add(self, sparse_values, offset):
+        """Add the part of the track starting at offset. Parts must
+        follow each other"""
+        self._indices.append(
+            np.asanyarray(sparse_values.indices, dtype="int64")+offset)
+        self._values.append(sparse_values.values)
+        self._write_chunks(min((offset+int(sparse_values.track_size)) //
+                               self.chunk_size, self._n_chunks))
+
+    def close(self):
+        if self._zip is None:
+            return
+        self._write_chunks(self._n_chunks)
+        self._chunk_offsets.append(self._n_runs)
+        values_dtype = self._values[0].dtype
+        members = {"track_size": self.track_size,
+                   "chunk_size": self.chunk_size,
+                   "chunk_offsets": np.array(self._chunk_offsets),
+                   "first_values": np.array(self._first_values,
+                                            dtype=values_dtype),
+                   "index_dtype": str(self._index_dtype)}
+        for name, value in members.items():
+            self._write_member(name, value)
+        self._zip.close()
+        self._zip = None
+        logging.info("Wrote to %s" % self.file_name)
+
+
+class ChunkedTrack:
+    """Reader for tracks written by write_chunked_track. Chunks are
+    decompressed when needed, and the last few are kept in memory"""
+
+    def __init__(self, file_name, n_cached_chunks=4):
+        self._data = np.load(file_name)
+        self.track_size = int(self._data["track_size"])
+        self.chunk_size = int(self._data["chunk_size"])
+        self._chunk_offsets = self._data["chunk_offsets"]
+        self._first_values = self._data["first_values"]
+        self._index_dtype = str(self._data["index_dtype"])
+        self._n_cached_chunks = n_cached_chunks
+        self._cache = {}
+
+    @classmethod
+    def from_base_name(cls, file_base_name):
+        return cls(get_track_file_name(file_base_name))
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def n_chunks(self):
+        return self._first_values.size
+
+    def _get_chunk(self, i):
+        if i not in self._cache:
+            if len(self._cache) >= self._n_cached_chunks:
+                del self._cache[next(iter(self._cache))]
+            indices = np.cumsum(self._data["indices%d" % i], dtype="int64") + \
+                i*self.chunk_size
+            self._cache[i] = (indices, self._data["values%d" % i])
+        return self._cache[i]
+
+    def get_sparse_values(self, start=0, end=None):
+        """SparseValues for positions start to end, with indices
+        relative to start"""
+        end = self.track_size if end is None else end
+        if end <= start:
+            sparse_values = SparseValues(np.zeros(0, dtype="int64"),
+                                         self._first_values[:0])
+            sparse_values.track_size = 0
+            return sparse_values
+        first_chunk = start // self.chunk_size
+        last_chunk = max((end-1) // self.chunk_size, first_chunk)
+        chunks = [self._get_chunk(i) for i in range(first_chunk, last_chunk+1)]
+        indices = np.concatenate(
+            [[first_chunk*self.chunk_size]] + [c[0] for c in chunks])
+        values = np.concatenate(
+            [self._first_values[first_chunk:first_chunk+1]] +
+            [c[1] for c in chunks])
+        first = np.searchsorted(indices, start, side="right")-1
+        last = np.searchsorted(indices, end, side="left")
+        indices = indices[first:last]-start
+        indices[0] = 0
+        sparse_values = SparseValues(indices.astype(self._index_dtype),
+                                     values[first:last], sanitize=True)
+        sparse_values.track_size = end-start
+        return sparse_values
+
+    def to_sparse_values(self):
+        chunks = [self._get_chunk(i) for i in range(self.n_chunks)]
+        sparse_values = SparseValues(
+            np.concatenate([c[0] for c in chunks]).astype(self._index_dtype),
+            np.concatenate([self._first_values[:0]] + [c[1] for c in chunks]))
+        sparse_values.track_size = self.track_size
+        return sparse_values
+
+    def get_dense(self, start, end):
+        if end <= start:
+            return np.zeros(0, dtype=self._first_values.dtype)
+        return self.get_sparse_values(start, end).to_dense_pileup(end-start)
+
+    def get_node_range_values(self, graph, first_node, last_node):
+        """Values of the nodes first_node to last_node (inclusive)"""
+        node_indexes = graph.node_indexes
+        return self.get_dense(int(node_indexes[first_node-graph.min_node]),
+                              int(node_indexes[last_node+1-graph.min_node]))
+
+    def get_peak_values(self, peaks, graph):
+        """Values along each peak in peaks (PeakArrays), in the order of
+        the forward directed peak, as in DensePileup.get_interval_values"""
+        from .sparsesummits import PeakSegments
+        segments = PeakSegments(peaks, graph)
+        pieces = [self.get_dense(int(start), int(end))
+                  for start, end in zip(segments.starts, segments.ends)]
+        bounds = np.searchsorted(segments.peak_ids, np.arange(len(peaks)+1))
+        return [np.concatenate(pieces[bounds[i]:bounds[i+1]])
+                for i in range(len(peaks))]
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, \
+    DirectedInterval, Block
+
+from graph_peak_caller import Configuration, CallPeaks
+from graph_peak_caller.api import call_peaks, AlignmentArrays
+from graph_peak_caller.control.linearmap import LinearMap
+from graph_peak_caller.intervals import UniqueIntervals
+from graph_peak_caller.peakarrays import PeakArrays
+from graph_peak_caller.reporter import Reporter
+
+
+class TestCallPeaks(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph({i: Block(10) for i in range(1, 4)},
+                           {1: [2], 2: [3]})
+        self.linear_map = LinearMap.from_graph(self.graph)
+        self.graph.convert_to_numpy_backend()
+        self.peak = DirectedInterval(7, 2, [1, 2], self.graph)
+        reads = []
+        for i in range(10):
+            reads.append(self.peak.get_subinterval(0, 2))
+            reads.append(self.peak.get_subinterval(3, 5).get_reverse())
+        self.reads = AlignmentArrays.from_intervals(reads)
+        self.control_reads = AlignmentArrays.from_intervals(
+            [DirectedInterval(2, 4, [3], self.graph)])
+        self.config = Configuration()
+        self.config.fragment_length = 5
+        self.config.read_length = 2
+        self.config.min_background = 0.33
+        self.dir_name = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.dir_name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir_name)
+
+    def test_call_peaks(self):
+        results = {}
+        peaks = call_peaks(self.graph, self.reads, self.control_reads,
+                           self.config, self.linear_map,
+                           callback=lambda name, data: results.update(
+                               {name: data}),
+                           chromosome="chr1")
+        self.assertIsInstance(peaks, PeakArrays)
+        self.assertIn(self.peak, list(peaks))
+        self.assertEqual(set(peaks.get_chromosomes()), {"chr1"})
+        self.assertTrue(np.all(np.diff(peaks.scores) <= 0))
+        for name in ("fragment_pileup", "pvalues", "qvalues", "max_paths"):
+            self.assertIn(name, results)
+        self.assertEqual(os.listdir(self.dir_name), [])
+
+    def test_equals_call_peaks_with_files(self):
+        config = self.config.copy()
+        config.linear_map_name = self.linear_map
+        config.has_control = True
+        caller = CallPeaks(self.graph, config, Reporter("test_"))
+        caller.run(UniqueIntervals(list(self.reads.to_intervals(self.graph))),
+                   UniqueIntervals(list(
+                       self.control_reads.to_intervals(self.graph))))
+        peaks = call_peaks(self.graph, self.reads, self.control_reads,
+                           self.config, self.linear_map, chromosome="test")
+        self.assertEqual(peaks, PeakArrays.from_peaks(caller.max_path_peaks))
+
+    def test_call_peaks_without_control(self):
+        peaks = call_peaks(self.graph, self.reads, config=self.config,
+                           linear_map=self.linear_map)
+        self.assertIsInstance(peaks, PeakArrays)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, Block
+
+from graph_peak_caller import Configuration
+from graph_peak_caller.control import SharedBackground
+from graph_peak_caller.control.backgroundcache import BackgroundCache
+from graph_peak_caller.control.linearmap import LinearMap
+from graph_peak_caller.sparsediffs import SparseDiffs
+
+
+class TestBackgroundCache(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir_name, "cache")
+        self.control_file = os.path.join(
+            self.dir_name, "control.intervalcollection")
+        self.graph = Graph({i: Block(10) for i in range(1, 4)},
+                           {1: [2], 2: [3]})
+        self.graph.convert_to_numpy_backend()
+        self.linear_map = LinearMap.from_graph(self.graph)
+        self.config = Configuration()
+        self.config.fragment_length = 5
+        self.config.read_length = 2
+        with open(self.control_file, "w") as f:
+            f.write("control\n")
+        self.background = SharedBackground(
+            SparseDiffs(np.array([0, 10, 15, 20]),
+                        np.array([1., 2., -1., -1.])),
+            20, 1., self.graph)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def _get_key(self, extensions=[10000]):
+        return BackgroundCache.get_key(
+            self.control_file, self.graph, self.linear_map, extensions,
+            self.config)
+
+    def test_key_depends_on_settings(self):
+        key = self._get_key()
+        self.assertEqual(key, self._get_key())
+        self.assertNotEqual(key, self._get_key([5, 1000, 10000]))
+        self.config.global_min = 0.5
+        self.assertNotEqual(key, self._get_key())
+
+    def test_put_and_get(self):
+        cache = BackgroundCache(self.cache_dir)
+        self.assertIsNone(cache.get("key", self.graph))
+        cache.put("key", self.background)
+        background = cache.get("key", self.graph)
+        self.assertEqual(background.n_reads, 20)
+        self.assertEqual(background.get_track({2}),
+                         self.background.get_track({2}))
+
+    def test_get_or_create_creates_once(self):
+        cache = BackgroundCache(self.cache_dir)
+        calls = []
+
+        def create():
+            calls.append(1)
+            return self.background
+
+        cache.get_or_create("key", create, self.graph)
+        background = cache.get_or_create("key", create, self.graph)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(background.get_track(),
+                         self.background.get_track())
+
+    def test_evicts_least_recently_used(self):
+        cache = BackgroundCache(self.cache_dir)
+        cache.put("a", self.background)
+        cache.put("b", self.background)
+        entry_size = os.path.getsize(os.path.join(self.cache_dir, "a.npz"))
+        past = time.time()-100
+        os.utime(os.path.join(self.cache_dir, "b.npz"), (past, past))
+        cache.get("b", self.graph)
+        cache = BackgroundCache(self.cache_dir, max_size=2*entry_size)
+        cache.put("c", self.background)
+        self.assertIsNone(cache.get("a", self.graph))
+        self.assertIsNotNone(cache.get("b", self.graph))
+        self.assertIsNotNone(cache.get("c", self.graph))
+
+
+if __name__ == "__main__":
+    unittest.main()
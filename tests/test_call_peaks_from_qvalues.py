@@ -263,6 +263,61 @@ class TestCallPeaksFromQValues(unittest.TestCase):
             self.multi_start_end_graph, pileup
         )
 
+    def test_multiple_cutoffs_equals_separate_runs(self):
+        pileup = SparsePileup(self.linear_graph)
+        pileup.data = {
+            1: ValuedIndexes([1], [1.5], 0, 10),
+            2: ValuedIndexes([3], [3], 1.5, 10),
+            3: ValuedIndexes([5], [0], 3, 10)
+        }
+        config = Configuration()
+        config.fragment_length = self.fragment_length
+        config.read_length = self.read_length
+        cutoffs = [0.1, 0.01, 0.0001]
+        separate = []
+        for cutoff in cutoffs:
+            config.q_values_threshold = cutoff
+            caller = CallPeaksFromQvalues(
+                self.linear_graph, convert_old_sparse(pileup), config,
+                Reporter("test_"), config=config, q_values_max_path=True)
+            caller.callpeaks()
+            separate.append(caller.max_paths)
+        self.assertEqual(separate[0], [Interval(1, 5, [1, 2, 3])])
+        self.assertEqual(separate[1], [Interval(3, 5, [2, 3])])
+        self.assertEqual(separate[2], [])
+
+        caller = CallPeaksFromQvalues(
+            self.linear_graph, convert_old_sparse(pileup), config,
+            Reporter("test_"), config=config, q_values_max_path=True,
+            cutoffs=cutoffs)
+        caller.callpeaks()
+        for cutoff, max_paths in zip(cutoffs, separate):
+            self.assertEqual(caller.max_paths_by_cutoff[cutoff], max_paths)
+            self.assertEqual(
+                [p.score for p in caller.max_paths_by_cutoff[cutoff]],
+                [p.score for p in max_paths])
+        self.assertEqual(caller.max_paths, separate[0])
+
+    def test_multiple_cutoffs_with_same_areas(self):
+        pileup = SparsePileup(self.linear_graph)
+        pileup.data = {
+            1: ValuedIndexes([1], [1.5], 0, 10),
+            2: ValuedIndexes([3], [3], 1.5, 10),
+            3: ValuedIndexes([5], [0], 3, 10)
+        }
+        config = Configuration()
+        config.fragment_length = self.fragment_length
+        config.read_length = self.read_length
+        caller = CallPeaksFromQvalues(
+            self.linear_graph, convert_old_sparse(pileup), config,
+            Reporter("test_"), config=config, q_values_max_path=True,
+            cutoffs=[0.1, 0.05])
+        caller.callpeaks()
+        self.assertEqual(caller.max_paths_by_cutoff[0.1],
+                         [Interval(1, 5, [1, 2, 3])])
+        self.assertEqual(caller.max_paths_by_cutoff[0.05],
+                         caller.max_paths_by_cutoff[0.1])
+
     def __test_many_possible_holes(self):
         pileup = SparsePileup(self.multi_start_end_graph)
         pileup.data = {
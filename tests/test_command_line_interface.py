@@ -1,10 +1,13 @@
 import unittest
+import subprocess
+import sys
 from offsetbasedgraph import GraphWithReversals, Block, \
     IntervalCollection, DirectedInterval as Interval, SequenceGraph
 from graph_peak_caller.peakcollection import Peak, PeakCollection
 import os
 from graph_peak_caller.sparsediffs import SparseValues
-from graph_peak_caller.command_line_interface import run_argument_parser
+from graph_peak_caller.command_line_interface import run_argument_parser, \
+    interface, get_method
 import numpy as np
 from graph_peak_caller.peakfasta import PeakFasta
 
@@ -149,6 +152,35 @@ class TestCommandLineInterface(TestWrapper):
             f.close()
 
 
+HEAVY_MODULES = ["numpy", "scipy", "offsetbasedgraph", "pyvg", "matplotlib"]
+
+
+def time_in_subprocess(code):
+    """Seconds used by code run in a new python process, and heavy
+    modules it imported"""
+    code = ("import sys, time\nt = time.time()\n" + code +
+            "\nprint(time.time()-t)\nprint(','.join(m for m in %r if m in sys.modules))"
+            % HEAVY_MODULES)
+    lines = subprocess.check_output([sys.executable, "-c", code]).decode().split("\n")
+    return float(lines[-3]), [m for m in lines[-2].split(",") if m]
+
+
+class TestStartup(unittest.TestCase):
+    def test_methods_exist(self):
+        for command, spec in interface.items():
+            self.assertTrue(callable(get_method(spec["method"])), command)
+
+    def test_version_is_fast(self):
+        startup_time, modules = time_in_subprocess(
+            "from graph_peak_caller.command_line_interface import run_argument_parser\n"
+            "run_argument_parser(['version'])")
+        self.assertEqual(modules, [])
+        import_time, modules = time_in_subprocess(
+            "import graph_peak_caller.analysis.analysis_interface")
+        self.assertIn("numpy", modules)
+        self.assertLess(startup_time, import_time)
+
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,8 @@ import unittest
 from offsetbasedgraph import GraphWithReversals, Block, \
         Interval
 from graph_peak_caller.control import SparseControl, LinearMap
+from graph_peak_caller.control.controlgenerator import get_max_window_values
+from graph_peak_caller.sparsediffs import SparseDiffs
 
 from graph_peak_caller.legacy.sparsepileup import \
     SparsePileup as OldSparsePileup, ValuedIndexes
@@ -108,6 +110,45 @@ class TestCreateControl(unittest.TestCase):
         self.assertTrue(np.allclose(control, correct_pileup))
 
 
+class TestMaxWindowValues(unittest.TestCase):
+
+    def _get_values_per_window(self, starts, extension_sizes,
+                               fragment_length, min_value):
+        """One track per window, combined with maximum"""
+        max_pileup = None
+        for extension_size in extension_sizes:
+            extension = extension_size // 2
+            sparse_diffs = SparseDiffs.from_starts_and_ends(
+                np.add.outer(np.array([-extension, extension]), starts))
+            sparse_diffs /= (extension*2/fragment_length)
+            if max_pileup is None:
+                sparse_diffs.clip_min(min_value)
+                max_pileup = sparse_diffs
+            else:
+                max_pileup = max_pileup.maximum(sparse_diffs)
+        max_pileup._sanitize()
+        return max_pileup._indices, np.cumsum(max_pileup._diffs)
+
+    def _get_values_at(self, indices, values, positions):
+        idxs = np.searchsorted(indices, positions, side="right")-1
+        return np.where(idxs >= 0, values[np.maximum(idxs, 0)], 0)
+
+    def test_equals_values_per_window(self):
+        np.random.seed(1)
+        starts = np.sort(np.random.randint(0, 3000, 200))
+        positions = np.arange(-6000, 9000)
+        for extension_sizes in ([100, 1000, 5000], [5000], [100, 101]):
+            indices, values = get_max_window_values(
+                starts, extension_sizes, 100, 0.5)
+            true_indices, true_values = self._get_values_per_window(
+                starts, extension_sizes, 100, 0.5)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+            self.assertEqual(indices[0], true_indices[0])
+            np.testing.assert_allclose(
+                self._get_values_at(indices, values, positions),
+                self._get_values_at(true_indices, true_values, positions))
+
+
 class _TestCreateControlGraphWithDifferentLengths():
 
     def setUp(self):
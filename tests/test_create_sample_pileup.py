@@ -1,8 +1,10 @@
 import unittest
+import numpy as np
 from offsetbasedgraph import GraphWithReversals as Graph, Block, \
     DirectedInterval as Interval
 from graph_peak_caller import Configuration
 from graph_peak_caller.sample import get_fragment_pileup
+from graph_peak_caller.sample.sparsegraphpileup import SamplePileupGenerator
 from graph_peak_caller.intervals import Intervals
 from util import from_intervals
 
@@ -172,5 +174,47 @@ class TestSplitGraph2(TestCase):
         self.do_asserts()
 
 
+
+class DirectPileupReporter:
+    def add(self, name, data):
+        if name == "direct_pileup":
+            self.direct_pileup = data
+
+
+class TestSamplePileupGenerator(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph({i: Block(5) for i in range(1, 7)},
+                           {1: [2, 3], 2: [4], 3: [4], 4: [5], 5: [6]})
+        fragments = [Interval(1, 3, [1, 2, 4]), Interval(4, 1, [1, 3, 4, 5]),
+                     Interval(0, 5, [4, 5, 6]), Interval(2, 2, [3, 4, 5])]
+        self.reads = []
+        for fragment in fragments:
+            fragment.graph = self.graph
+            self.reads.append(fragment.get_subinterval(0, 3))
+            self.reads.append(fragment.get_subinterval(
+                fragment.length()-3, fragment.length()).get_reverse())
+
+    def _run(self, n_processes, batch_size=None):
+        generator = SamplePileupGenerator(self.graph, 5, n_processes)
+        reporter = DirectPileupReporter()
+        if batch_size is None:
+            pileup = generator.run(self.reads, reporter)
+        else:
+            pileup = generator.run_batches(
+                [self.reads[i:i+batch_size]
+                 for i in range(0, len(self.reads), batch_size)], reporter)
+        return pileup, reporter.direct_pileup
+
+    def test_parallel_equals_sequential(self):
+        true_pileup, true_direct_pileup = self._run(1)
+        for n_processes, batch_size in [(2, None), (3, None), (1, 3),
+                                        (3, 3)]:
+            pileup, direct_pileup = self._run(n_processes, batch_size)
+            self.assertEqual(pileup.get_sparse_values(),
+                             true_pileup.get_sparse_values())
+            self.assertEqual(direct_pileup, true_direct_pileup)
+            self.assertTrue(np.array_equal(pileup.touched_nodes._mask,
+                                           true_pileup.touched_nodes._mask))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from offsetbasedgraph import Graph, Block, NumpyIndexedInterval, Interval
+from graph_peak_caller.linearreads import LinearPathIndex, \
+    LinearReadsConverter, to_file_lines, parse_bed_chunk
+
+bed_lines = ["chr1\t0\t4\t.\t0\t+\n",
+             "chr1\t8\t14\t.\t0\t-\n",
+             "chr2\t3\t9\t.\t0\t+\n",
+             "chr1\t12\t25\t.\t0\t-\n",
+             "chr1\t22\t25\t.\t0\t+\n",
+             "chr1\t20\t40\t.\t0\t+\n",
+             "chr1\t10\t15\t.\t0\t+\n"]
+
+
+class TestLinearReads(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.graph = Graph(
+            {1: Block(10), 2: Block(5), 3: Block(10), 4: Block(5), 5: Block(5)},
+            {1: [2, 3], 2: [4], 3: [4], 4: [5]})
+        self.graph.convert_to_numpy_backend()
+        self.linear_path = NumpyIndexedInterval.from_interval(
+            Interval(0, 5, [1, 2, 4, 5], self.graph))
+        self.path_index = LinearPathIndex.from_linear_path(
+            self.linear_path, self.graph)
+        self.bed_file_name = os.path.join(self.dir, "reads.bed")
+        with open(self.bed_file_name, "w") as f:
+            f.writelines(bed_lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _get_true_lines(self, lines, chromosome=None):
+        true_lines = []
+        for line in lines:
+            row = line.split()
+            start, end = int(row[1]), int(row[2])
+            if chromosome is not None and row[0] != chromosome:
+                continue
+            if end > self.linear_path.length():
+                continue
+            interval = self.linear_path.get_exact_subinterval(start, end)
+            interval.graph = self.graph
+            if row[5] == "-":
+                interval = interval.get_reverse()
+            true_lines.append(interval.to_file_line() + "\n")
+        return "".join(true_lines)
+
+    def test_path_index(self):
+        self.assertEqual(list(self.path_index.nodes), [1, 2, 4, 5])
+        self.assertEqual(list(self.path_index.starts), [0, 10, 15, 20])
+        self.assertEqual(list(self.path_index.node_sizes), [10, 5, 5, 5])
+
+    def test_same_as_exact_subintervals(self):
+        _, starts, ends, is_reverse = parse_bed_chunk(
+            "".join(bed_lines[:5]).encode())
+        lines = to_file_lines(*self.path_index.get_intervals(
+            starts, ends, is_reverse))
+        self.assertEqual(lines, self._get_true_lines(bed_lines[:5]))
+
+    def _check_convert(self, **kwargs):
+        out_base = os.path.join(self.dir, "reads")
+        converter = LinearReadsConverter({"1": self.path_index}, **kwargs)
+        n_skipped = converter.convert(self.bed_file_name, out_base)
+        self.assertEqual(n_skipped, 1)
+        with open(out_base + "_1.intervalcollection") as f:
+            self.assertEqual(f.read(),
+                             self._get_true_lines(bed_lines, "chr1"))
+
+    def test_convert(self):
+        self._check_convert()
+
+    def test_convert_parallel_small_chunks(self):
+        self._check_convert(chunk_size=20, n_processes=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
-from graph_peak_caller.multiplegraphscallpeaks import MultipleGraphsCallpeaks
+from graph_peak_caller.multiplegraphscallpeaks import MultipleGraphsCallpeaks, \
+    MultipleSamplesCallpeaks
+from graph_peak_caller.control import get_shared_background, \
+    get_background_track_from_input
 from graph_peak_caller.intervals import Intervals
+from graph_peak_caller.linearprojection import AlignmentArrays
 from graph_peak_caller import Configuration
 from graph_peak_caller.reporter import Reporter
+from graph_peak_caller.sparsediffs import SparseValues
+from graph_peak_caller.peakcollection import PeakCollection
+import numpy as np
 from offsetbasedgraph import GraphWithReversals as Graph, \
     DirectedInterval, IntervalCollection, Block, SequenceGraph, Interval
 import unittest
@@ -11,6 +18,8 @@ import logging
 from graph_peak_caller.logging_config import set_logging_config
 #set_logging_config(1)
 import os
+import glob
+import json
 from graph_peak_caller.command_line_interface import run_argument_parser
 
 
@@ -179,6 +188,269 @@ class TestMultipleGraphsCallPeaksCommandLine(TestMultipleGraphsCallPeaks):
         self.assertEqual(unique, 3)
 
 
+class TestMultipleGraphsCallPeaksCompact(TestMultipleGraphsCallPeaks):
+
+    def test_compact_equals_full_precision(self):
+        compact_config = self.config.copy()
+        compact_config.compact_tracks = True
+        for config, name in [(self.config, "full_"),
+                             (compact_config, "compact_")]:
+            caller = MultipleGraphsCallpeaks(
+                self.chromosomes,
+                [chrom + ".nobg" for chrom in self.chromosomes],
+                [Intervals(reads._intervals) for reads in self.sample_reads],
+                [Intervals(reads._intervals) for reads in self.control_reads],
+                self.linear_maps, config,
+                Reporter(name, compact=config.compact_tracks))
+            caller.run()
+
+        for chromosome in self.chromosomes:
+            full = SparseValues.from_sparse_files(
+                "full_%s_pvalues" % chromosome)
+            compact = SparseValues.from_sparse_files(
+                "compact_%s_pvalues" % chromosome)
+            np.testing.assert_array_equal(compact.indices, full.indices)
+            np.testing.assert_array_equal(compact.values, full.values)
+            for track in ["qvalues", "direct_pileup"]:
+                full = SparseValues.from_sparse_files(
+                    "full_%s_%s" % (chromosome, track))
+                compact = SparseValues.from_sparse_files(
+                    "compact_%s_%s" % (chromosome, track))
+                self.assertEqual(compact.indices.dtype, np.int32)
+                self.assertEqual(compact.values.dtype, np.float32)
+                size = full.track_size
+                np.testing.assert_allclose(
+                    compact.to_dense_pileup(size),
+                    full.to_dense_pileup(size), rtol=1e-6)
+            full_peaks = list(PeakCollection.from_file(
+                "full_%s_max_paths.intervalcollection" % chromosome,
+                text_file=True))
+            compact_peaks = list(PeakCollection.from_file(
+                "compact_%s_max_paths.intervalcollection" % chromosome,
+                text_file=True))
+            self.assertEqual(full_peaks, compact_peaks)
+            self.assertEqual([p.score for p in compact_peaks],
+                             [p.score for p in full_peaks])
+
+
+class TestMultipleGraphsCallPeaksChunked(TestMultipleGraphsCallPeaks):
+
+    def test_run_with_chunked_tracks(self):
+        config = self.config.copy()
+        config.chunked_tracks = True
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            config,
+            Reporter("chunked_", chunked=True),
+            stop_after_p_values=True
+        )
+        caller.run()
+        caller.create_joined_q_value_mapping()
+        caller.run_from_p_values()
+        for chromosome in self.chromosomes:
+            self.assertTrue(os.path.isfile(
+                "chunked_%s_qvalues_track.npz" % chromosome))
+            final_peaks = IntervalCollection.create_list_from_file(
+                "chunked_%s_max_paths.intervalcollection" % chromosome)
+            for peak in self.peaks[self.chromosomes.index(chromosome)]:
+                assert peak in final_peaks
+
+
+class TestMultipleGraphsCallPeaksScheduled(TestMultipleGraphsCallPeaks):
+
+    def test_run_with_memory_limit(self):
+        config = self.config.copy()
+        config.memory_limit = 4*1024**3
+        config.memory_history = "test_memory_history.json"
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            config,
+            self.reporter
+        )
+        caller.run()
+        self.do_asserts()
+        with open("test_memory_history.json") as f:
+            self.assertEqual(len(json.load(f)), len(self.chromosomes))
+        os.remove("test_memory_history.json")
+
+
+class TestMultipleGraphsCallPeaksPrefetch(TestMultipleGraphsCallPeaks):
+
+    def test_run_with_prefetch(self):
+        config = self.config.copy()
+        config.prefetch_depth = 2
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            config,
+            self.reporter,
+            sequence_retrievers=(SequenceGraph.from_file(chrom + ".nobg.sequences")
+                                 for chrom in self.chromosomes)
+        )
+        caller.run()
+        self.do_asserts()
+        for chromosome in self.chromosomes:
+            self.assertTrue(os.path.isfile(
+                "multigraphs_%s_sequences.fasta" % chromosome))
+
+    def test_prefetch_reads_from_files(self):
+        read_files = []
+        for chromosome, reads in zip(self.chromosomes, self.sample_reads):
+            file_name = "multigraphs_%s_reads.intervalcollection" % chromosome
+            IntervalCollection(reads._intervals).to_file(
+                file_name, text_file=True)
+            read_files.append(file_name)
+        config = self.config.copy()
+        config.prefetch_depth = 1
+        config.keep_duplicates = True
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            read_files, read_files, self.linear_maps, config,
+            self.reporter)
+        _, _, sample, control = caller._get_p_values_input(0)
+        self.assertIsInstance(sample, AlignmentArrays)
+        self.assertIs(control, sample)
+        self.assertEqual(len(sample), len(self.sample_reads[0]._intervals))
+        caller.run()
+        self.do_asserts()
+        for file_name in read_files:
+            os.remove(file_name)
+
+
+class TestMultipleGraphsCallPeaksHandoff(TestMultipleGraphsCallPeaks):
+
+    def _get_caller(self, config, reporter):
+        return MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            config, reporter)
+
+    def test_keeps_results_in_memory(self):
+        caller = self._get_caller(self.config, self.reporter)
+        caller.run_to_p_values()
+        for chromosome in self.chromosomes:
+            self.assertIn("multigraphs_%s_pvalues" % chromosome,
+                          self.reporter._results)
+        caller.create_joined_q_value_mapping()
+        caller.run_from_p_values()
+        self.do_asserts()
+
+    def test_reads_back_results_over_handoff_memory(self):
+        config = self.config.copy()
+        config.handoff_memory = 0
+        caller = self._get_caller(config, self.reporter)
+        caller.run_to_p_values()
+        self.assertEqual(self.reporter._results, {})
+        caller.create_joined_q_value_mapping()
+        caller.run_from_p_values()
+        self.do_asserts()
+
+    def test_write_behind(self):
+        config = self.config.copy()
+        config.write_behind = True
+        caller = self._get_caller(
+            config, Reporter("multigraphs_", write_behind=True))
+        caller.run()
+        self.do_asserts()
+
+
+class MaxPathsReporter(Reporter):
+    max_paths = {}
+
+    def add(self, name, data):
+        if name == "max_paths":
+            self.max_paths[self._base_name] = data
+        super().add(name, data)
+
+
+class TestMultipleGraphsCallPeaksInMemory(TestMultipleGraphsCallPeaks):
+
+    def test_run_without_writing_files(self):
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            self.config,
+            MaxPathsReporter("inmemory_", write_files=False)
+        )
+        caller.run()
+        self.assertEqual(glob.glob("inmemory_*"), [])
+        for i, chromosome in enumerate(self.chromosomes):
+            max_paths = MaxPathsReporter.max_paths["inmemory_%s_" % chromosome]
+            for peak in self.peaks[i]:
+                assert peak in max_paths
+
+    def test_run_with_write_behind(self):
+        caller = MultipleGraphsCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            self.sample_reads,
+            self.control_reads,
+            self.linear_maps,
+            self.config,
+            Reporter("multigraphs_", write_behind=True)
+        )
+        caller.run()
+        caller._reporter.flush()
+        self.do_asserts()
+
+
+class TestMultipleSamplesCallPeaks(TestMultipleGraphsCallPeaks):
+
+    def test_shared_background_equals_background(self):
+        graph = Graph.from_file("1.nobg")
+        self.config.linear_map_name = self.linear_maps[0]
+        for touched_nodes in [{1}, {1, 2, 3}, {2}]:
+            true_track = get_background_track_from_input(
+                graph, Intervals(self.control_reads[0]._intervals),
+                self.config, touched_nodes)
+            shared = get_shared_background(
+                graph, Intervals(self.control_reads[0]._intervals),
+                self.config, LinearMap.from_file(self.linear_maps[0], graph))
+            self.assertEqual(shared.get_track(touched_nodes), true_track)
+            self.assertEqual(shared.n_reads, len(self.control_reads[0]._intervals))
+
+    def test_run_two_samples(self):
+        sample_names = ["a", "b", "c"]
+        samples = {name: [Intervals(reads._intervals)
+                          for reads in self.sample_reads]
+                   for name in sample_names}
+        background_reads = [
+            Intervals([DirectedInterval(i, i+2, [3+3*chrom_number])
+                       for i in range(0, 8, 2)])
+            for chrom_number in range(len(self.chromosomes))]
+        controls = {"a": None, "b": background_reads, "c": background_reads}
+        caller = MultipleSamplesCallpeaks(
+            self.chromosomes,
+            [chrom + ".nobg" for chrom in self.chromosomes],
+            sample_names, samples, controls,
+            self.linear_maps, self.config,
+            Reporter("multisamples_"))
+        caller.run()
+        for sample_name in sample_names:
+            for i, chromosome in enumerate(self.chromosomes):
+                final_peaks = IntervalCollection.create_list_from_file(
+                    "multisamples_%s_%s_max_paths.intervalcollection" % (
+                        sample_name, chromosome))
+                for peak in self.peaks[i]:
+                    assert peak in final_peaks
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+import offsetbasedgraph as obg
+from graph_peak_caller.peakcollection import Peak, PeakCollection
+from graph_peak_caller.overlapindex import OverlapIndex
+
+
+class TestOverlapIndex(unittest.TestCase):
+    def setUp(self):
+        self.graph = obg.GraphWithReversals(
+            {i: obg.Block(5) for i in range(1, 9)},
+            {i: [i+1] for i in range(1, 8)})
+        self.graph.convert_to_numpy_backend()
+        np.random.seed(0)
+        self.peaks1 = [self._random_peak() for _ in range(40)]
+        self.peaks2 = [self._random_peak() for _ in range(30)]
+
+    def _random_peak(self):
+        start_node = np.random.randint(1, 9)
+        end_node = np.random.randint(start_node, 9)
+        start = np.random.randint(0, 5)
+        end = np.random.randint(start+1 if start_node == end_node else 1, 6)
+        rps = list(range(start_node, end_node+1))
+        if np.random.rand() < 0.2:
+            rps = [-rp for rp in rps[::-1]]
+        return Peak(start, end, rps, graph=self.graph)
+
+    def test_overlapping_pairs(self):
+        for minimum_overlap in (1, 4):
+            ids, other_ids = OverlapIndex.from_intervals(
+                self.peaks1).overlapping_pairs(
+                    OverlapIndex.from_intervals(self.peaks2), minimum_overlap)
+            true_pairs = [(i, j) for i, p1 in enumerate(self.peaks1)
+                          for j, p2 in enumerate(self.peaks2)
+                          if p1.overlaps(p2, minimum_overlap)]
+            self.assertEqual(list(zip(ids, other_ids)), true_pairs)
+
+    def test_similar_pairs(self):
+        ids, other_ids = OverlapIndex.from_intervals(
+            self.peaks1).similar_pairs(
+                OverlapIndex.from_intervals(self.peaks2), 3)
+        true_pairs = [(i, j) for i, p1 in enumerate(self.peaks1)
+                      for j, p2 in enumerate(self.peaks2)
+                      if p1.is_approx_equal(p2, 3)]
+        self.assertEqual(list(zip(ids, other_ids)), true_pairs)
+
+    def test_peak_collection_queries(self):
+        collection = PeakCollection(self.peaks1)
+        for peak in self.peaks2[:10]:
+            self.assertEqual(
+                collection.get_overlapping_intervals(peak, 2),
+                [p for p in self.peaks1 if p.overlaps(peak, 2)])
+        pairs = collection.get_overlapping_pairs(PeakCollection(self.peaks2))
+        self.assertEqual(len(pairs), sum(
+            p1.overlaps(p2) for p1 in self.peaks1 for p2 in self.peaks2))
+
+    def test_identical_intervals(self):
+        collection = PeakCollection(self.peaks1)
+        other = PeakCollection(self.peaks2 + self.peaks1[5:8])
+        self.assertEqual(collection.get_identical_intervals(other),
+                         [p for p in self.peaks1 if p in other.intervals])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from offsetbasedgraph import Graph, Block, Interval
+from graph_peak_caller.peakcollection import Peak, PeakCollection
+from graph_peak_caller.peakarrays import PeakArrays
+
+
+class TestPeakArrays(unittest.TestCase):
+    def setUp(self):
+        self.peaks = [Peak(3, 5, [1, 2, 3], score=4.0, unique_id="peak0",
+                           chromosome="2"),
+                      Peak(0, 2, [-5], score=9.5, unique_id="peak1",
+                           chromosome="1"),
+                      Peak(1, 4, [7, 8], score=1.5, chromosome=None)]
+        self.peaks[1].info = (1, 0)
+        self.arrays = PeakArrays.from_peaks(self.peaks)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip_peaks(self):
+        peaks = list(self.arrays)
+        self.assertEqual(peaks, self.peaks)
+        self.assertEqual([p.to_file_line() for p in peaks],
+                         [p.to_file_line() for p in self.peaks])
+
+    def test_to_from_file(self):
+        file_name = os.path.join(self.dir, "peaks.npz")
+        self.arrays.to_file(file_name)
+        self.assertEqual(PeakArrays.from_file(file_name), self.arrays)
+
+    def test_from_intervalcollection_file(self):
+        file_name = os.path.join(self.dir, "peaks.intervalcollection")
+        PeakCollection(self.peaks).to_file(file_name, text_file=True)
+        from_text = PeakArrays.from_intervalcollection_file(file_name)
+        self.assertEqual(from_text.get_chromosomes(), ["2", "1", None])
+        self.arrays.to_files(file_name)
+        self.assertEqual(PeakArrays.from_intervalcollection_file(file_name),
+                         self.arrays)
+
+    def test_filter_by_score(self):
+        filtered = self.arrays.filter_by_score(3.0)
+        self.assertEqual(list(filtered), self.peaks[:2])
+        self.assertTrue(np.all(filtered.region_paths == [1, 2, 3, -5]))
+
+    def test_get_chromosome(self):
+        self.assertEqual(list(self.arrays.get_chromosome("1")),
+                         [self.peaks[1]])
+        self.assertEqual(len(self.arrays.get_chromosome("X")), 0)
+        self.assertEqual(sorted(self.arrays.split_by_chromosome()), ["1", "2"])
+
+    def test_to_approx_linear_bed_file(self):
+        graph = Graph({i: Block(10) for i in range(1, 9)},
+                      {1: [2, 3], 2: [4], 3: [4], 4: [5, 6], 5: [7],
+                       6: [7], 7: [8]})
+        graph.convert_to_numpy_backend()
+        linear_path = Interval(0, 10, [1, 2, 4, 5, 7, 8],
+                               graph).to_numpy_indexed_interval()
+        peaks = [Peak(3, 5, [1, 2, 4], score=4.0),
+                 Peak(2, 8, [3, 4, 6, 7], score=2.0),
+                 Peak(1, 4, [3], score=1.0),
+                 Peak(5, 6, [2], score=3.25)]
+        file_name = os.path.join(self.dir, "peaks.bed")
+        PeakArrays.from_peaks(peaks).to_approx_linear_bed_file(
+            file_name, linear_path, "chr2")
+        expected = [peaks[i].to_approx_linear_peak(linear_path, "chr2")
+                    for i in (0, 1, 3)]
+        with open(file_name) as f:
+            self.assertEqual(f.read(), "".join(
+                peak.to_bed_line() for peak in expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
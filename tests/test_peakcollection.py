@@ -23,6 +23,14 @@ class TestPeakCollection(unittest.TestCase):
         self.assertTrue(self.peaks.contains_interval(Peak(3, 3, [1, 2, 3, 4])))
         self.assertFalse(self.peaks.contains_interval(Peak(2, 3, [1, 2, 3, 4])))
 
+    def test_setting_intervals_resets_index(self):
+        self.assertFalse(self.peaks.contains_interval(Peak(2, 3, [1, 2, 3, 4])))
+        self.peaks.intervals = [Peak(2, 3, [1, 2, 3, 4], self.graph)]
+        self.assertTrue(self.peaks.contains_interval(Peak(2, 3, [1, 2, 3, 4])))
+        overlapping = self.peaks.get_overlapping_intervals(
+            Peak(3, 3, [5, 6], self.graph))
+        self.assertEqual(len(overlapping), 0)
+
     def test_get_similar_intervals(self):
         similar = self.peaks.get_similar_intervals(Peak(2, 3, [1, 2, 3, 4], self.graph), 1)
         self.assertTrue(len(similar) == 1)
@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import offsetbasedgraph as obg
+from graph_peak_caller.peakcollection import Peak
+from graph_peak_caller.peakfasta import get_interval_sequences,\
+    merge_peak_fasta_files, PeakFasta
+
+
+class TestIntervalSequences(unittest.TestCase):
+    def setUp(self):
+        node_sizes = np.array([4, 3, 5, 2])
+        indices = np.insert(np.cumsum(node_sizes), 0, 0)
+        sequence_array = np.array([1, 2, 3, 4, 0, 1, 1, 4, 4, 2, 3, 1, 2, 3],
+                                  dtype=np.uint8)
+        self.sequence_graph = obg.SequenceGraph(
+            1, indices, node_sizes, sequence_array)
+        self.intervals = [
+            Peak(1, 3, [1]),
+            Peak(2, 2, [1, 2, 3, 4]),
+            Peak(0, 3, [-3, -2]),
+            Peak(1, 4, [-3]),
+            Peak(3, 2, [2, 3, 4])]
+
+    def test_matches_get_interval_sequence(self):
+        true_sequences = [self.sequence_graph.get_interval_sequence(interval)
+                          for interval in self.intervals]
+        sequences = get_interval_sequences(self.sequence_graph,
+                                           self.intervals)
+        self.assertEqual(sequences, true_sequences)
+
+    def test_write_max_path_sequences(self):
+        out_dir = tempfile.mkdtemp()
+        file_name = os.path.join(out_dir, "sequences.fasta")
+        PeakFasta(self.sequence_graph).write_max_path_sequences(
+            file_name, self.intervals)
+        lines = open(file_name).read().split("\n")
+        shutil.rmtree(out_dir)
+        self.assertEqual(lines[0], ">peak0 " + self.intervals[0].to_file_line())
+        self.assertEqual(lines[1], "ct")
+        self.assertEqual(len(lines), 2*len(self.intervals)+1)
+
+
+class TestMergePeakFastaFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, scores):
+        file_name = os.path.join(self.dir, name)
+        with open(file_name, "w") as f:
+            for i, score in enumerate(scores):
+                f.write(">peak%d %s\nacgt%s\n" % (
+                    i, Peak(0, 4, [int(score)], score=score).to_file_line(), name))
+        return file_name
+
+    def _merge(self, file_names):
+        out_name = os.path.join(self.dir, "out.fasta")
+        out_json = os.path.join(self.dir, "out.intervalcollection")
+        merge_peak_fasta_files(file_names, out_name, out_json, chunk_size=2)
+        lines = open(out_name).readlines()
+        peaks = [Peak.from_file_line(line.split(maxsplit=1)[1])
+                 for line in lines[::2]]
+        self.assertEqual(len(open(out_json).readlines()), len(peaks))
+        return [peak.score for peak in peaks], [line.strip() for line in lines[1::2]]
+
+    def test_merge_sorted(self):
+        files = [self._write("a", [9, 5, 5, 1]), self._write("b", [7, 5, 2])]
+        scores, sequences = self._merge(files)
+        self.assertEqual(scores, [9, 7, 5, 5, 5, 2, 1])
+        self.assertEqual(sequences[2:5], ["acgta", "acgta", "acgtb"])
+
+    def test_merge_unsorted(self):
+        files = [self._write("a", [9, 1, 5]), self._write("b", [7, 8])]
+        scores, _ = self._merge(files)
+        self.assertEqual(scores, [9, 8, 7, 5, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
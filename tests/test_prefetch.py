@@ -0,0 +1,59 @@
+import unittest
+import threading
+from graph_peak_caller.prefetch import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+    def test_yields_items_in_order(self):
+        for depth in [0, 1, 3]:
+            items = list(Prefetcher(lambda x: x*2, range(5), depth))
+            self.assertEqual(items, [0, 2, 4, 6, 8])
+
+    def test_loads_at_most_depth_ahead(self):
+        loaded = []
+        lock = threading.Lock()
+
+        def load(key):
+            with lock:
+                loaded.append(key)
+            return key
+
+        prefetcher = Prefetcher(load, range(10), depth=2)
+        for key in prefetcher:
+            with lock:
+                self.assertLessEqual(len(loaded), key+3)
+
+    def test_loads_in_background(self):
+        started = threading.Event()
+
+        def load(key):
+            if key == 1:
+                started.set()
+            return key
+
+        for key in Prefetcher(load, range(2), depth=1):
+            if key == 0:
+                self.assertTrue(started.wait(5))
+
+    def test_raises_exceptions_in_order(self):
+        def load(key):
+            if key == 2:
+                raise FileNotFoundError(key)
+            return key
+
+        items = []
+        with self.assertRaises(FileNotFoundError):
+            for item in Prefetcher(load, range(5), depth=2):
+                items.append(item)
+        self.assertEqual(items, [0, 1])
+
+    def test_close_stops_loading(self):
+        loaded = []
+        prefetcher = Prefetcher(loaded.append, range(100), depth=1)
+        for _ in prefetcher:
+            break
+        self.assertLessEqual(len(loaded), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,8 @@
+import io
+import numpy as np
 from graph_peak_caller.command_line_interface import project_alignments
+from graph_peak_caller.linearprojection import LinearProjector, \
+    AlignmentArrays, write_bed
 from offsetbasedgraph import Graph, Block, NumpyIndexedInterval, Interval
 
 def test_simple():
@@ -33,3 +37,36 @@ def test_reverse():
     projected = list(projected)
     assert projected[0] == (5, 16, "-")
 
+
+
+def test_unprojectable_alignments_are_skipped():
+    graph = Graph({1: Block(10), 2: Block(5), 3: Block(10), 4: Block(5), 5: Block(3)},
+                  {1: [2, 3], 2: [4], 3: [4], 5: [3]})
+    graph.convert_to_numpy_backend()
+    linear_path = NumpyIndexedInterval.from_interval(Interval(0, 5, [1, 2, 4], graph))
+    alignments = [Interval(0, 2, [5], graph),
+                  Interval(5, 5, [1, 3], graph),
+                  Interval(5, 2, [1, -2], graph)]
+    projected = list(project_alignments(alignments, linear_path))
+    assert projected == [(5, 15, "+")]
+
+
+def test_uses_last_previous_node_on_path():
+    graph = Graph({1: Block(10), 2: Block(5), 3: Block(10), 4: Block(5)},
+                  {1: [2, 3], 2: [3, 4], 3: [4]})
+    graph.convert_to_numpy_backend()
+    linear_path = NumpyIndexedInterval.from_interval(Interval(0, 5, [1, 2, 4], graph))
+    projector = LinearProjector(graph, linear_path)
+    alignments = AlignmentArrays.from_intervals(
+        [Interval(2, 4, [3], graph), Interval(2, 3, [3, 4], graph)])
+    starts, ends, strands, is_projected = projector.project(alignments)
+    assert list(starts) == [17, 17]
+    assert list(ends) == [19, 28]
+    assert list(strands) == [1, 1]
+    assert all(is_projected)
+
+
+def test_write_bed():
+    out = io.StringIO()
+    write_bed(out, "chr1", np.array([1, 5]), np.array([3, 9]), np.array([1, -1]))
+    assert out.getvalue() == "chr1\t1\t3\t.\t0\t+\nchr1\t5\t9\t.\t0\t-\n"
@@ -0,0 +1,59 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from graph_peak_caller.readsplitter import ChromosomeReadSplitter,\
+    find_chunk_boundaries, split_chunk
+
+lines = [b'{"path": {"mapping": [{"position": {"node_id": 3}}, {"position": {"node_id": 12}}]}}\n',
+         b'{"path": {"mapping": [{"position": {"node_id": "15"}}]}}\n',
+         b'{"sequence": "ACGT"}\n',
+         b'{"path": {"mapping": [{"position": {"node_id": 40}}]}}\n',
+         b'{"path": {"mapping": [{"position": {"node_id": 11}}]}}\n',
+         b'{"path": {"mapping": [{"position": {"node_id": 1}}]}}']
+
+
+class TestReadSplitter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir, "reads.json")
+        with open(self.file_name, "wb") as f:
+            f.writelines(lines)
+        self.limits = {"2": (11, 20), "1": (1, 10)}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_split_chunk(self):
+        result = split_chunk(b"".join(lines), np.array([1, 11]),
+                             np.array([10, 20]))
+        self.assertEqual(result[0], lines[0] + lines[5])
+        self.assertEqual(result[1], lines[1] + lines[4])
+        self.assertEqual(result[-1], lines[2] + lines[3])
+
+    def test_chunk_boundaries(self):
+        chunks = find_chunk_boundaries(self.file_name, 10)
+        self.assertEqual(len(chunks), len(lines))
+        self.assertEqual(chunks[-1][1], sum(len(line) for line in lines))
+
+    def _check_split(self, **kwargs):
+        out_base = os.path.join(self.dir, "reads")
+        n_unmapped = ChromosomeReadSplitter(
+            self.limits, **kwargs).split(self.file_name, out_base)
+        self.assertEqual(n_unmapped, 2)
+        expected = {"1": lines[0] + lines[5], "2": lines[1] + lines[4],
+                    "unmapped": lines[2] + lines[3]}
+        for chrom, data in expected.items():
+            with open(out_base + "_" + chrom + ".json", "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_split(self):
+        self._check_split()
+
+    def test_split_parallel_small_chunks(self):
+        self._check_split(chunk_size=30, n_processes=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
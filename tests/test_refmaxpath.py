@@ -1,7 +1,7 @@
 import offsetbasedgraph as obg
 from collections import defaultdict
 from graph_peak_caller.postprocess.reference_based_max_path\
-    import max_path_func
+    import max_path_func, ReferenceMaxPaths
 from offsetbasedgraph.vcfmap import VariantMap, DELMap
 from graph_peak_caller.sparsediffs import SparseValues
 from graph_peak_caller.peakcollection import Peak
@@ -50,13 +50,13 @@ def nonvar_pileup():
 
 
 @pytest.fixture
-def get_max_path():
-    return max_path_func(pileup(), graph(), variant_maps())
+def get_max_path(pileup, graph, variant_maps):
+    return max_path_func(pileup, graph, variant_maps)
 
 
 @pytest.fixture
-def get_max_path_nonvar():
-    return max_path_func(nonvar_pileup(), graph(), variant_maps())
+def get_max_path_nonvar(nonvar_pileup, graph, variant_maps):
+    return max_path_func(nonvar_pileup, graph, variant_maps)
 
 
 @pytest.fixture
@@ -76,18 +76,19 @@ def offset_areas():
 
 
 @pytest.fixture
-def sparse_max_paths():
-    return SparseMaxPaths(areas(), graph(), pileup(), variant_maps())
+def sparse_max_paths(areas, graph, pileup, variant_maps):
+    return SparseMaxPaths(areas, graph, pileup, variant_maps)
 
 
 @pytest.fixture
-def sparse_max_paths_nonvar():
-    return SparseMaxPaths(areas(), graph(), nonvar_pileup(), variant_maps())
+def sparse_max_paths_nonvar(areas, graph, nonvar_pileup, variant_maps):
+    return SparseMaxPaths(areas, graph, nonvar_pileup, variant_maps)
 
 
 @pytest.fixture
-def sparse_max_paths_offset():
-    return SparseMaxPaths(offset_areas(), graph(), nonvar_pileup(), variant_maps())
+def sparse_max_paths_offset(offset_areas, graph, nonvar_pileup,
+                            variant_maps):
+    return SparseMaxPaths(offset_areas, graph, nonvar_pileup, variant_maps)
 
 
 def test_snp(get_max_path):
@@ -120,6 +121,12 @@ def test_no_del(get_max_path_nonvar):
     assert max_path == [14, 16, 17]
 
 
+def test_many_components(pileup, graph, variant_maps):
+    max_paths = ReferenceMaxPaths(pileup, graph, variant_maps).run(
+        [[11, 12, 13, 14], [14, 15, 16], [14, 15, 16, 17], [12]])
+    assert max_paths == [[11, 13, 14], [14, 15, 16], [14, 17], [12]]
+
+
 def test_maxpath(sparse_max_paths):
     max_paths = sparse_max_paths.run()[0]
     print(max_paths)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from graph_peak_caller.reporter import Reporter
+from graph_peak_caller.sparsediffs import SparseValues
+from graph_peak_caller.touchednodes import TouchedNodes
+
+
+class TestReporter(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.base_name = os.path.join(self.dir_name, "test_")
+        self.track = SparseValues(np.array([0, 3, 7]),
+                                  np.array([0., 2., 1.]))
+        self.track.track_size = 10
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def assert_tracks_equal(self, track, true_track):
+        np.testing.assert_array_equal(track.indices, true_track.indices)
+        np.testing.assert_array_equal(track.values, true_track.values)
+
+    def test_get_from_memory(self):
+        reporter = Reporter(self.base_name, write_files=False)
+        sub_reporter = reporter.get_sub_reporter("1")
+        sub_reporter.add("pvalues", self.track)
+        self.assert_tracks_equal(sub_reporter.get("pvalues"), self.track)
+        self.assertEqual(os.listdir(self.dir_name), [])
+        sub_reporter.release()
+        self.assertRaises(KeyError, sub_reporter.get, "pvalues")
+
+    def test_get_from_file_after_release(self):
+        reporter = Reporter(self.base_name).get_sub_reporter("1")
+        reporter.add("pvalues", self.track)
+        reporter.add("touched_nodes", TouchedNodes.from_node_ids(
+            np.array([2, 4]), min_node=1, n_nodes=5))
+        reporter.release()
+        self.assert_tracks_equal(reporter.get("pvalues"), self.track)
+        np.testing.assert_array_equal(
+            reporter.get("touched_nodes")._mask,
+            [False, True, False, True, False])
+
+    def test_compacts_tracks_in_memory(self):
+        reporter = Reporter(self.base_name, write_files=False)
+        reporter.add("pvalues", self.track)
+        track = reporter.get("pvalues")
+        self.assertEqual(track.indices.dtype, np.int32)
+        self.assertEqual(track.values.dtype, np.float32)
+        self.track.values[1] = 1/3
+        reporter.add("pvalues", self.track)
+        track = reporter.get("pvalues")
+        self.assertEqual(track.indices.dtype, np.int32)
+        self.assertEqual(track.values.dtype, np.float64)
+        self.assert_tracks_equal(track, self.track)
+
+    def test_write_behind(self):
+        reporter = Reporter(self.base_name, write_behind=True)
+        sub_reporter = reporter.get_sub_reporter("1")
+        sub_reporter.add("qvalues", self.track)
+        reporter.flush()
+        self.assert_tracks_equal(
+            SparseValues.from_sparse_files(self.base_name + "1_qvalues"),
+            self.track)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import os
+import time
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, Block
+
+from graph_peak_caller.scheduler import MemoryEstimator, MemoryScheduler
+
+LOG = "test_scheduler_log.txt"
+
+
+def log_job(job):
+    with open(LOG, "a") as f:
+        f.write("%s start %f\n" % (job, time.time()))
+    time.sleep(0.2)
+    with open(LOG, "a") as f:
+        f.write("%s end %f\n" % (job, time.time()))
+
+
+class TestMemoryEstimator(unittest.TestCase):
+    def setUp(self):
+        graph = Graph({i: Block(10) for i in range(1, 5)},
+                      {1: [2, 3], 2: [4], 3: [4]})
+        graph.convert_to_numpy_backend()
+        graph.to_file("test_scheduler.nobg")
+        with open("test_scheduler_reads.json", "w") as f:
+            f.write("x"*1000)
+
+    def tearDown(self):
+        for name in ["test_scheduler.nobg", "test_scheduler_reads.json",
+                     "test_scheduler_history.json"]:
+            if os.path.isfile(name):
+                os.remove(name)
+
+    def test_features(self):
+        features = MemoryEstimator.get_features(
+            "test_scheduler.nobg", ["test_scheduler_reads.json", None])
+        self.assertEqual(features["n_bases"], 40)
+        self.assertEqual(features["n_nodes"], 4)
+        self.assertEqual(features["n_edges"], 4)
+        self.assertEqual(features["read_bytes"], 1000)
+
+    def test_history_scales_estimates(self):
+        estimator = MemoryEstimator("test_scheduler_history.json")
+        features = MemoryEstimator.get_features(
+            "test_scheduler.nobg", ["test_scheduler_reads.json"])
+        model = estimator.model(features)
+        self.assertEqual(estimator.estimate(features), int(1.1*model))
+        other = dict(features, graph="other.nobg")
+        estimator.add(other, 3*model)
+        estimator.add(features, 2*model)
+        estimator.add(features, 0.5*model)
+        estimator.save()
+
+        estimator = MemoryEstimator("test_scheduler_history.json")
+        self.assertEqual(estimator.estimate(features), int(1.1*2*model))
+        new = dict(features, graph="new.nobg")
+        self.assertEqual(estimator.estimate(new), int(1.1*2*model))
+
+
+class TestMemoryScheduler(unittest.TestCase):
+    def tearDown(self):
+        if os.path.isfile(LOG):
+            os.remove(LOG)
+
+    def _get_intervals(self):
+        starts, ends = {}, {}
+        with open(LOG) as f:
+            for line in f:
+                job, event, t = line.split()
+                (starts if event == "start" else ends)[job] = float(t)
+        return starts, ends
+
+    def test_stays_below_limit(self):
+        jobs = ["a", "b", "c", "d"]
+        estimates = [3, 6, 4, 5]
+        MemoryScheduler(10, n_processes=4).run(log_job, jobs, estimates)
+        starts, ends = self._get_intervals()
+        self.assertEqual(sorted(starts), jobs)
+        self.assertEqual(min(starts, key=starts.get), "b")
+        for job, start in starts.items():
+            running = [other for other in jobs
+                       if starts[other] <= start < ends[other]]
+            self.assertLessEqual(
+                sum(estimates[jobs.index(other)] for other in running), 10)
+
+    def test_too_large_job_runs_alone(self):
+        MemoryScheduler(10, n_processes=4).run(log_job, ["a", "b"], [20, 1])
+        starts, ends = self._get_intervals()
+        self.assertGreaterEqual(starts["b"], ends["a"])
+
+    def test_measures_memory(self):
+        peak_memory = MemoryScheduler(10**10).run(
+            lambda n: np.ones(n).sum(), [10, 25*10**6], [1, 1])
+        self.assertLess(peak_memory[0], 50*1024**2)
+        self.assertGreater(peak_memory[1], 150*1024**2)
+
+    def test_failing_job(self):
+        def fail(job):
+            raise ValueError(job)
+        with self.assertRaises(RuntimeError):
+            MemoryScheduler(10).run(fail, ["a"], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import io
+import os
+import shutil
+import threading
+import time
+from offsetbasedgraph import IntervalCollection, DirectedInterval as Interval
+
+from graph_peak_caller.command_line_interface import run_argument_parser, \
+    build_parser
+from graph_peak_caller.server import PeakCallerServer, JobQueue, \
+    submit_job, absolute_path_args, remove_stale_socket
+from graph_peak_caller import resources
+
+SOCKET = "test_server.sock"
+JOBS_DIR = "test_server_jobs"
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        run_argument_parser(["create_ob_graph", "-o", "tests/server_graph.nobg",
+                             "tests/vg_test_graph.json"])
+        IntervalCollection([Interval(1, 1, [1, 2])]).to_file(
+            "tests/server_sample.intervalcollection")
+        self.server = PeakCallerServer(SOCKET, JobQueue(JOBS_DIR, 1))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.jobs.shutdown()
+        self.thread.join()
+        shutil.rmtree(JOBS_DIR)
+        os.remove(SOCKET)
+        for name in ["tests/server_graph.nobg",
+                     "tests/server_graph_linear_map.npz",
+                     "tests/server_sample.intervalcollection"]:
+            if os.path.isfile(name):
+                os.remove(name)
+
+    def _submit(self, job_args):
+        out = io.StringIO()
+        message = submit_job(SOCKET, absolute_path_args(job_args), out)
+        return message, out.getvalue()
+
+    def test_callpeaks_jobs(self):
+        job_args = ["callpeaks", "-g", "tests/server_graph.nobg",
+                    "-s", "tests/server_sample.intervalcollection",
+                    "-n", "out_", "-f", "10", "-r", "7"]
+        message, log = self._submit(job_args)
+        self.assertEqual(message["status"], "done")
+        self.assertEqual(message["exit_code"], 0)
+        self.assertIn("Loading graph", log)
+        self.assertTrue(os.path.isfile(
+            os.path.join(message["out_dir"], "out_max_paths.intervalcollection")))
+
+        message2, log = self._submit(job_args)
+        self.assertNotEqual(message2["out_dir"], message["out_dir"])
+        self.assertEqual(message2["status"], "done")
+        self.assertIn("Using already loaded graph", log)
+
+    def test_failing_job(self):
+        message, log = self._submit(["peaks_to_linear", "missing.intervalcollection",
+                                     "missing.npz", "chr1", "out.bed"])
+        self.assertEqual(message["status"], "failed")
+        self.assertIn("No such file", log)
+
+    def test_rejects_other_commands(self):
+        message, _ = self._submit(["create_ob_graph", "graph.json"])
+        self.assertIn("error", message)
+
+    def test_submit_arguments(self):
+        args = build_parser().parse_args(
+            ["submit", "-s", "x.sock", "callpeaks", "-g", "graph.nobg", "-v", "2"])
+        self.assertEqual(args.socket, "x.sock")
+        self.assertEqual(args.job, ["callpeaks", "-g", "graph.nobg", "-v", "2"])
+        self.assertEqual(absolute_path_args(["-d", "tests/", "out_"]),
+                         ["-d", os.path.abspath("tests") + "/", "out_"])
+
+    def test_does_not_take_over_live_socket(self):
+        self.assertRaises(ValueError, remove_stale_socket, SOCKET)
+        self.assertTrue(os.path.exists(SOCKET))
+
+    def test_prunes_finished_jobs(self):
+        self.server.jobs.max_finished_jobs = 1
+        for _ in range(3):
+            self._submit(["peaks_to_linear", "missing.intervalcollection",
+                          "missing.npz", "chr1", "out.bed"])
+        self.assertLessEqual(len(self.server.jobs._jobs), 2)
+
+
+class TestServerFiles(unittest.TestCase):
+    def setUp(self):
+        self.file_name = "test_server_file.txt"
+        with open(self.file_name, "w") as f:
+            f.write("1")
+
+    def tearDown(self):
+        resources._cache = None
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+    def test_does_not_remove_other_files(self):
+        self.assertRaises(ValueError, remove_stale_socket, self.file_name)
+        self.assertTrue(os.path.isfile(self.file_name))
+
+    def test_drops_changed_files_from_cache(self):
+        resources.enable_cache()
+        resources._load("text", lambda name: open(name).read(),
+                        self.file_name)
+        with open(self.file_name, "w") as f:
+            f.write("2")
+        os.utime(self.file_name, (time.time()+10, time.time()+10))
+        self.assertEqual(resources._load(
+            "text", lambda name: open(name).read(), self.file_name), "2")
+        self.assertEqual(len(resources._cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+import os
+import shutil
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, Block, Interval
+
+from graph_peak_caller import Configuration
+from graph_peak_caller.callpeaks import CallPeaks
+from graph_peak_caller.control.linearmap import LinearMap
+from graph_peak_caller.intervals import Intervals
+from graph_peak_caller.linearprojection import AlignmentArrays
+from graph_peak_caller.peakcollection import PeakCollection
+from graph_peak_caller.reporter import Reporter
+from graph_peak_caller.sharding import ShardedCallPeaks, find_cut_nodes, \
+    get_windows, get_subgraph
+from graph_peak_caller.sparsediffs import SparseValues
+
+
+def create_bubble_graph(n_segments, seed=0):
+    """Chain of cut nodes, with a bubble after every other cut node"""
+    rng = np.random.RandomState(seed)
+    nodes, edges = {}, {}
+    node_id = 1
+    for i in range(n_segments):
+        nodes[node_id] = Block(int(rng.randint(60, 150)))
+        if i % 2:
+            nodes[node_id+1] = Block(int(rng.randint(20, 80)))
+            nodes[node_id+2] = Block(int(rng.randint(20, 80)))
+            edges[node_id] = [node_id+1, node_id+2]
+            edges[node_id+1] = [node_id+3]
+            edges[node_id+2] = [node_id+3]
+            node_id += 3
+        else:
+            edges[node_id] = [node_id+1]
+            node_id += 1
+    nodes[node_id] = Block(100)
+    return Graph(nodes, edges)
+
+
+def create_reads(graph, centers, n_reads, read_length, rng):
+    reads = []
+    node_ids = sorted(graph.blocks.keys())
+    for _ in range(n_reads):
+        if rng.rand() < 0.5:
+            node = node_ids[rng.randint(len(node_ids)-1)]
+        else:
+            node = centers[rng.randint(len(centers))] + rng.randint(-2, 1)
+        offset = rng.randint(graph.node_size(node))
+        rps = [node]
+        end = offset + read_length
+        while end > graph.node_size(rps[-1]):
+            end -= graph.node_size(rps[-1])
+            nexts = graph.adj_list[rps[-1]]
+            rps.append(nexts[rng.randint(len(nexts))])
+        read = Interval(offset, end, rps, graph)
+        if rng.rand() < 0.5:
+            read = read.get_reverse()
+        reads.append(read)
+    return reads
+
+
+class TestWindows(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph({i: Block(10) for i in range(1, 9)},
+                           {1: [2, 3], 2: [4], 3: [4], 4: [5],
+                            5: [6, 7], 6: [8], 7: [8]})
+        self.graph.convert_to_numpy_backend()
+
+    def test_find_cut_nodes(self):
+        np.testing.assert_array_equal(find_cut_nodes(self.graph),
+                                      [1, 4, 5, 8])
+
+    def test_get_windows(self):
+        starts, ends, firsts, lasts = get_windows(self.graph, 30, 10)
+        np.testing.assert_array_equal(starts, [1, 4, 8])
+        np.testing.assert_array_equal(ends, [4, 8, 9])
+        np.testing.assert_array_equal(firsts, [1, 1, 5])
+        np.testing.assert_array_equal(lasts, [4, 8, 8])
+
+    def test_get_subgraph(self):
+        subgraph = get_subgraph(self.graph, 4, 8)
+        self.assertEqual(subgraph.min_node, 4)
+        self.assertEqual(subgraph.node_indexes[-1], 50)
+        self.assertEqual(list(subgraph.adj_list[5]), [6, 7])
+        self.assertEqual(list(subgraph.adj_list[8]), [])
+        self.assertEqual(list(subgraph.reverse_adj_list[-4]), [])
+        self.assertEqual(sorted(subgraph.reverse_adj_list[-8]), [-7, -6])
+
+
+class TestShardedCallPeaks(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        graph = create_bubble_graph(500)
+        linear_map = LinearMap.from_graph(graph)
+        linear_map.to_file("test_sharding_linear_map.npz")
+        centers = [int(c) for c in rng.randint(3, 740, 15)]
+        window_graph = create_bubble_graph(500)
+        window_graph.convert_to_numpy_backend()
+        starts = get_windows(window_graph, 5000, 10000)[0]
+        centers.extend(int(start)+1 for start in starts[1:5])
+        self.sample = create_reads(graph, centers, 3000, 20, rng)
+        graph.convert_to_numpy_backend()
+        self.graph = graph
+        self.config = Configuration()
+        self.config.fragment_length = 100
+        self.config.read_length = 20
+        self.config.has_control = False
+        self.config.linear_map_name = "test_sharding_linear_map.npz"
+        self.config.window_size = 5000
+
+    def tearDown(self):
+        shutil.rmtree("test_sharding_windows")
+        for name in os.listdir("."):
+            if name.startswith("test_sharding"):
+                os.remove(name)
+
+    def _get_reads(self):
+        return Intervals([Interval(read.start_position.offset,
+                                   read.end_position.offset,
+                                   read.region_paths, self.graph)
+                          for read in self.sample])
+
+    def test_same_as_unsharded(self):
+        caller = CallPeaks(self.graph, self.config,
+                           Reporter("test_sharding_whole_"))
+        caller.run(self._get_reads(), self._get_reads())
+        sharded = ShardedCallPeaks(
+            self.graph, self.config, Reporter("test_sharding_"),
+            work_dir="test_sharding_windows")
+        self.assertGreater(sharded.starts.size, 3)
+        sharded.run(self._get_reads(), self._get_reads())
+
+        size = self.graph.node_indexes[-1]
+        np.testing.assert_allclose(
+            SparseValues.from_sparse_files(
+                "test_sharding_pvalues").to_dense_pileup(size),
+            caller.p_values_pileup.to_dense_pileup(size))
+        self.assertGreater(len(caller.max_path_peaks), 5)
+        self.assertEqual(len(sharded.max_path_peaks),
+                         len(caller.max_path_peaks))
+        key = lambda peak: (peak.region_paths, peak.start_position.offset)
+        for peak, true in zip(sorted(sharded.max_path_peaks, key=key),
+                              sorted(caller.max_path_peaks, key=key)):
+            self.assertEqual(peak.region_paths, true.region_paths)
+            self.assertEqual(peak.start_position, true.start_position)
+            self.assertEqual(peak.end_position, true.end_position)
+            self.assertAlmostEqual(peak.score, true.score)
+        all_max_paths, true_all_max_paths = (
+            list(PeakCollection.from_file(
+                name + "all_max_paths.intervalcollection", text_file=True))
+            for name in ["test_sharding_", "test_sharding_whole_"])
+        self.assertEqual(len(all_max_paths), len(true_all_max_paths))
+
+    def test_read_windows(self):
+        sharded = ShardedCallPeaks(
+            self.graph, self.config, Reporter("test_sharding_"),
+            work_dir="test_sharding_windows")
+        alignments = AlignmentArrays.from_intervals(self._get_reads())
+        read_ids, window_ids = sharded._get_read_windows(alignments)
+        true_pairs = []
+        for i, interval in enumerate(alignments.to_intervals()):
+            nodes = [abs(rp) for rp in interval.region_paths]
+            true_pairs.extend(
+                (j, i) for j in range(sharded.starts.size)
+                if sharded.firsts[j] <= min(nodes) and
+                max(nodes) <= sharded.lasts[j])
+        self.assertEqual(list(zip(window_ids, read_ids)), sorted(true_pairs))
+
+    def test_writes_joined_tracks(self):
+        sharded = ShardedCallPeaks(
+            self.graph, self.config, Reporter("test_sharding_"),
+            work_dir="test_sharding_windows")
+        sharded.run(self._get_reads(), self._get_reads())
+        chunked = ShardedCallPeaks(
+            self.graph, self.config,
+            Reporter("test_sharding_chunked_", compact=True, chunked=True),
+            work_dir="test_sharding_windows")
+        chunked.run(self._get_reads(), self._get_reads())
+        size = self.graph.node_indexes[-1]
+        for name in ["pvalues", "qvalues"]:
+            track = SparseValues.from_sparse_files("test_sharding_" + name)
+            self.assertEqual(track.track_size, size)
+            joined = sharded._join_core_tracks(
+                name, np.arange(sharded.starts.size))
+            np.testing.assert_array_equal(track.indices, joined.indices)
+            np.testing.assert_array_equal(track.values, joined.values)
+            chunked_track = SparseValues.from_sparse_files(
+                "test_sharding_chunked_" + name)
+            np.testing.assert_allclose(chunked_track.to_dense_pileup(size),
+                                       track.to_dense_pileup(size),
+                                       rtol=1e-6)
+        self.assertEqual(chunked_track.indices.dtype, np.int32)
+        self.assertEqual(chunked_track.values.dtype, np.float32)
+
+
+if __name__ == "__main__":
+    unittest.main()
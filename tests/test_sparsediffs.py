@@ -1,6 +1,7 @@
 import unittest
 import numpy as np
-from graph_peak_caller.sparsediffs import SparseDiffs, SparseValues
+from graph_peak_caller.sparsediffs import SparseDiffs, SparseValues, \
+    get_merge_args
 
 
 class TestSparseValues(unittest.TestCase):
@@ -17,6 +18,104 @@ class TestSparseValues(unittest.TestCase):
         new = sv.from_sparse_files("test_sparsevalues.tmp")
         self.assertEqual(sv, new)
 
+    def test_compact(self):
+        sv = SparseValues(np.array([0, 3, 5, 9]),
+                          np.array([0.1, 0.1+1e-12, 2.5, 1/3]))
+        sv.track_size = 12
+        compact = sv.compact()
+        self.assertEqual(compact.indices.dtype, np.int32)
+        self.assertEqual(compact.values.dtype, np.float32)
+        self.assertEqual(compact.track_size, 12)
+        # The two first runs are equal as float32
+        np.testing.assert_array_equal(compact.indices, [0, 5, 9])
+        np.testing.assert_allclose(compact.values, [0.1, 2.5, 1/3],
+                                   rtol=1e-7)
+
+    def test_compact_keeps_int64_for_large_tracks(self):
+        sv = SparseValues(np.array([0, 2**31+10]), np.array([1., 2.]))
+        sv.track_size = 2**31+20
+        self.assertEqual(sv.compact().indices.dtype, np.int64)
+
+    def test_threshold_copy_compact(self):
+        # Tracks are thresholded before they are compacted, so values
+        # just below the cutoff stay below it
+        cutoff = -np.log10(0.05)
+        values = np.array([0, cutoff, np.nextafter(cutoff, 0), 4.])
+        sv = SparseValues(np.arange(4), values)
+        sv.track_size = 4
+        np.testing.assert_array_equal(
+            sv.threshold_copy(cutoff).compact().to_dense_pileup(4),
+            sv.threshold_copy(cutoff).to_dense_pileup(4))
+        np.testing.assert_array_equal(
+            sv.threshold_copy(cutoff).to_dense_pileup(4),
+            [False, True, False, True])
+
+    def test_dense_pileup_compact(self):
+        values = np.random.rand(1000)*100
+        sv = SparseValues(np.arange(0, 2000, 2), values)
+        sv.track_size = 2000
+        compact = sv.compact()
+        np.testing.assert_array_equal(
+            compact.to_dense_pileup(2000),
+            np.repeat(values.astype(np.float32), 2))
+
+
+class TestSparseDiffs(unittest.TestCase):
+
+    def test_compact(self):
+        sd = SparseDiffs(np.array([0, 4, 10]), np.array([0.1, 0.2, -0.3]))
+        compact = sd.compact()
+        self.assertEqual(compact._indices.dtype, np.int32)
+        self.assertEqual(compact._diffs.dtype, np.float64)
+        self.assertEqual(compact, sd)
+
+    def _get_unsorted_values(self, indices, diffs):
+        args = np.argsort(indices, kind="mergesort")
+        return SparseValues(indices[args], np.cumsum(diffs[args]),
+                            sanitize=True)
+
+    def test_from_positions(self):
+        positions = np.array([5, 0, 9, 5, 3, 10, 3])
+        weights = np.array([1, 2, -1, -1, 3, -2, -3])
+        true_values = self._get_unsorted_values(positions, weights)
+        for size in [10, 1000]:  # histogram and sorting
+            sd = SparseDiffs.from_positions(positions, weights, size)
+            np.testing.assert_array_equal(sd._indices, [0, 9, 10])
+            np.testing.assert_array_equal(sd._diffs, [2, -1, -2])
+            sparse_values = sd.get_sparse_values()
+            np.testing.assert_array_equal(sparse_values.indices,
+                                          true_values.indices)
+            np.testing.assert_array_equal(sparse_values.values,
+                                          true_values.values)
+
+    def test_from_starts_and_ends(self):
+        starts = np.array([4.5, 1., 7., 1.])
+        starts_ends = np.add.outer(np.array([-2, 2]), starts)
+        sd = SparseDiffs.from_starts_and_ends(starts_ends)
+        self.assertTrue(np.all(np.diff(sd._indices) >= 0))
+        true_values = self._get_unsorted_values(
+            starts_ends.ravel(), np.r_[np.ones(4), -np.ones(4)])
+        sparse_values = sd.get_sparse_values()
+        np.testing.assert_array_equal(sparse_values.indices,
+                                      true_values.indices)
+        np.testing.assert_array_equal(sparse_values.values,
+                                      true_values.values)
+
+    def test_get_merge_args(self):
+        a = np.array([1, 3, 3, 8])
+        b = np.array([0, 3, 8, 9, 10])
+        np.testing.assert_array_equal(
+            get_merge_args(a, b),
+            np.argsort(np.r_[a, b], kind="mergesort"))
+
+    def test_maximum_sorted_and_unsorted(self):
+        a = SparseDiffs(np.array([0, 4, 10]), np.array([1., 2., -3.]))
+        b = SparseDiffs(np.array([2, 4, 6]), np.array([2., -1., 3.]))
+        unsorted = a.maximum(b)
+        a._sorted = True
+        b._sorted = True
+        self.assertEqual(a.maximum(b), unsorted)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
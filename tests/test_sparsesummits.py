@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import offsetbasedgraph as obg
+from graph_peak_caller.peakcollection import Peak, PeakCollection
+from graph_peak_caller.peakarrays import PeakArrays
+from graph_peak_caller.sparsediffs import SparseValues
+from graph_peak_caller.mindense import DensePileup
+from graph_peak_caller.sparsesummits import cut_around_summits,\
+    get_summit_positions
+
+
+class TestSparseSummits(unittest.TestCase):
+    def setUp(self):
+        sizes = [10, 4, 7, 12, 3, 9]
+        self.graph = obg.GraphWithReversals(
+            {i+1: obg.Block(size) for i, size in enumerate(sizes)},
+            {i: [i+1] for i in range(1, len(sizes))})
+        self.graph.convert_to_numpy_backend()
+        np.random.seed(1)
+        size = sum(sizes)
+        indices = np.r_[0, np.sort(np.random.choice(
+            np.arange(1, size), 15, replace=False))]
+        self.qvalues = SparseValues(indices, np.random.randint(0, 4, 16)*1.5)
+        self.qvalues.track_size = size
+        self.dense = DensePileup(
+            self.graph, self.qvalues.to_dense_pileup(size))
+        self.peaks = [Peak(2, 5, [1, 2, 3, 4], graph=self.graph),
+                      Peak(0, 10, [1], graph=self.graph),
+                      Peak(3, 2, [3, 4, 5, 6], graph=self.graph),
+                      Peak(1, 3, [2, 3, 4], graph=self.graph),
+                      Peak(1, 4, [-4, -3], graph=self.graph)]
+
+    def test_summit_positions(self):
+        positions, lengths = get_summit_positions(
+            PeakArrays.from_peaks(self.peaks), self.qvalues, self.graph)
+        for peak, position, length in zip(self.peaks, positions, lengths):
+            values = self.dense.get_interval_values(peak)
+            max_positions = np.flatnonzero(values == np.max(values))
+            self.assertEqual(position, max_positions[max_positions.size//2])
+            self.assertEqual(length, peak.length())
+
+    def test_cut_around_summits(self):
+        for window in (1, 3, 60):
+            summits = cut_around_summits(PeakArrays.from_peaks(self.peaks),
+                                         self.qvalues, self.graph, window)
+            collection = PeakCollection(
+                [Peak(p.start_position, p.end_position, p.region_paths,
+                      graph=self.graph) for p in self.peaks])
+            collection.cut_around_summit(self.dense, window)
+            self.assertEqual(list(summits), collection.intervals)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, Block
+
+from graph_peak_caller.touchednodes import TouchedNodes, as_touched_nodes,\
+    read_touched_nodes
+from graph_peak_caller.postprocess.holecleaner import HolesCleaner
+from graph_peak_caller.postprocess.graphs import get_edges
+from graph_peak_caller.reporter import Reporter
+from graph_peak_caller.sparsediffs import SparseValues
+
+
+class TestTouchedNodes(unittest.TestCase):
+    def setUp(self):
+        self.touched = TouchedNodes.from_node_ids([11, 13, 14], 10, 6)
+
+    def test_membership(self):
+        for node_id in [11, 13, 14]:
+            self.assertIn(node_id, self.touched)
+        for node_id in [-11, 0, 10, 12, 15, 16, 100]:
+            self.assertNotIn(node_id, self.touched)
+        self.assertEqual(len(self.touched), 3)
+        self.assertEqual(list(self.touched), [11, 13, 14])
+        self.assertEqual(self.touched, {11, 13, 14})
+
+    def test_contains(self):
+        node_ids = np.array([9, 10, 11, -11, 13, 14, 15, 16, 17])
+        np.testing.assert_array_equal(
+            self.touched.contains(node_ids),
+            [node_id in {11, 13, 14} for node_id in node_ids])
+
+    def test_to_from_file(self):
+        self.touched.to_file("test_touched.npz")
+        new = TouchedNodes.from_file("test_touched.npz")
+        os.remove("test_touched.npz")
+        np.testing.assert_array_equal(new._mask, self.touched._mask)
+        self.assertEqual(new._min_node, 10)
+
+    def test_reporter_and_legacy_files(self):
+        Reporter("test_touched_").add("touched_nodes", {3, 5})
+        self.assertEqual(read_touched_nodes("test_touched_"), {3, 5})
+        os.remove("test_touched_touched_nodes.npz")
+        np.save("test_touched_touched_nodes.npy", np.array([3, 7]))
+        self.assertEqual(read_touched_nodes("test_touched_"), {3, 7})
+        os.remove("test_touched_touched_nodes.npy")
+
+
+class TestVectorizedFilters(unittest.TestCase):
+    def setUp(self):
+        nodes = {i: Block(10) for i in range(101, 107)}
+        edges = {101: [102], 102: [103, 104], 103: [105],
+                 104: [105], 105: [106]}
+        self.graph = Graph(nodes, edges)
+        self.graph.convert_to_numpy_backend()
+
+    def test_get_edges(self):
+        idxs, adjs = get_edges(self.graph.adj_list, [102, 106, 1, 105])
+        np.testing.assert_array_equal(idxs, [0, 0, 3])
+        np.testing.assert_array_equal(adjs, [103, 104, 106])
+
+    def test_get_edges_dict_backend(self):
+        nodes = {i: Block(10) for i in range(101, 107)}
+        graph = Graph(nodes, {101: [102], 102: [103, 104]})
+        idxs, adjs = get_edges(graph.reverse_adj_list, [-104, -101, -102])
+        np.testing.assert_array_equal(idxs, [0, 2])
+        np.testing.assert_array_equal(adjs, [-102, -101])
+
+    def test_holes_cleaner_with_bitmap(self):
+        touched_nodes = TouchedNodes.from_node_ids(
+            [101, 102, 103, 104, 105, 106], 101, 6)
+        pileup = SparseValues([0, 4, 22, 28, 56],
+                              [1, 0, 1, 0, 1])
+        cleaned = HolesCleaner(self.graph, pileup, 20, touched_nodes).run()
+        true = SparseValues([0, 30, 40], [1, 0, 1])
+        self.assertEqual(cleaned, true)
+
+    def test_holes_cleaner_keeps_untouched(self):
+        touched_nodes = TouchedNodes.from_node_ids([101, 103, 106], 101, 6)
+        pileup = SparseValues([0, 4, 22, 28, 56],
+                              [1, 0, 1, 0, 1])
+        cleaned = HolesCleaner(self.graph, pileup, 4, touched_nodes).run()
+        self.assertEqual(cleaned, pileup)
+
+
+if __name__ == "__main__":
+    unittest.main()
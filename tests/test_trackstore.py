@@ -0,0 +1,99 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from offsetbasedgraph import GraphWithReversals as Graph, Block
+from graph_peak_caller.sparsediffs import SparseValues, SparseDiffs
+from graph_peak_caller.sparsepvalues import PToQValuesMapper
+from graph_peak_caller.peakcollection import Peak
+from graph_peak_caller.peakarrays import PeakArrays
+from graph_peak_caller.trackstore import ChunkedTrack, ChunkedTrackWriter, \
+    write_chunked_track
+
+
+class TestChunkedTrack(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base_name = os.path.join(self.dir, "track")
+        rng = np.random.RandomState(1)
+        self.track_size = 1000
+        indices = np.r_[0, np.sort(rng.choice(np.arange(1, self.track_size),
+                                              100, replace=False))]
+        self.sparse_values = SparseValues(indices, rng.rand(indices.size))
+        self.sparse_values.track_size = self.track_size
+        self.dense = self.sparse_values.to_dense_pileup(self.track_size)
+        write_chunked_track(self.base_name, self.sparse_values, chunk_size=64)
+        self.track = ChunkedTrack.from_base_name(self.base_name)
+
+    def tearDown(self):
+        self.track.close()
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.assertEqual(self.track.to_sparse_values(), self.sparse_values)
+        self.assertEqual(SparseValues.from_sparse_files(self.base_name),
+                         self.sparse_values)
+
+    def test_ranges(self):
+        for start, end in [(0, 1000), (0, 64), (63, 65), (100, 300),
+                           (999, 1000), (500, 500)]:
+            np.testing.assert_array_equal(self.track.get_dense(start, end),
+                                          self.dense[start:end])
+
+    def test_only_reads_needed_chunks(self):
+        self.track.get_dense(130, 190)
+        self.assertEqual(sorted(self.track._cache), [2])
+
+    def test_peak_values(self):
+        graph = Graph({i: Block(100) for i in range(1, 11)},
+                      {i: [i+1] for i in range(1, 10)})
+        graph.convert_to_numpy_backend()
+        peaks = [Peak(10, 20, [1, 2, 3], graph=graph),
+                 Peak(30, 90, [-7, -6], graph=graph),
+                 Peak(0, 100, [10], graph=graph)]
+        values = self.track.get_peak_values(PeakArrays.from_peaks(peaks), graph)
+        for peak, peak_values in zip(peaks, values):
+            self.assertEqual(peak_values.size, peak.length())
+        np.testing.assert_array_equal(values[0], self.dense[10:220])
+        np.testing.assert_array_equal(values[1], self.dense[510:670])
+        np.testing.assert_array_equal(
+            self.track.get_node_range_values(graph, 2, 3), self.dense[100:300])
+
+    def test_writer_equals_write_chunked_track(self):
+        base_name = self.base_name + "_parts"
+        with ChunkedTrackWriter(base_name, self.track_size,
+                                chunk_size=64) as writer:
+            for start, end in [(0, 10), (10, 200), (200, 201), (201, 1000)]:
+                writer.add(self.track.get_sparse_values(start, end), start)
+        with ChunkedTrack.from_base_name(base_name) as track:
+            self.assertEqual(track.n_chunks, self.track.n_chunks)
+            np.testing.assert_array_equal(track._first_values,
+                                          self.track._first_values)
+            np.testing.assert_array_equal(
+                track.to_sparse_values().to_dense_pileup(self.track_size),
+                self.dense)
+
+    def test_sparse_diffs_chunked(self):
+        diffs = SparseDiffs(np.array([0, 5, 10]), np.array([1.0, 2.0, -3.0]))
+        diffs.track_size = 20
+        diffs.to_sparse_files(self.base_name + "2", chunked=True)
+        true_values = diffs.get_sparse_values()
+        true_values.track_size = 20
+        self.assertEqual(SparseDiffs.from_sparse_files(self.base_name + "2"),
+                         true_values)
+
+    def test_p_to_q_values_from_chunked_files(self):
+        self.sparse_values.to_sparse_files(
+            os.path.join(self.dir, "a_pvalues"), chunked=True)
+        self.sparse_values.to_sparse_files(
+            os.path.join(self.dir, "b_pvalues"))
+        mapper = PToQValuesMapper.from_files(os.path.join(self.dir, ""))
+        true_mapper = PToQValuesMapper.from_p_values_files(
+            [os.path.join(self.dir, name) for name in ["a_pvalues", "b_pvalues"]])
+        np.testing.assert_array_equal(mapper.cum_counts, true_mapper.cum_counts)
+        self.assertEqual(mapper.cum_counts[-1], 2*self.track_size)
+
+
+if __name__ == "__main__":
+    unittest.main()